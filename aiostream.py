@@ -0,0 +1,275 @@
+# Потоковая передача gcode на asyncio
+# Один цикл событий вместо основного цикла с блокирующим чтением, потока запросов состояния и потока GUI:
+# порт читается по готовности дескриптора, отправка ждёт освобождения буфера GRBL,
+# запросы состояния и прочие периодические действия - обычные таймеры asyncio.
+# В порт пишет только цикл событий, realtime-команды встают в начало очереди отправки.
+
+import asyncio
+import collections
+import os
+import time
+
+from grblio import StatusParser, classify_line
+
+
+class AsyncGrbl:
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.loop = asyncio.get_running_loop()
+        self.acks = asyncio.Queue()         # 0 - 'ok', N - 'error:N'
+        self.status = asyncio.Queue()       # GrblStatus из '<Idle|WPos:...>'
+        self.alarms = asyncio.Queue()       # N из 'ALARM:N'
+        self.messages = asyncio.Queue()     # Прочие строки
+        self.queues = {'ack': self.acks, 'status': self.status, 'alarm': self.alarms, 'message': self.messages}
+        self.parser = StatusParser()
+        self.trace = None                   # StreamTrace: время прихода подтверждений и отчётов
+        self._tail = b''
+        self._out = bytearray()             # Очередь отправки, если порт не принял всё сразу
+        self.hold_latency = []              # Задержка записи '!' в порт от вызова write_realtime(), сек
+        self.writes = 0                     # Записей блоков в порт (пакетов)
+        self.bytes_written = 0
+        self._hold_times = []               # Время вызова для '!', оставшихся в очереди отправки
+        self._fd = ser.fileno() if os.name == 'posix' else None
+        if self._fd is not None:
+            self.loop.add_reader(self._fd, self._on_readable)
+            self._poll_task = None
+        else:
+            # Windows: add_reader недоступен, чтение в пуле потоков
+            self._poll_task = self.loop.create_task(self._poll())
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        self._feed(data)
+
+    async def _poll(self):
+        while True:
+            data = await self.loop.run_in_executor(None, lambda: self.ser.read(self.ser.in_waiting or 1))
+            self._feed(data)
+
+    def _feed(self, data):
+        if not data:
+            return
+        lines = (self._tail + data).split(b'\n')
+        self._tail = lines.pop()
+        for line in lines:
+            kind, value = classify_line(line.strip())
+            if kind == 'status':
+                value = self.parser.parse(value)
+            if kind:
+                if self.trace is not None:
+                    self.trace.reply(kind, value)
+                self.queues[kind].put_nowait(value)
+
+    # Отправка без блокировки: остаток, не принятый портом, дописывается по готовности дескриптора
+    def write(self, data):
+        self._write(data, True)
+
+    def _write(self, data, count):
+        if self._fd is None:
+            self.ser.write(data)
+            sent = len(data)
+        elif self._out:
+            self._out += data
+            return
+        else:
+            try:
+                sent = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+        if count and sent:
+            self.writes += 1
+            self.bytes_written += sent
+        if sent < len(data):
+            self._out += data[sent:]
+            self.loop.add_writer(self._fd, self._on_writable)
+
+    # Realtime-команды ('?', '!', '~', 0x18, 0x90-0x9D) отправляются раньше очереди блоков
+    def write_realtime(self, data):
+        start = time.perf_counter()
+        if self._out:
+            self._out[0:0] = data
+        else:
+            self._write(data, False)
+        if b'!' in data:
+            if self._out:
+                self._hold_times.append(start)  # Время записи - по опустошению очереди (оценка сверху)
+            else:
+                self.hold_latency.append(time.perf_counter() - start)
+
+    def _on_writable(self):
+        try:
+            sent = os.write(self._fd, self._out)
+        except (BlockingIOError, InterruptedError):
+            return
+        del self._out[:sent]
+        self.writes += 1
+        self.bytes_written += sent
+        if not self._out:
+            self.loop.remove_writer(self._fd)
+            now = time.perf_counter()
+            self.hold_latency += [now - start for start in self._hold_times]
+            self._hold_times.clear()
+
+    def close(self):
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            if self._out:
+                self.loop.remove_writer(self._fd)
+        elif self._poll_task:
+            self._poll_task.cancel()
+
+
+class AsyncStreamer:
+
+    # on_block(i) - подготовка блока, False - остановить цикл перед блоком
+    # on_status(status), on_error(code, i), on_alarm(code), on_message(text) - обработчики ответов GRBL
+    # on_ack(code, i) - ответ на блок плана
+    # interval() - текущая периодичность запросов состояния, сек
+    # trace - StreamTrace для записи отправок (None - без трассировки)
+    def __init__(self, grbl, plan, rx_size=128, simple=False, interval=lambda: 1.0,
+                 on_block=None, on_status=None, on_error=None, on_alarm=None, on_message=None, on_ack=None,
+                 trace=None):
+        self.grbl = grbl
+        self.plan = plan
+        self.rx_size = rx_size
+        self.simple = simple
+        self.interval = interval
+        self.on_block = on_block or (lambda i: True)
+        self.on_status = on_status or (lambda state: None)
+        self.on_error = on_error or (lambda code, i: None)
+        self.on_alarm = on_alarm or (lambda code: None)
+        self.on_message = on_message or (lambda text: None)
+        self.on_ack = on_ack or (lambda code, i: None)
+        self.trace = trace
+        self.inflight = collections.deque()     # (индекс блока или -1 для команд, длина)
+        self.c_sum = 0                          # Байт в приёмном буфере GRBL
+        self.last_code = 0
+        self.last_status = None                 # Последний GrblStatus
+        self._acked = asyncio.Event()
+        self._status_event = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(coro) for coro in
+                       (self.receive(), self.poll_status(), self.receive_status(), self.receive_other())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.grbl.close()
+
+    # Приём подтверждений: освобождение места в буфере GRBL
+    async def receive(self):
+        while True:
+            code = await self.grbl.acks.get()
+            index, length = self.inflight.popleft()
+            self.c_sum -= length
+            self.last_code = code
+            if index >= 0:
+                self.on_ack(code, index)
+                if code:
+                    self.on_error(code, index)
+            self._acked.set()
+
+    async def poll_status(self):
+        while True:
+            self.grbl.write_realtime(b'?')
+            await asyncio.sleep(self.interval())
+
+    async def receive_status(self):
+        while True:
+            status = await self.grbl.status.get()
+            self.last_status = status
+            self._status_event.set()
+            self.on_status(status)
+
+    async def receive_other(self):
+        alarms = asyncio.create_task(self.grbl.alarms.get())
+        messages = asyncio.create_task(self.grbl.messages.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait((alarms, messages), return_when=asyncio.FIRST_COMPLETED)
+                if alarms in done:
+                    self.on_alarm(alarms.result())
+                    alarms = asyncio.create_task(self.grbl.alarms.get())
+                if messages in done:
+                    self.on_message(messages.result())
+                    messages = asyncio.create_task(self.grbl.messages.get())
+        finally:
+            alarms.cancel()
+            messages.cancel()
+
+    # Ожидание, пока в буфере GRBL не останется limit байт и меньше
+    async def _wait_space(self, limit):
+        while self.inflight and self.c_sum > limit:
+            self._acked.clear()
+            await self._acked.wait()
+
+    def _send(self, index, data):
+        self.inflight.append((index, len(data)))
+        self.c_sum += len(data)
+        if self.trace is not None:
+            self.trace.send(index, self.c_sum, len(data))
+        self.grbl.write(data)
+
+    # Отправка одного цикла по плану с блока start, возвращает индекс блока, на котором цикл закончен
+    # Блоки, помещающиеся в свободное место буфера, записываются в порт одной записью (срез plan.wire)
+    async def stream_cycle(self, start=0):
+        plan = self.plan
+        offsets, lengths = plan.offsets, plan.lengths
+        first = start   # Первый блок, ещё не записанный в порт
+        for i in range(start, len(plan)):
+            if not self.on_block(i):
+                self._send_blocks(first, i)
+                await self._wait_space(0)
+                return i
+            if self.simple:
+                await self._wait_space(0)
+                self._send(i, plan.block(i))
+                first = i + 1
+                continue
+            # Блок помещается в буфер, если вместе с ним и накопленными блоками занято меньше rx_size-1 байт
+            limit = self.rx_size - 2 - lengths[i]
+            if self.c_sum + offsets[i] - offsets[first] > limit:
+                self._send_blocks(first, i)
+                first = i
+                await self._wait_space(limit)
+        self._send_blocks(first, len(plan))
+        await self._wait_space(0)
+        return len(plan)
+
+    # Запись блоков first..end (не включая end) одним срезом plan.wire
+    def _send_blocks(self, first, end):
+        if end <= first:
+            return
+        plan = self.plan
+        trace = self.trace
+        for i in range(first, end):
+            length = plan.lengths[i]
+            self.inflight.append((i, length))
+            self.c_sum += length
+            if trace is not None:
+                trace.send(i, self.c_sum, length)
+        offset = plan.offsets[first]
+        self.grbl.write(memoryview(plan.wire)[offset:plan.offsets[end-1] + plan.lengths[end-1]])
+
+    # Команды вне плана (G90, $H): ожидание подтверждения всех команд, код последнего ответа
+    async def command(self, *blocks):
+        await self._wait_space(0)
+        for data in blocks:
+            self._send(-1, data)
+        await self._wait_space(0)
+        return self.last_code
+
+    # Ожидание отчёта о состоянии, удовлетворяющего условию
+    async def wait_status(self, predicate):
+        while True:
+            self._status_event.clear()
+            await self._status_event.wait()
+            if predicate(self.last_status):
+                return self.last_status
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Микро-тест скорости разбора gcode: прежняя data_from_gcode() против tokenize() + ModalState.step()
+# Перед замером - проверка ModalState.step() на строках с модальными словами после осей, G92, G28 и т.п.
+# Пример: python bench_gcode.py test.gcode -m 1 4 16
+
+import argparse
+import re
+import time
+
+from gcode import ModalState, tokenize
+
+
+# Прежняя функция из stream.py (для сравнения)
+def data_from_gcode(line):
+    if ('G1' in line.upper() or 'G0' in line.upper()) and 'X' in line.upper():
+        x_move = re.search(r'X(-?)(\d+)(\.?)(\d*)', line.upper()).group()    # 'X-28.731'
+        x_move = float(x_move[1:])
+    else: x_move = 0
+    if ('G1' in line.upper() or 'G0' in line.upper()) and 'Y' in line.upper():
+        y_move = re.search(r'Y(-?)(\d+)(\.?)(\d*)', line.upper()).group()    # 'Y10'
+        y_move = float(y_move[1:])
+    else: y_move = 0
+    xy_move = (x_move**2 + y_move**2)**0.5
+    if 'G1' in line.upper() and 'S' in line.upper():
+        s = re.search(r'S(\d+)', line.upper()).group()    # 'S800'
+        s_power = int(s[1:])
+        s_move = s_power * xy_move
+    else:
+        s_move = 0
+        s_power = 0
+    if 'G1' in line.upper() and 'F' in line.upper():
+        f_speed = re.search(r'F(\d+)', line.upper()).group()    # 'F2000'
+        f_speed = int(f_speed[1:])
+    else:
+        f_speed = None
+    return x_move, y_move, xy_move, f_speed, s_power, s_move
+
+
+# Строки, ожидаемая позиция после них (None - неизвестна по файлу), dx и длина последней строки
+CASES = [
+    (['G0 X1 G20'], [25.4, 0.0, 0.0], 25.4, 25.4),
+    (['G0 X1 G20', 'G21 X1'], [1.0, 0.0, 0.0], -24.4, 24.4),
+    (['G0 X10', 'X1 G91'], [11.0, 0.0, 0.0], 1.0, 1.0),
+    (['G91 G0 X10', 'X1 G90'], [1.0, 0.0, 0.0], -9.0, 9.0),
+    (['G1 X10 F100 G20'], [254.0, 0.0, 0.0], 254.0, 254.0),
+    (['G90 G0 X50', 'G92 X0', 'G0 X10'], [10.0, 0.0, 0.0], 10.0, 10.0),
+    (['G0 X50', 'G92 X0', 'G92.1'], [50.0, 0.0, 0.0], 0.0, 0.0),
+    (['G0 X5 Y5', 'G28'], [None, None, None], 0.0, 0.0),
+    (['G0 X5 Y5', 'G30 X1'], [None, None, None], 0.0, 0.0),
+    (['G28', 'G91 G1 X1 F100'], [None, None, None], 0.0, 0.0),
+    (['G28', 'G0 X1 Y2'], [1.0, 2.0, None], 0.0, 0.0),
+    (['G28', 'G0 X1 Y2', 'G1 X4 Y6 F100'], [4.0, 6.0, None], 3.0, 5.0),
+    (['G0 X5 Y5', 'G28.1'], [5.0, 5.0, 0.0], 0.0, 0.0),
+    (['G0 X5', 'G53 G0 X0'], [None, 0.0, 0.0], 0.0, 0.0),
+    (['G0 X5', 'G55'], [None, None, None], 0.0, 0.0),
+    (['G0 X5', 'G10 L20 P0 X0'], [0.0, 0.0, 0.0], 0.0, 0.0),
+]
+
+
+# Несовпадения с ожидаемым: [(строки, позиция, dx, длина)]
+def check_cases():
+    errors = []
+    for lines, position, dx, length in CASES:
+        state = ModalState()
+        for line in lines:
+            block = state.step(tokenize(line))
+        same = all(a is b if a is None or b is None else abs(a - b) < 1e-9 for a, b in zip(state.position, position))
+        if not same or abs(block.dx - dx) > 1e-9 or abs(block.length - length) > 1e-9:
+            errors.append((lines, state.position, block.dx, block.length))
+    return errors
+
+
+def run_legacy(lines):
+    for line in lines:
+        data_from_gcode(line)
+
+def run_tokenizer(lines):
+    state = ModalState()
+    for line in lines:
+        state.step(tokenize(line))
+
+# Строки исходного файла, повторённые до размера не меньше size_mb
+def scaled_lines(lines, size_mb):
+    size = sum(len(line) for line in lines)
+    repeats = max(1, int(size_mb * 1024 * 1024 / size + 0.5))
+    return lines * repeats
+
+def measure(func, lines):
+    start = time.perf_counter()
+    func(lines)
+    return len(lines) / (time.perf_counter() - start)
+
+
+parser = argparse.ArgumentParser(description='G-code parser benchmark')
+parser.add_argument('gcode_file', type=argparse.FileType('r'), help='g-code file')
+parser.add_argument('-m', '--megabytes', type=float, nargs='+', default=[1, 4, 16], help='scaled file sizes, MB')
+args = parser.parse_args()
+
+errors = check_cases()
+for lines, position, dx, length in errors:
+    print(f"Ошибка разбора {' / '.join(lines)}: позиция {position}, dx {dx:g}, длина {length:g}")
+print(f"Проверка разбора: {len(CASES) - len(errors)} из {len(CASES)}")
+
+source = args.gcode_file.readlines()
+args.gcode_file.close()
+
+print(f"{'МБ':>6} {'строк':>10} {'data_from_gcode':>16} {'tokenize+step':>14} {'ускорение':>10}")
+for size_mb in args.megabytes:
+    lines = scaled_lines(source, size_mb)
+    legacy = measure(run_legacy, lines)
+    tokenizer = measure(run_tokenizer, lines)
+    print(f"{size_mb:>6g} {len(lines):>10} {int(legacy):>12} с/с {int(tokenizer):>10} с/с {tokenizer/legacy:>9.2f}x")
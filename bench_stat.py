@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Проверка общей статистики при одновременной записи: несколько процессов, в каждом несколько потоков
+# со своим StatStore (отдельное соединение SQLite) дописывают циклы в один stat.txt и обновляют один stat.db.
+# После записи индекс сравнивается с индексом, построенным заново по журналу: каждая строка учтена ровно один раз.
+# Пример: python bench_stat.py -p 4 -t 2 -n 200
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from statstore import StatStore
+
+
+# Циклы одного потока: своё соединение с индексом, строки с разными операторами и файлами gcode
+def writer(path, process, thread, cycles, times):
+    store = StatStore(path)
+    start = time.perf_counter()
+    for n in range(cycles):
+        t = 1700000000 + n * 100
+        store.append(f'{t} {t + 60} part{n % 3}.gcode {n % 5 + 1} 100 200 {process * 10 + thread} OP{process}_{thread}')
+    times.append((time.perf_counter() - start) / cycles)
+    store.close()
+
+
+def process_main(path, process, threads, cycles, result):
+    times = []
+    workers = [threading.Thread(target=writer, args=(path, process, thread, cycles, times)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result.put(times)
+
+
+# Итоги и серии индекса
+def snapshot(store):
+    return store.totals(), store.db.execute('SELECT * FROM series ORDER BY operator').fetchall()
+
+
+parser = argparse.ArgumentParser(description='Concurrent statistics writers check')
+parser.add_argument('-p', '--processes', type=int, default=4, help='writer processes')
+parser.add_argument('-t', '--threads', type=int, default=2, help='StatStore instances (threads) per process')
+parser.add_argument('-n', '--cycles', type=int, default=200, help='cycles appended by each instance')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'stat.txt')
+    StatStore(path).close()
+    result = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=process_main, args=(path, p, args.threads, args.cycles, result))
+                 for p in range(args.processes)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    times = [t for _ in processes for t in result.get()]
+    for process in processes:
+        process.join()
+    duration = time.perf_counter() - start
+
+    with open(path) as file:
+        lines = file.read().splitlines()
+    expected = args.processes * args.threads * args.cycles
+    store = StatStore(path)
+    rebuilt = StatStore(path, os.path.join(directory, 'rebuilt.db'))
+    same = snapshot(store) == snapshot(rebuilt)
+    store.close()
+    rebuilt.close()
+
+print(f"Запись: {args.processes} процессов x {args.threads} StatStore, {args.cycles} циклов каждый, "
+      f"{duration:.2f} сек, {sum(times) / len(times) * 1000:.2f} мс на запись")
+print(f"Строк журнала: {len(lines)} из {expected}, повреждённых: {sum(1 for line in lines if len(line.split()) != 8)}")
+print(f"Индекс совпадает с построенным заново: {'да' if same else 'НЕТ'}")
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+# Тест производительности потоковой передачи на имитаторе GRBL (grblsim.py)
+# Режимы simple, aggressive (подсчёт символов), asyncio и planner на наборе нагрузок: test.gcode,
+# длинные векторные контуры и плотная растровая гравировка из тысяч коротких G1.
+# Результаты: строк/сек, байт/сек, задержка подтверждений (перцентили), опустошения планировщика,
+# процессорное время на строку. Сохраняются в JSON для сравнения запусков.
+# С --machines N каждый режим передаёт план одновременно на N имитаторов (asyncio - в одном цикле событий,
+# simple/aggressive - поток на станок), скорость передачи не должна падать с ростом числа станков.
+# С --compact каждая нагрузка передаётся также сжатым планом: сокращение байт и блоков, прирост строк файла/сек.
+# planner - как stream.py -b: подсчёт символов с размером приёмного буфера по Bf: в отчёте о состоянии,
+# запросы состояния раз в 0.2 сек, пока планировщик опустел больше чем наполовину;
+# опустошения планировщика сравниваются с aggressive (128 байт); размер буфера имитатора - --rx.
+# Пример: python benchmark.py --latency 0.02 -o bench_bt.json
+#         python benchmark.py -m asyncio -n 4
+#         python benchmark.py -w raster --packet-time 0.005 --compact
+#         python benchmark.py -m aggressive planner --rx 256 --latency 0.02
+
+import argparse
+import ast
+import asyncio
+import json
+import math
+import os
+import platform
+import queue
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import serial
+
+from aiostream import AsyncGrbl, AsyncStreamer
+from cycleplan import compact_plan, compile_plan
+from grblio import GrblReader, Streamer, Transmitter
+
+BAUD_RATE = 115200
+RX_BUFFER_SIZE = 128
+REPORT_INTERVAL = 1.0
+REPORT_INTERVAL_MIN = 0.2   # Запросы состояния при опустошении планировщика (режим planner, как stream.py -b)
+PATH_SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grblsim.py')
+
+
+# --------------------- Нагрузки ------------------------------------
+
+# Векторный контур: спираль из отрезков ~step мм в абсолютных координатах
+def vector_gcode(lines, step=2.0):
+    out = ['G21 G90', 'G0 X100 Y100', 'M4', 'G1 F6000 S600']
+    angle = 0.0
+    for _ in range(lines):
+        radius = 5 + 2 * angle
+        angle += step / max(radius, 1.0)
+        out.append(f'G1 X{100 + radius*math.cos(angle):.3f}Y{100 + radius*math.sin(angle):.3f}')
+    out += ['M5', 'G0 X100 Y100']
+    return '\n'.join(out) + '\n'
+
+# Растровая гравировка: строки по 0.1 мм из коротких отрезков с переключением мощности (как LightBurn, G91)
+def raster_gcode(lines, width=40.0, seed=1):
+    rnd = random.Random(seed)
+    out = ['G21 G90', 'G0 X100 Y42.5', 'M4', 'G91', 'G1 F20000 S0']
+    direction = 1
+    count = 0
+    while count < lines:
+        x = 0.0
+        power = 0
+        while x < width and count < lines:
+            segment = round(rnd.uniform(0.1, 0.6), 3)
+            power = 800 if power == 0 else 0
+            out.append(f'G1 X{direction*segment:g}S{power}')
+            x += segment
+            count += 1
+        out.append('G1 Y0.1S0')
+        direction = -direction
+        count += 1
+    out += ['G90', 'M5']
+    return '\n'.join(out) + '\n'
+
+def workloads(directory, scale, gcode_file):
+    files = {}
+    if gcode_file:
+        files['test.gcode'] = gcode_file
+    for name, text in (('vector', vector_gcode(int(3000*scale))), ('raster', raster_gcode(int(6000*scale)))):
+        path = os.path.join(directory, f'{name}.gcode')
+        with open(path, 'w') as file:
+            file.write(text)
+        files[name] = path
+    return files
+
+
+# --------------------- Измерения ------------------------------------
+
+# Очереди подтверждений с отметкой времени прихода
+class TimedQueue(queue.Queue):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def put(self, item, block=True, timeout=None):
+        self.times.append(time.perf_counter())
+        super().put(item, block, timeout)
+
+# Очередь отчётов о состоянии с последним отчётом (частота запросов в режиме planner)
+class StatusQueue(queue.Queue):
+    def __init__(self):
+        super().__init__()
+        self.last = None
+
+    def put(self, item, block=True, timeout=None):
+        self.last = item
+        super().put(item, block, timeout)
+
+class TimedAsyncQueue(asyncio.Queue):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def put_nowait(self, item):
+        self.times.append(time.perf_counter())
+        super().put_nowait(item)
+
+# Порт с отметкой времени отправки каждого блока (в одной записи может быть несколько блоков)
+class TimedSerial:
+    def __init__(self, ser):
+        self.ser = ser
+        self.times = []
+
+    def write(self, data):
+        self.times += [time.perf_counter()] * bytes(data).count(b'\n')
+        return self.ser.write(data)
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# --------------------- Имитатор ------------------------------------
+
+def start_sim(args):
+    command = [sys.executable, '-u', PATH_SIM, '--baud', str(args.baud), '--latency', str(args.latency),
+               '--speedup', str(args.speedup), '--planner', str(args.planner_size), '--packet-time', str(args.packet_time),
+               '--rx', str(args.rx)]
+    sim = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    port = sim.stdout.readline().split()[2]
+    return sim, port
+
+def stop_sim(sim):
+    sim.send_signal(signal.SIGINT)
+    output, _ = sim.communicate(timeout=10)
+    lines = [line for line in output.splitlines() if line.startswith('{')]
+    return ast.literal_eval(lines[-1]) if lines else {}
+
+def open_grbl(port):
+    ser = serial.Serial(port, BAUD_RATE, timeout=5, write_timeout=0)
+    ser.readline()
+    ser.write(b"\x18")
+    time.sleep(0.5)
+    ser.reset_input_buffer()
+    return ser
+
+
+# --------------------- Режимы ------------------------------------
+
+def run_threaded(port, plan, simple, planner=False):
+    ser = open_grbl(port)
+    reader = GrblReader(ser)
+    reader.acks = reader.queues['ack'] = TimedQueue()
+    reader.status = reader.queues['status'] = StatusQueue()
+    reader.start()
+    tx = Transmitter(ser)
+    timed = TimedSerial(tx)
+    running = True
+
+    # Размеры планировщика и приёмного буфера по Bf: в отчёте о состоянии (stream.py -b)
+    rx_size = RX_BUFFER_SIZE
+    planner_size = 0
+    if planner:
+        tx.realtime(b'?')
+        status = reader.status.get(timeout=5)
+        if status.rx_free is not None:
+            planner_size, rx_size = status.planner_free, status.rx_free
+
+    # В режиме planner запросы чаще, когда планировщик опустел больше чем наполовину
+    def status_request():
+        while running:
+            tx.realtime(b'?')
+            last = reader.status.last
+            hungry = (planner_size and last and last.planner_free is not None
+                      and last.planner_free > planner_size // 2)
+            time.sleep(REPORT_INTERVAL_MIN if hungry else REPORT_INTERVAL)
+    threading.Thread(target=status_request, daemon=True).start()
+
+    start = time.perf_counter()
+    Streamer(timed, reader, plan, rx_size, simple=simple).stream_cycle()
+    stream_time = time.perf_counter() - start
+
+    # Ожидание завершения перемещений
+    while True:
+        if reader.status.get().state == 'Idle':
+            break
+    cycle_time = time.perf_counter() - start
+    running = False
+    reader.stop()
+    tx.stop()
+    ser.close()
+    return timed.times, reader.acks.times, (tx.writes, tx.bytes_written), stream_time, cycle_time, rx_size
+
+# Станки в отдельных потоках
+def run_threads(ports, plan, simple, planner=False):
+    results = [None] * len(ports)
+
+    def machine(k):
+        results[k] = run_threaded(ports[k], plan, simple, planner)
+    threads = [threading.Thread(target=machine, args=(k,)) for k in range(len(ports))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+# Станки в одном цикле событий
+def run_async(ports, plan, simple):
+    sers = [open_grbl(port) for port in ports]
+
+    async def machine(ser):
+        grbl = AsyncGrbl(ser)
+        grbl.acks = grbl.queues['ack'] = TimedAsyncQueue()
+        sends = []
+        write = grbl.write
+
+        def timed_write(data):
+            sends.extend([time.perf_counter()] * bytes(data).count(b'\n'))
+            write(data)
+        grbl.write = timed_write
+        streamer = AsyncStreamer(grbl, plan, simple=simple, interval=lambda: REPORT_INTERVAL)
+        streamer.start()
+        start = time.perf_counter()
+        await streamer.stream_cycle()
+        stream_time = time.perf_counter() - start
+        await streamer.wait_status(lambda status: status.state == 'Idle')
+        cycle_time = time.perf_counter() - start
+        await streamer.stop()
+        return sends, grbl.acks.times, (grbl.writes, grbl.bytes_written), stream_time, cycle_time, streamer.rx_size
+
+    async def main():
+        return await asyncio.gather(*(machine(ser) for ser in sers))
+
+    results = asyncio.run(main())
+    for ser in sers:
+        ser.close()
+    return results
+
+MODES = {
+    'simple': lambda ports, plan: run_threads(ports, plan, True),
+    'aggressive': lambda ports, plan: run_threads(ports, plan, False),
+    'asyncio': lambda ports, plan: run_async(ports, plan, False),
+    'planner': lambda ports, plan: run_threads(ports, plan, False, True),
+}
+
+# Итоги режима: скорость передачи - по самому медленному станку, задержки и опустошения - по всем станкам
+def bench(args, mode, plan):
+    sims = [start_sim(args) for _ in range(args.machines)]
+    cpu = time.process_time()
+    try:
+        machines = MODES[mode]([port for _, port in sims], plan)
+    finally:
+        cpu = time.process_time() - cpu
+        sim_stats = [stop_sim(sim) for sim, _ in sims]
+    latency = [(ack - send) * 1000 for sends, acks, *_ in machines for send, ack in zip(sends, acks)]
+    blocks = len(plan)
+    stream_time = max(machine[3] for machine in machines)
+    writes = sum(machine[2][0] for machine in machines)
+    written = sum(machine[2][1] for machine in machines)
+    return {
+        'machines': args.machines,
+        'blocks': blocks,
+        'bytes': len(plan.wire),
+        'stream_time': round(stream_time, 3),
+        'cycle_time': round(max(machine[4] for machine in machines), 3),
+        'lines_per_sec': round(blocks / stream_time, 1),
+        'bytes_per_sec': round(len(plan.wire) / stream_time, 1),
+        'lines_per_sec_each': [round(blocks / machine[3], 1) for machine in machines],
+        'writes': writes,
+        'writes_per_sec': round(writes / args.machines / stream_time, 1),
+        'bytes_per_write': round(written / writes, 1) if writes else None,
+        'ack_latency_ms': {f'p{p}': round(percentile(latency, p), 3) for p in (50, 90, 99, 100)},
+        'rx_size': machines[0][5],
+        'planner_empty': sum(stats.get('planner_empty', 0) for stats in sim_stats),
+        'rx_overflows': sum(stats.get('overflows', 0) for stats in sim_stats),
+        'cpu_us_per_line': round(cpu / (blocks * args.machines) * 1e6, 1),
+    }
+
+
+parser = argparse.ArgumentParser(description='Streaming benchmark on simulated GRBL')
+parser.add_argument('-g', '--gcode', type=str, default='test.gcode', help='g-code file added to workloads')
+parser.add_argument('-m', '--modes', nargs='+', default=list(MODES), choices=list(MODES), help='streaming modes')
+parser.add_argument('-w', '--workloads', nargs='+', default=None, help='workload names (test.gcode, vector, raster)')
+parser.add_argument('-s', '--scale', type=float, default=1.0, help='generated workload size factor')
+parser.add_argument('--baud', type=int, default=115200, help='simulated link speed, baud')
+parser.add_argument('--latency', type=float, default=0.0, help='simulated link latency one way, sec')
+parser.add_argument('--packet-time', type=float, default=0.0, help='simulated link time per packet, sec')
+parser.add_argument('--speedup', type=float, default=1.0, help='simulated motion speedup')
+parser.add_argument('--planner-size', type=int, default=16, help='simulated planner size, blocks')
+parser.add_argument('--rx', type=int, default=RX_BUFFER_SIZE, help='simulated RX buffer size, bytes')
+parser.add_argument('-n', '--machines', type=int, default=1, help='simulated controllers streamed concurrently')
+parser.add_argument('--compact', action='store_true', default=False, help='also stream compacted plans')
+parser.add_argument('--compact-digits', type=int, default=3, help='compacted coordinate digits')
+parser.add_argument('--merge-tolerance', type=float, default=0.01, help='collinear G1 merge tolerance, mm')
+parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='results file (JSON)')
+args = parser.parse_args()
+
+results = {
+    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    'host': platform.node(),
+    'python': platform.python_version(),
+    'link': {'baud': args.baud, 'latency': args.latency, 'packet_time': args.packet_time, 'speedup': args.speedup,
+             'planner_size': args.planner_size, 'rx_size': args.rx,
+             'machines': args.machines},
+    'compact': {'digits': args.compact_digits, 'merge_tolerance': args.merge_tolerance} if args.compact else None,
+    'runs': [],
+}
+
+with tempfile.TemporaryDirectory() as directory:
+    files = workloads(directory, args.scale, args.gcode if os.path.exists(args.gcode) else None)
+    for name, path in files.items():
+        if args.workloads and name not in args.workloads:
+            continue
+        with open(path) as file:
+            plan = compile_plan(file, 600)
+        plans = [(name, plan)]
+        if args.compact:
+            compacted = compact_plan(plan, args.compact_digits, args.merge_tolerance)
+            if compacted.compact_error:
+                print(f'{name:>11}: сжатие отменено, траектория не совпадает: {compacted.compact_error}')
+            else:
+                plans.append((name + '+compact', compacted))
+        for mode in args.modes:
+            for label, variant in plans:
+                run = {'workload': label, 'mode': mode, **bench(args, mode, variant)}
+                results['runs'].append(run)
+                latency = run['ack_latency_ms']
+                print(f"{label:>11} {mode:>10} x{args.machines}: {run['lines_per_sec']:>8} строк/с {run['bytes_per_sec']:>9} байт/с "
+                      f"{run['writes_per_sec']:>7} записей/с {run['bytes_per_write']:>5} байт/запись "
+                      f"ack p50/p99 {latency['p50']}/{latency['p99']} мс, планировщик пуст {run['planner_empty']}, "
+                      f"{run['cpu_us_per_line']} мкс CPU/строку")
+
+                # Сжатый план: строки файла в секунду против несжатого плана
+                if variant.compacted:
+                    blocks, size = variant.compacted
+                    raw = results['runs'][-2]
+                    run['source_blocks'] = blocks
+                    run['source_bytes'] = size
+                    run['source_lines_per_sec'] = round(blocks / run['stream_time'], 1)
+                    run['blocks_saved'] = round(100 - len(variant) * 100 / blocks, 1)
+                    run['bytes_saved'] = round(100 - len(variant.wire) * 100 / size, 1)
+                    run['lines_per_sec_gain'] = round(run['source_lines_per_sec'] * 100 / raw['lines_per_sec'] - 100, 1)
+                    print(f"{'':>11} {'':>10}     сжатие: -{run['bytes_saved']}% байт, -{run['blocks_saved']}% блоков, "
+                          f"{run['source_lines_per_sec']} строк файла/с ({run['lines_per_sec_gain']:+}%)")
+
+        # planner против подсчёта символов с постоянным размером буфера: опустошения планировщика и скорость
+        for label, _ in plans:
+            runs = {run['mode']: run for run in results['runs'] if run['workload'] == label}
+            if 'planner' in runs and 'aggressive' in runs:
+                planner, aggressive = runs['planner'], runs['aggressive']
+                print(f"{label:>11} planner/aggressive: планировщик пуст {planner['planner_empty']}/"
+                      f"{aggressive['planner_empty']}, буфер {planner['rx_size']}/{aggressive['rx_size']} байт, "
+                      f"{planner['lines_per_sec']}/{aggressive['lines_per_sec']} строк/с")
+
+with open(args.output, 'w') as file:
+    json.dump(results, file, indent=2, ensure_ascii=False)
+print(f'\nРезультаты: {args.output}')
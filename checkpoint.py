@@ -0,0 +1,169 @@
+# Журнал контрольных точек потоковой передачи
+# Подтверждённый GRBL блок уже в планировщике и будет исполнен даже при обрыве связи или сбое ПК,
+# поэтому после сбоя цикл продолжается с блока, следующего за последним подтверждённым.
+# Подтверждение только запоминается в памяти, строка JSON с последним подтверждённым блоком, циклом,
+# деталями и модальным состоянием дописывается в журнал с fsync раз в FLUSH_INTERVAL сек или FLUSH_BLOCKS блоков.
+# При потере питания ПК повторяются блоки, подтверждённые после последней записи (не более бюджета записи).
+# Журнал удаляется по завершении цикла, оставшийся журнал - признак прерванного цикла.
+# Поток передачи при подтверждении только запоминает блок; восстановление модального состояния по файлу,
+# запись и fsync выполняет отдельный поток, при медленном диске записывается только последняя точка.
+
+import collections
+import json
+import os
+import threading
+import time
+
+from gcode import ModalState
+
+FLUSH_INTERVAL = 1.0    # Запись журнала не реже, сек
+FLUSH_BLOCKS = 500      # Запись журнала не реже, подтверждённых блоков
+
+_BEGIN, _WRITE, _FINISH, _STOP = range(4)   # Задания потока записи журнала
+
+
+# Файл gcode для сравнения с журналом: путь, размер, время изменения
+def source_id(file):
+    stat = os.fstat(file.fileno())
+    return [os.path.realpath(file.name), stat.st_size, stat.st_mtime_ns]
+
+
+def _dump_state(state):
+    return [state.motion, state.absolute, state.scale, state.plane, state.feed, state.power, state.spindle,
+            list(state.position), list(state.offset), state.coord]
+
+
+# Журнал прежней версии - без смещения G92 и системы координат
+def load_state(values):
+    state = ModalState()
+    (state.motion, state.absolute, state.scale, state.plane, state.feed, state.power, state.spindle,
+     state.position) = values[:8]
+    if len(values) > 8:
+        state.offset, state.coord = values[8:10]
+    return state
+
+
+# Последняя полная запись журнала или None
+def load_checkpoint(path):
+    record = None
+    try:
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break   # Строка, не дописанная до сбоя
+    except OSError:
+        return None
+    return record
+
+
+class CheckpointJournal:
+    __slots__ = ('path', 'plan', 'file', 'interval', 'blocks', 'info', 'block', 'pieces', 'pending', 'flushed',
+                 'jobs', 'ready', 'writer', 'error')
+
+    def __init__(self, path, plan, file, interval=FLUSH_INTERVAL, blocks=FLUSH_BLOCKS):
+        self.path = path
+        self.plan = plan
+        self.file = file                # Файл gcode для восстановления модального состояния
+        self.interval = interval
+        self.blocks = blocks
+        self.info = None                # Данные цикла, общие для всех записей
+        self.block = -1                 # Последний подтверждённый блок
+        self.pieces = 0                 # Деталей цикла, завершённых подтверждёнными блоками
+        self.pending = 0                # Подтверждений после последней записи
+        self.flushed = 0.0
+        self.jobs = collections.deque()     # Задания потока записи: (вид, данные)
+        self.ready = threading.Condition()
+        self.writer = None
+        self.error = None               # Первая ошибка записи журнала
+
+    # Начало цикла с блока start: новый журнал
+    def begin(self, operator, gcode, cycle, pieces_total, start_time, start=0):
+        self.info = {'source': source_id(self.file), 'gcode': gcode, 'operator': operator, 'cycle': cycle,
+                     'pieces_total': pieces_total, 'start_time': int(start_time), 'start': start}
+        self.block = start - 1
+        self.pieces = 0
+        self._put(_BEGIN, None)
+        self.flush()
+
+    # Подтверждение блока index: запись журнала только по бюджету времени или количества блоков
+    def ack(self, index):
+        self.block = index
+        if index + 1 < len(self.plan) and self.plan.piece[index + 1]:
+            self.pieces += 1
+        self.pending += 1
+        if self.pending >= self.blocks or time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    # Запись контрольной точки: в потоке передачи только снимок, разбор gcode и запись с fsync - в потоке записи
+    def flush(self):
+        if self.info is None:
+            return
+        self._put(_WRITE, (self.info, self.block, self.pieces, int(time.time())))
+        self.pending = 0
+        self.flushed = time.monotonic()
+
+    # Цикл завершён: журнал больше не нужен
+    def finish(self):
+        self.info = None
+        self._put(_FINISH, None)
+
+    # Дождаться записи всех заданий и остановить поток записи
+    def close(self):
+        writer = self.writer
+        if writer:
+            self._put(_STOP, None)
+            writer.join()
+            self.writer = None
+
+    def _put(self, kind, data):
+        with self.ready:
+            if kind == _WRITE and self.jobs and self.jobs[-1][0] == _WRITE:
+                self.jobs[-1] = (kind, data)    # Не записанная точка заменяется более поздней
+            else:
+                self.jobs.append((kind, data))
+            self.ready.notify()
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._run, daemon=True)
+                self.writer.start()
+
+    # Поток записи: медленный диск задерживает только журнал, не отправку блоков
+    def _run(self):
+        journal = None
+        known = None            # (блок, модальное состояние перед ним) прошлой записи: разбор продолжается от него
+        while True:
+            with self.ready:
+                while not self.jobs:
+                    self.ready.wait()
+                kind, data = self.jobs.popleft()
+            try:
+                if kind == _WRITE and journal:
+                    info, block, pieces, now = data
+                    state = self.plan.state_before(self.file, block + 1, known)
+                    known = (block + 1, state)
+                    journal.write(json.dumps(dict(info, block=block, pieces=pieces, time=now,
+                                                  state=_dump_state(state))) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    continue
+                if journal:
+                    journal.close()
+                    journal = None
+                known = None
+                if kind == _BEGIN:
+                    journal = open(self.path, 'w')
+                elif kind == _FINISH and os.path.exists(self.path):
+                    os.remove(self.path)
+                elif kind == _STOP:
+                    return
+            except OSError as error:
+                self.error = self.error or error
+
+
+# Отметка в журнале, что строка статистики прерванного цикла записана (не записывать повторно при следующем запуске)
+def mark_recorded(path, record):
+    with open(path, 'a') as journal:
+        journal.write(json.dumps(dict(record, recorded=True)) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
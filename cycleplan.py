@@ -0,0 +1,832 @@
+# Скомпилированный план цикла
+# Файл gcode разбирается один раз при запуске: подмена S и F, удаление пробелов и комментариев,
+# подсчёт перемещений, границ деталей и меток '; beep'. Циклы обработки только проходят по готовым массивам.
+# Готовый план сохраняется в кэш и при следующем запуске с тем же файлом и параметрами не разбирается заново.
+# Файл читается через mmap, план хранит смещения строк файла и модальное состояние через каждые CHECKPOINT_BLOCKS блоков,
+# поэтому продолжение с любой строки или детали восстанавливает состояние разбором только части файла.
+# Необязательное изменение порядка групп между G0 сокращает холостые ходы цикла.
+# Блоки плана проверяются по правилам разбора GRBL 1.1 без станка, ошибки сохраняются в кэше вместе с планом.
+# Необязательное сжатие плана уменьшает байты на блок (при передаче по Bluetooth - предел скорости растровых файлов):
+# без повторов модальных слов, с округлёнными координатами и объединёнными отрезками G1 на одной прямой.
+
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+from gcode import ModalState, fmt, tokenize
+from grblcheck import check_plan
+
+_S_WORD = re.compile(r'S\s*\d+(\.\d*)?', re.IGNORECASE)
+_F_WORD = re.compile(r'F\s*\d+(\.\d*)?', re.IGNORECASE)
+
+RAPID_RATE = 5000   # Скорость G0 для оценки времени, мм/мин
+CHECKPOINT_BLOCKS = 1000    # Шаг сохранения модального состояния в плане, блоков
+MERGE_BLOCKS = 100  # Наибольшее количество отрезков G1, объединяемых при сжатии в один блок
+PLAN_VERSION = 6    # Изменить при изменении CyclePlan или compile_plan, чтобы не читать устаревший кэш
+
+
+class CyclePlan:
+    __slots__ = ('wire', 'offsets', 'lengths', 'line_no', 'source_offsets', 'checkpoints',
+                 'x_move', 'y_move', 'xy_move', 's_move', 'x_end', 'y_end', 'feed', 'duration', 'piece', 'beep',
+                 'start_positions', 'end_beep', 'lines_in_file', 'reordered', 'compacted', 'compact_error', 'errors',
+                 '_totals')
+
+    def __init__(self):
+        self.wire = b''                 # Все блоки подряд в виде готовых к отправке байт (с '\n')
+        self.offsets = array('L')       # Смещение блока в wire
+        self.lengths = array('H')       # Длина блока в байтах (с '\n')
+        self.line_no = array('L')       # Номер строки файла
+        self.source_offsets = array('Q')    # Смещение строки блока в файле gcode
+        self.checkpoints = []           # (смещение строки в файле, ModalState перед строкой) по порядку строк файла
+        self.x_move = array('d')        # Перемещения для статистики
+        self.y_move = array('d')
+        self.xy_move = array('d')
+        self.s_move = array('d')
+        self.x_end = array('d')         # Координаты X, Y после блока
+        self.y_end = array('d')
+        self.feed = array('d')          # Заданная подача, мм/мин (0 - G0 и блоки без перемещения)
+        self.duration = array('d')      # Время исполнения блока по заданной подаче, сек
+        self.piece = array('b')         # 1 - блок начинает новую деталь
+        self.beep = array('b')          # 1 - перед блоком стоит метка '; beep'
+        self.start_positions = []       # (индекс блока, G0 начальной позиции)
+        self.end_beep = False           # Метка '; beep' после последнего блока
+        self.lines_in_file = 0
+        self.reordered = None           # Холостые ходы цикла до и после изменения порядка групп, мм
+        self.compacted = None           # (блоков, байт) до сжатия плана
+        self.compact_error = None       # Причина отказа от сжатия (проверка траектории не пройдена)
+        self.errors = []                # Ошибки GRBL блоков без станка: (индекс блока, код)
+        self._totals = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Байты блока для отправки (без копирования)
+    def block(self, i):
+        offset = self.offsets[i]
+        return memoryview(self.wire)[offset:offset + self.lengths[i]]
+
+    # Текст блока без '\n' (для вывода на экран)
+    def text(self, i):
+        offset = self.offsets[i]
+        return self.wire[offset:offset + self.lengths[i] - 1].decode()
+
+    # Суммарные перемещения блоков start..end (не включая end): x, y, xy, s
+    def totals(self, end=None, start=0):
+        if (end is None or end >= len(self)) and not start:
+            if self._totals is None:
+                self._totals = (sum(self.x_move), sum(self.y_move), sum(self.xy_move), sum(self.s_move))
+            return self._totals
+        return (sum(self.x_move[start:end]), sum(self.y_move[start:end]),
+                sum(self.xy_move[start:end]), sum(self.s_move[start:end]))
+
+    # Первый блок, начиная со строки файла line_no (в переупорядоченном плане - блок ближайшей следующей строки)
+    def block_at_line(self, line_no):
+        if self.reordered is None:
+            return bisect_left(self.line_no, line_no)
+        later = [i for i, number in enumerate(self.line_no) if number >= line_no]
+        return min(later, key=self.line_no.__getitem__) if later else len(self)
+
+    # Первый блок детали number (с 1) или None, если деталей меньше
+    def piece_block(self, number):
+        if number <= 1:
+            return 0
+        count = 1
+        for i, flag in enumerate(self.piece):
+            if flag:
+                count += 1
+                if count == number:
+                    return i
+        return None
+
+    # Модальное состояние перед блоком index: от ближайшего сохранённого состояния разбираются только строки до блока
+    # known - (блок, состояние перед ним), полученное ранее: используется, если строка блока ближе к блоку index
+    def state_before(self, file, index, known=None):
+        end = self.source_offsets[index] if index < len(self) else None
+        offsets = [checkpoint[0] for checkpoint in self.checkpoints]
+        offset, state = self.checkpoints[bisect_right(offsets, end) - 1 if end is not None else -1]
+        if known and known[0] < len(self):
+            known_offset = self.source_offsets[known[0]]
+            if offset <= known_offset and (end is None or known_offset <= end):
+                offset, state = known_offset, known[1]
+        state = state.copy()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            data.seek(offset)
+            while end is None or data.tell() < end:
+                line = data.readline()
+                if not line:
+                    break
+                state.step(tokenize(line.decode(errors='replace')))
+        return state
+
+    # Первое пересечение координаты y в сторону увеличения Y: (индекс блока, доля пути блока) или None
+    def y_crossing(self, y, start=0):
+        y_prev = self.y_end[start - 1] if start else 0.0
+        for i in range(start, len(self)):
+            y_end = self.y_end[i]
+            if y_prev <= y < y_end:
+                return i, (y - y_prev) / (y_end - y_prev)
+            y_prev = y_end
+        return None
+
+    # Блок среди lo..hi-1, на отрезке которого лежит точка (x, y): (индекс блока, доля пути блока)
+    # Дуги приближаются хордой, при равном расстоянии выбирается более ранний блок
+    def locate(self, x, y, lo, hi):
+        best = None
+        distance_min = float('inf')
+        x_prev = self.x_end[lo - 1] if lo else 0.0
+        y_prev = self.y_end[lo - 1] if lo else 0.0
+        for i in range(lo, min(hi, len(self))):
+            x_end, y_end = self.x_end[i], self.y_end[i]
+            dx, dy = x_end - x_prev, y_end - y_prev
+            norm = dx*dx + dy*dy
+            fraction = min(1.0, max(0.0, ((x - x_prev)*dx + (y - y_prev)*dy) / norm)) if norm else 1.0
+            distance = (x_prev + fraction*dx - x)**2 + (y_prev + fraction*dy - y)**2
+            if distance < distance_min:
+                best, distance_min = (i, fraction), distance
+            x_prev, y_prev = x_end, y_end
+        return best
+
+    # Время исполнения от точки (i, доля пути) до точки (j, доля пути) по заданным подачам, сек
+    def time_between(self, i, fraction_i, j, fraction_j):
+        return sum(self.duration[i:j]) - self.duration[i]*fraction_i + self.duration[j]*fraction_j
+
+    # Начальная позиция следующего цикла - последний G0 с X и Y до блока end
+    def start_position(self, end=None):
+        position = None
+        for index, block in self.start_positions:
+            if end is not None and index >= end:
+                break
+            position = block
+        return position
+
+
+# Разбор файла gcode в план цикла
+def compile_plan(file, pieces_distance, laser=None, speed=None, rapid_rate=RAPID_RATE):
+    plan = CyclePlan()
+    state = ModalState()
+    wire = bytearray()
+    pending_beep = False
+    l_count = 0
+    for offset, line in _read_lines(file):
+        l_count += 1
+
+        # Модальное состояние перед строкой для продолжения с середины файла
+        if len(plan.offsets) >= len(plan.checkpoints) * CHECKPOINT_BLOCKS:
+            plan.checkpoints.append((offset, state.copy()))
+
+        # Звуковой сигнал, если надена метка ; beep
+        if '; beep' in line.lower():
+            pending_beep = True
+
+        words = tokenize(line)
+        block = state.step(words)   # None для строк без слов gcode ($-команды, '%')
+        letters = [letter for letter, _ in words]
+
+        # Подмена мощности лазера S
+        if laser and int(laser) <= 100 and 'S' in letters and state.power:
+            line = _S_WORD.sub(f'S{laser*10}', line)
+
+        # Подмена скорости F
+        if speed and 'F' in letters and block.motion != 0:
+            line = _F_WORD.sub(f'F{speed}', line)
+
+        l_block = re.sub(r'(\s)|(;.*)', '', line).upper()
+        if not l_block:
+            continue
+
+        # Граница деталей: перемещение G1 с выключенным лазером не меньше расстояния между деталями
+        piece = block is not None and block.motion == 1 and not block.power and block.dy >= pieces_distance
+        _add_block(plan, wire, l_block.encode() + b'\n', block, state, l_count, offset, pending_beep, piece,
+                   speed, rapid_rate)
+        pending_beep = False
+
+    plan.end_beep = pending_beep
+    plan.lines_in_file = l_count
+    plan.wire = bytes(wire)
+    return plan
+
+
+# Координата для x_end/y_end: неизвестная по файлу (после G28, G53 и т.п.) - NaN
+def _coordinate(value):
+    return math.nan if value is None else value
+
+
+# Блок в конец плана: байты для отправки, строка файла и перемещения по результату ModalState.step
+def _add_block(plan, wire, data, block, state, line_no, offset, beep, piece, speed, rapid_rate):
+    index = len(plan.offsets)
+    plan.offsets.append(len(wire))
+    plan.lengths.append(len(data))
+    plan.line_no.append(line_no)
+    plan.source_offsets.append(offset)
+    wire += data
+    plan.beep.append(1 if beep else 0)
+
+    if block is None or block.motion is None:
+        for values in (plan.x_move, plan.y_move, plan.xy_move, plan.s_move, plan.feed, plan.duration):
+            values.append(0)
+        plan.x_end.append(_coordinate(state.position[0]))
+        plan.y_end.append(_coordinate(state.position[1]))
+        plan.piece.append(0)
+        return
+
+    # Сохранить начальную позию для следующего цикла (абсолютные координаты, отправляется после G90)
+    if block.motion == 0 and 'X' in block.axes and 'Y' in block.axes and block.x is not None and block.y is not None:
+        plan.start_positions.append((index, f'G0X{fmt(block.x)}Y{fmt(block.y)}\n'.encode()))
+
+    # Статистика
+    plan.x_move.append(abs(block.dx))
+    plan.y_move.append(abs(block.dy))
+    plan.xy_move.append(block.length)
+    plan.s_move.append(block.power * block.length if block.motion else 0)
+    plan.x_end.append(_coordinate(block.x))
+    plan.y_end.append(_coordinate(block.y))
+    feed = (speed or block.feed or 0) if block.motion else 0
+    plan.feed.append(feed)
+    plan.duration.append(block.length * 60 / (feed or rapid_rate))
+    plan.piece.append(1 if piece else 0)
+
+
+# Строки файла через mmap: (смещение строки, текст)
+def _read_lines(file):
+    file.seek(0)
+    if not os.fstat(file.fileno()).st_size:
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offset = 0
+        for line in iter(data.readline, b''):
+            yield offset, line.decode(errors='replace')
+            offset += len(line)
+
+
+REORDER_WINDOW = 200    # Наибольшее количество групп, переворачиваемых 2-opt за один шаг
+REORDER_PASSES = 10     # Наибольшее количество проходов 2-opt
+
+_PLAIN_LETTERS = set('GXYZFSMIJKR')
+_PLAIN_G = (0, 1, 2, 3, 17, 18, 19, 20, 21, 90, 91)
+_PLAIN_M = (3, 4, 5, 7, 8, 9)
+_RESTORE = ('absolute', 'scale', 'plane', 'spindle', 'power', 'feed')
+
+
+# Группа блоков от G0 с X и Y до следующего такого G0
+class _Group:
+    __slots__ = ('first', 'last', 'state', 'start', 'end', 'needs', 'assigned', 'movable', 'points')
+
+    def __init__(self, index, state, start):
+        self.first = self.last = index
+        self.state = state              # ModalState перед G0 группы
+        self.start = start              # Точка G0 (X, Y)
+        self.end = start                # Конечная точка группы (X, Y)
+        self.needs = set()              # Поля ModalState, используемые группой до их установки в группе
+        self.assigned = set()
+        self.movable = True             # Группу можно переставлять: без деталей, меток '; beep' и особых команд
+        self.points = []                # (X, Y, подача, мощность) отрезков G1 для прохода в обратном направлении
+
+    # Блок группы: слова и результат исполнения
+    def add(self, index, words, block, state, flags):
+        self.last = index
+        self.end = (state.position[0], state.position[1])
+        for letter, value in words:
+            if letter == 'G' and value in (90, 91):
+                self.assigned.add('absolute')
+            elif letter == 'G' and value in (20, 21):
+                self.assigned.add('scale')
+            elif letter == 'G' and value in (17, 18, 19):
+                self.assigned.add('plane')
+            elif letter == 'M' and value in (3, 4, 5):
+                self.assigned.add('spindle')
+            elif letter == 'S':
+                self.assigned.add('power')
+            elif letter == 'F':
+                self.assigned.add('feed')
+        if block is not None and block.motion is not None:
+            needs = ['absolute', 'scale']
+            if block.motion:
+                needs += ['spindle', 'power', 'feed']
+            if block.motion in (2, 3):
+                needs.append('plane')
+            self.needs.update(field for field in needs if field not in self.assigned)
+
+        letters = {letter for letter, _ in words}
+        g_words = [value for letter, value in words if letter == 'G']
+        if (flags or not _PLAIN_LETTERS.issuperset(letters) or any(value not in _PLAIN_G for value in g_words)
+                or any(value not in _PLAIN_M for letter, value in words if letter == 'M')):
+            self.movable = False
+
+        # Обратный проход - только для G0 X Y и отрезков G1 X Y в абсолютных координатах
+        if self.points is None:
+            return
+        if index == self.first:
+            if not letters <= set('GXY'):
+                self.points = None
+        elif (block is not None and block.motion == 1 and state.absolute and letters <= set('GXYFS')
+                and all(value == 1 for value in g_words)):
+            self.points.append((state.position[0], state.position[1], state.feed, state.power))
+        else:
+            self.points = None
+
+
+def _distance_xy(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+# Холостой ход через группы order [(группа, обратно), ...] от точки entry до точки exit (None - без конечной точки)
+def _travel(order, entry, exit):
+    travel = 0.0
+    point = entry
+    for group, back in order:
+        travel += _distance_xy(point, group.end if back else group.start)
+        point = group.start if back else group.end
+    if exit is not None:
+        travel += _distance_xy(point, exit)
+    return travel
+
+
+# Порядок групп участка: ближайший сосед, затем 2-opt по холостым ходам.
+# С reverse группы из отрезков G1 могут проходиться в обратном направлении
+def _order_groups(groups, entry, exit, reverse):
+    left = list(groups)
+    order = []
+    point = entry
+    while left:
+        best = None
+        for group in left:
+            for back in ((False, True) if reverse and group.points else (False,)):
+                distance = _distance_xy(point, group.end if back else group.start)
+                if best is None or distance < best[0]:
+                    best = (distance, group, back)
+        _, group, back = best
+        left.remove(group)
+        order.append((group, back))
+        point = group.start if back else group.end
+
+    # 2-opt: участок i..j проходится в обратном порядке (группы в прежнем направлении или все обратно)
+    n = len(order)
+    starts = [group.end if back else group.start for group, back in order]
+    ends = [group.start if back else group.end for group, back in order]
+    for _ in range(REORDER_PASSES):
+        improved = False
+        for i in range(n):
+            before = ends[i - 1] if i else entry
+            inside = 0.0        # Изменение переходов внутри участка при прежнем направлении групп
+            backward = reverse
+            for j in range(i, min(n, i + REORDER_WINDOW)):
+                if j > i:
+                    inside += _distance_xy(ends[j], starts[j - 1]) - _distance_xy(ends[j - 1], starts[j])
+                backward = backward and bool(order[j][0].points)
+                after = starts[j + 1] if j + 1 < n else exit
+                outside = _distance_xy(before, starts[i]) + (_distance_xy(ends[j], after) if after is not None else 0.0)
+                delta = None
+                if j > i:
+                    delta = (_distance_xy(before, starts[j]) + inside - outside
+                             + (_distance_xy(ends[i], after) if after is not None else 0.0))
+                    flipped = False
+                if backward:
+                    delta_back = (_distance_xy(before, ends[j]) - outside
+                                  + (_distance_xy(starts[i], after) if after is not None else 0.0))
+                    if delta is None or delta_back < delta:
+                        delta, flipped = delta_back, True
+                if delta is None or delta > -1e-6:
+                    continue
+                segment = order[i:j + 1][::-1]
+                order[i:j + 1] = [(group, not back) for group, back in segment] if flipped else segment
+                for k in range(i, j + 1):
+                    group, back = order[k]
+                    starts[k], ends[k] = (group.end, group.start) if back else (group.start, group.end)
+                improved = True
+                break
+        if not improved:
+            break
+    return order
+
+
+# Изменение порядка групп между холостыми ходами G0 для сокращения холостых ходов цикла.
+# Группа начинается с G0 с X и Y в абсолютных координатах. Порядок меняется только внутри участков из подряд
+# идущих переставляемых групп: группы с началом детали, меткой '; beep', дугой без обратного прохода, особыми командами
+# ($, G28, G92, M0 и т.п.) или изменением Z остаются на месте, поэтому порядок деталей и сигналов сохраняется.
+# Перед группой, если состояние после предыдущей группы отличается от исходного, добавляется блок восстановления
+# (G90/G91, G20/G21, плоскость, M3/M4/M5, S, F) - только для полей, которые группа использует до их установки.
+# Смещение строки файла обратного отрезка - строка после исходного отрезка: продолжение с середины восстанавливает
+# состояние в его начальной точке
+def reorder_plan(plan, file, speed=None, reverse=False, rapid_rate=RAPID_RATE):
+    state = ModalState()
+    head = 0
+    groups = []
+    for i in range(len(plan)):
+        words = tokenize(plan.text(i))
+        before = state.copy()
+        block = state.step(words)
+        if (block is not None and block.motion == 0 and 'X' in block.axes and 'Y' in block.axes and state.absolute
+                and not any(letter == 'G' and value == 53 for letter, value in words)):
+            groups.append(_Group(i, before, (block.x, block.y)))
+            if None in before.position[:2]:
+                groups[-1].movable = False      # Точка входа неизвестна
+        if not groups:
+            head = i + 1
+            continue
+        group = groups[-1]
+        group.add(i, words, block, state, plan.piece[i] or plan.beep[i])
+        if block is not None and block.dz:
+            group.movable = False
+
+    # Участки из подряд идущих переставляемых групп, последняя группа с завершением программы (M5 и т.п.) на месте
+    if groups:
+        groups[-1].movable = False
+    order = []
+    k = 0
+    while k < len(groups):
+        if not groups[k].movable:
+            order.append((groups[k], False))
+            k += 1
+            continue
+        m = k
+        while m < len(groups) and groups[m].movable:
+            m += 1
+        entry = (groups[k].state.position[0], groups[k].state.position[1])
+        exit = groups[m].start if m < len(groups) else None
+        segment = [(group, False) for group in groups[k:m]]
+        optimized = min((_order_groups(groups[k:m], entry, exit, back) for back in {False, reverse}),
+                        key=lambda order: _travel(order, entry, exit))
+        order += optimized if _travel(optimized, entry, exit) < _travel(segment, entry, exit) - 1e-6 else segment
+        k = m
+
+    travel = _rapid_travel(plan)
+    if all(a is b and not back for (a, back), b in zip(order, groups)):
+        plan.reordered = (travel, travel)
+        return plan
+
+    result = CyclePlan()
+    wire = bytearray()
+    state = ModalState()
+    end_offset = os.fstat(file.fileno()).st_size
+
+    def put(text, line_no, offset, beep=0, piece=0):
+        block = state.step(tokenize(text))
+        _add_block(result, wire, text.encode() + b'\n', block, state, line_no, offset, beep, piece, speed, rapid_rate)
+
+    for i in range(head):
+        put(plan.text(i), plan.line_no[i], plan.source_offsets[i], plan.beep[i], plan.piece[i])
+    for group, back in order:
+        entry = group.state
+        words = []
+        for field in _RESTORE:
+            value = getattr(entry, field)
+            if field not in group.needs or getattr(state, field) == value or value is None:
+                continue
+            if field == 'absolute':
+                words.append('G90' if value else 'G91')
+            elif field == 'scale':
+                words.append('G21' if value == 1.0 else 'G20')
+            elif field == 'plane':
+                words.append(f'G{value}')
+            elif field == 'spindle':
+                words.append(f'M{value}' if value else 'M5')
+            elif field == 'power':
+                words.append(f'S{fmt(value, 6)}')
+            else:
+                words.append(f'F{fmt(value / entry.scale, 6)}')
+        first = group.first
+        if words:
+            put(''.join(words), plan.line_no[first], plan.source_offsets[first])
+        if not back:
+            for i in range(first, group.last + 1):
+                put(plan.text(i), plan.line_no[i], plan.source_offsets[i], plan.beep[i], plan.piece[i])
+            continue
+
+        # Обратный проход: G0 в конечную точку, отрезки от последнего к первому с подачей и мощностью отрезка
+        scale = entry.scale
+        points = [(group.start[0], group.start[1], None, None)] + group.points
+        put(f'G0X{fmt(points[-1][0] / scale, 6)}Y{fmt(points[-1][1] / scale, 6)}', plan.line_no[first],
+            plan.source_offsets[first])
+        feed = power = None
+        for k in range(len(points) - 1, 0, -1):
+            x, y = points[k - 1][0], points[k - 1][1]
+            text = ('G1' if k == len(points) - 1 else '') + f'X{fmt(x / scale, 6)}Y{fmt(y / scale, 6)}'
+            if points[k][2] != feed and points[k][2] is not None:
+                feed = points[k][2]
+                text += f'F{fmt(feed / scale, 6)}'
+            if points[k][3] != power:
+                power = points[k][3]
+                text += f'S{fmt(power, 6)}'
+            index = first + k
+            put(text, plan.line_no[index], plan.source_offsets[index + 1] if index + 1 < len(plan) else end_offset)
+
+    result.checkpoints = plan.checkpoints
+    result.end_beep = plan.end_beep
+    result.lines_in_file = plan.lines_in_file
+    result.wire = bytes(wire)
+    result.reordered = (travel, _rapid_travel(result))
+    return result
+
+
+# Холостые ходы G0 плана, мм
+def _rapid_travel(plan):
+    return sum(length for length, feed in zip(plan.xy_move, plan.feed) if not feed)
+
+
+_COMPACT_LETTERS = set('GXYZFS')
+_POSITION_G = (4, 10, 28, 30, 53, 54, 55, 56, 57, 58, 59, 92, 28.1, 30.1, 92.1)   # G, меняющие позицию без перемещения
+
+
+# Блок сжатого плана: строка gcode или отрезки G1 на одной прямой, ожидающие объединения
+class _Run:
+    __slots__ = ('first', 'last', 'head', 'tail', 'axes', 'absolute', 'scale', 'start', 'points', 'mergeable')
+
+    def __init__(self, index, head, tail, axes, state, start, mergeable):
+        self.first = self.last = index
+        self.head = head                # Слова перед осями: ['G1']
+        self.tail = tail                # Слова после осей: ['F1000', 'S800']
+        self.axes = axes                # Индексы осей, указанных в строках
+        self.absolute = state.absolute
+        self.scale = state.scale
+        self.start = start              # Начальная точка, мм
+        self.points = [list(state.position)]    # Конечные точки отрезков, мм
+        self.mergeable = mergeable
+
+    # Присоединение отрезка до точки end: все точки по порядку не дальше tolerance от прямой start - end
+    def extend(self, index, end, axes, tolerance):
+        if len(self.points) >= MERGE_BLOCKS:
+            return False
+        sx, sy, sz = self.start
+        dx, dy, dz = end[0] - sx, end[1] - sy, end[2] - sz
+        norm = dx*dx + dy*dy + dz*dz
+        if not norm:
+            return False
+        t_prev = 0.0
+        for x, y, z in self.points:
+            t = ((x - sx)*dx + (y - sy)*dy + (z - sz)*dz) / norm
+            if t < t_prev or t > 1.0:
+                return False
+            if (sx + t*dx - x)**2 + (sy + t*dy - y)**2 + (sz + t*dz - z)**2 > tolerance*tolerance:
+                return False
+            t_prev = t
+        self.last = index
+        self.points.append(end)
+        self.axes |= axes
+        return True
+
+
+# Сжатый план для передачи: модальные G0/G1, F и S не повторяются, координаты округляются до digits знаков,
+# подряд идущие отрезки G1 с одинаковыми подачей и мощностью, отклоняющиеся от общей прямой не более tolerance мм,
+# объединяются в один блок. Строки с другими словами (дуги, M, G90/G91 и т.п.) передаются без изменений.
+# Состояние станка в начале цикла неизвестно: слова опускаются только после отправки того же значения в этом плане.
+# Приращения G91 считаются от отправленной позиции, поэтому ошибка округления не накапливается.
+# Сжатый план проверяется исполнением: при расхождении траектории причина в compact_error
+def compact_plan(plan, digits=3, tolerance=0.01):
+    compact = CyclePlan()
+    state = ModalState()
+    wire = bytearray()
+    firsts = array('L')                 # Первый блок плана для каждого блока сжатого плана
+    sent = [0.0, 0.0, 0.0]              # Позиция станка по отправленным блокам, мм
+    known = [False, False, False]       # Позиция оси известна по отправленным блокам (G90)
+    modal = {'G': None, 'F': None, 'S': None}   # Отправленные значения модальных слов
+    sums = ('x_move', 'y_move', 'xy_move', 's_move', 'duration')
+    run = None
+    pending_beep = False
+
+    # Блок сжатого плана из блоков first..last плана
+    def emit(first, last, text):
+        nonlocal pending_beep
+        data = text.encode() + b'\n'
+        firsts.append(first)
+        compact.offsets.append(len(wire))
+        compact.lengths.append(len(data))
+        compact.line_no.append(plan.line_no[first])
+        compact.source_offsets.append(plan.source_offsets[first])
+        wire.extend(data)
+        for name in sums:
+            getattr(compact, name).append(sum(getattr(plan, name)[first:last + 1]))
+        compact.x_end.append(plan.x_end[last])
+        compact.y_end.append(plan.y_end[last])
+        compact.feed.append(plan.feed[first])
+        compact.piece.append(plan.piece[first])
+        compact.beep.append(1 if plan.beep[first] or pending_beep else 0)
+        pending_beep = False
+
+    # Отправка ожидающего блока: оси - только изменившиеся, с округлением
+    def flush(run):
+        nonlocal pending_beep
+        if run is None:
+            return None
+        words = list(run.head)
+        end = run.points[-1]
+        for k in sorted(run.axes):
+            target = round(end[k] / run.scale, digits)
+            if run.absolute:
+                if known[k] and target == round(sent[k] / run.scale, digits):
+                    continue
+                words.append(f'{"XYZ"[k]}{fmt(target, digits)}')
+                sent[k] = target * run.scale
+                known[k] = True
+            else:
+                delta = round(target - sent[k] / run.scale, digits)
+                if not delta:
+                    continue
+                words.append(f'{"XYZ"[k]}{fmt(delta, digits)}')
+                sent[k] += delta * run.scale
+        text = ''.join(words + run.tail)
+        if text:
+            emit(run.first, run.last, text)
+        elif plan.beep[run.first]:
+            pending_beep = True
+        return None
+
+    for i in range(len(plan)):
+        text = plan.text(i)
+        words = tokenize(text)
+        start = list(state.position)
+        block = state.step(words)
+        letters = [letter for letter, _ in words]
+        g_words = [value for letter, value in words if letter == 'G']
+
+        # Строка без изменений
+        if (not words or not _COMPACT_LETTERS.issuperset(letters) or len(g_words) > 1
+                or any(value not in (0, 1) for value in g_words) or state.motion not in (0, 1)
+                or None in start or None in state.position):
+            run = flush(run)
+            emit(i, i, text)
+            if block is None:
+                continue
+            if any(value in _POSITION_G for value in g_words):
+                # Отправленная позиция станка неизвестна, приращения G91 - от позиции по файлу
+                known[:] = (False, False, False)
+                sent[:] = state.position
+            elif block.motion is not None:
+                for k, delta in enumerate((block.dx, block.dy, block.dz)):
+                    if 'XYZ'[k] in block.axes:
+                        if state.absolute or state.position[k] is None or sent[k] is None:
+                            sent[k] = state.position[k]
+                        else:
+                            sent[k] += delta
+                        known[k] = known[k] or state.absolute
+            if any(value in (0, 1, 2, 3, 80) for value in g_words):
+                modal['G'] = state.motion
+            if 'F' in letters:
+                modal['F'] = state.feed
+            if 'S' in letters:
+                modal['S'] = state.power
+            continue
+
+        # Модальные слова, не совпадающие с отправленными
+        head, tail = [], []
+        for letter, value in words:
+            if letter == 'G':
+                if modal['G'] != state.motion:
+                    head.append(f'G{state.motion}')
+                modal['G'] = state.motion
+            elif letter == 'F':
+                if modal['F'] != state.feed:
+                    tail.append(f'F{fmt(value, 6)}')
+                modal['F'] = state.feed
+            elif letter == 'S':
+                if modal['S'] != state.power:
+                    tail.append(f'S{fmt(value, 6)}')
+                modal['S'] = state.power
+        axes = {k for k, letter in enumerate('XYZ') if letter in letters}
+        move = block.motion == 1 and block.length > 0 and tolerance > 0
+
+        # Отрезок G1 без модальных слов продолжает прямую ожидающего блока
+        if (move and run is not None and run.mergeable and not head and not tail and not plan.beep[i]
+                and not plan.piece[i] and run.extend(i, state.position, axes, tolerance)):
+            continue
+        run = flush(run)
+        run = _Run(i, head, tail, axes, state, start, move)
+        if not move:
+            run = flush(run)
+    flush(run)
+
+    # Начальная позиция - в блоке со строкой G0
+    for index, position in plan.start_positions:
+        compact.start_positions.append((bisect_right(firsts, index) - 1, position))
+    compact.checkpoints = plan.checkpoints
+    compact.reordered = plan.reordered
+    compact.end_beep = plan.end_beep or pending_beep
+    compact.lines_in_file = plan.lines_in_file
+    compact.compacted = (len(plan), len(plan.wire))
+    compact.wire = bytes(wire)
+    compact.compact_error = _verify_compact(plan, compact, firsts, digits, tolerance)
+    return compact
+
+
+# Точка с неизвестными по файлу координатами, заменёнными нулём (ось без перемещения)
+def _known(point):
+    return [0.0 if value is None else value for value in point]
+
+
+# Расстояние от точки до отрезка start - end, мм
+def _distance(point, start, end):
+    delta = [b - a for a, b in zip(start, end)]
+    norm = sum(d*d for d in delta)
+    t = min(1.0, max(0.0, sum((p - a)*d for p, a, d in zip(point, start, delta)) / norm)) if norm else 0.0
+    return math.sqrt(sum((a + t*d - p)**2 for p, a, d in zip(point, start, delta)))
+
+
+# Проверка сжатого плана исполнением обоих планов (подача и мощность в начале неизвестны):
+# конечная точка каждого перемещения плана не дальше tolerance от блока сжатого плана с тем же видом движения,
+# подачей и мощностью, после каждого блока позиция и модальное состояние совпадают.
+# None - траектории совпадают, иначе описание первого расхождения
+def _verify_compact(plan, compact, firsts, digits, tolerance):
+    source, result = ModalState(), ModalState()
+    source.power = result.power = None
+    segment = None
+    i = 0
+    for j in range(len(compact) + 1):
+        stop = firsts[j] if j < len(compact) else len(plan)
+        while i < stop:
+            block = source.step(tokenize(plan.text(i)))
+            eps = 1.01 * 10**-digits * source.scale
+            if block is not None and block.motion is not None and block.length > eps:
+                if (segment is None or segment[0] != (block.motion, block.feed, block.power)
+                        or _distance(_known((block.x, block.y, block.z)), *segment[1:]) > tolerance + eps):
+                    return f'строка {plan.line_no[i]} {plan.text(i)}'
+            i += 1
+        if j:
+            eps = 1.01 * 10**-digits * source.scale
+            if (any(a != b if a is None or b is None else abs(a - b) > eps
+                    for a, b in zip(source.position, result.position))
+                    or (source.motion, source.feed, source.power, source.spindle, source.absolute, source.scale,
+                        source.plane) != (result.motion, result.feed, result.power, result.spindle, result.absolute,
+                                          result.scale, result.plane)):
+                return f'строка {compact.line_no[j - 1]} {compact.text(j - 1)}'
+        if j < len(compact):
+            start = list(result.position)
+            block = result.step(tokenize(compact.text(j)))
+            segment = None
+            if block is not None and block.motion is not None:
+                segment = ((block.motion, block.feed, block.power), _known(start), _known(result.position))
+    return None
+
+
+# Команды восстановления модального состояния перед продолжением с середины файла:
+# лазер выключен на время перехода в начальную точку блока, затем единицы, плоскость, подача, мощность и режим координат.
+# Смещение G92 по X, Y задаётся заново: переход без смещения, затем G92 в начальной точке.
+# Начальная точка, неизвестная по файлу (после G28, G53 и т.п.), не восстанавливается
+def resume_preamble(state, laser=None, speed=None):
+    scale = state.scale
+    x, y, _ = state.position
+    ox, oy, _ = state.offset
+    blocks = ['M5', 'G21' if scale == 1.0 else 'G20', f'G{state.plane}', 'G90']
+    if None not in (x, y, ox, oy):
+        if ox or oy:
+            blocks += ['G92.1', f'G0X{fmt((x + ox)/scale)}Y{fmt((y + oy)/scale)}', f'G92X{fmt(x/scale)}Y{fmt(y/scale)}']
+        else:
+            blocks.append(f'G0X{fmt(x/scale)}Y{fmt(y/scale)}')
+    power = laser*10 if laser and int(laser) <= 100 and state.power else state.power
+    if state.spindle:
+        blocks.append(f'M{state.spindle}S{fmt(power)}')
+    else:
+        blocks.append(f'S{fmt(power)}')
+    feed = speed or (state.feed / scale if state.feed else None)
+    if state.motion in (0, 1):
+        blocks.append(f'G{state.motion}' + (f'F{fmt(feed)}' if feed else ''))
+    elif feed:
+        blocks.append(f'F{fmt(feed)}')
+    if not state.absolute:
+        blocks.append('G91')
+    return [f'{block}\n'.encode() for block in blocks]
+
+
+# План из кэша или разбор файла: (план, True - из кэша)
+# Ключ кэша - путь, размер и время изменения файла gcode и параметры разбора
+# reorder - изменение порядка групп между G0 (reverse - с обратным проходом групп).
+# compact - (знаков координат, допуск объединения мм) для сжатия плана. Если проверка траектории не пройдена,
+# используется несжатый план с причиной в compact_error.
+# Готовый план проверяется по правилам GRBL 1.1 (grblcheck), ошибки блоков хранятся в плане
+def load_plan(file, cache_dir, pieces_distance, laser=None, speed=None, compact=None, reorder=False, reverse=False):
+    path = os.path.abspath(file.name)
+    stat = os.stat(path)
+    key = repr((path, stat.st_size, stat.st_mtime_ns, pieces_distance, laser, speed, compact, reorder, reverse,
+                PLAN_VERSION))
+    prefix = re.sub(r'\W', '_', os.path.basename(path)) + '-'
+    path_cache = os.path.join(cache_dir, prefix + hashlib.sha1(key.encode()).hexdigest()[:16] + '.plan')
+    try:
+        with open(path_cache, 'rb') as file_cache:
+            return pickle.load(file_cache), True
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError):
+        pass
+
+    plan = compile_plan(file, pieces_distance, laser, speed)
+    if reorder:
+        plan = reorder_plan(plan, file, speed, reverse)
+    if compact:
+        compacted = compact_plan(plan, *compact)
+        plan.compact_error = compacted.compact_error
+        if plan.compact_error is None:
+            plan = compacted
+    plan.errors = check_plan(plan)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Старые планы того же файла больше не нужны
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix):
+                os.remove(os.path.join(cache_dir, name))
+        with open(path_cache + '.tmp', 'wb') as file_cache:
+            pickle.dump(plan, file_cache, pickle.HIGHEST_PROTOCOL)
+        os.replace(path_cache + '.tmp', path_cache)
+    except OSError:
+        pass
+    return plan, False
@@ -0,0 +1,193 @@
+# Расчёт времени исполнения плана цикла с учётом ускорений по настройкам GRBL
+# $110/$111 - максимальная скорость X/Y (мм/мин), $120/$121 - ускорение X/Y (мм/сек²), $11 - junction deviation (мм).
+# Профиль скорости блока - трапеция. Скорость на стыке блоков ограничена так же, как в планировщике GRBL,
+# проходы торможения (назад) и разгона (вперёд) в квадратах скоростей сводятся к накопленному минимуму.
+# С NumPy расчёт векторный, без NumPy - тот же расчёт в цикле. NumPy загружается только при расчёте.
+
+import math
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+np = None
+
+# Значения по умолчанию GRBL 1.1 (defaults.h), если настройка не прочитана
+GRBL_DEFAULTS = {11: 0.010, 110: 500.0, 111: 500.0, 120: 10.0, 121: 10.0}
+
+_SETTING = re.compile(r'\$(\d+)=(-?\d+(\.\d*)?)')
+
+
+# Настройки GRBL из ответа на '$$': {110: 20000.0, ...}
+# Читается напрямую из порта до запуска процесса чтения ответов
+def read_settings(ser):
+    settings = {}
+    ser.write(b'$$\n')
+    while True:
+        line = ser.readline().decode(errors='replace').strip()
+        if not line or line == 'ok' or line.startswith('error'):
+            break
+        match = _SETTING.match(line)
+        if match:
+            settings[int(match.group(1))] = float(match.group(2))
+    return settings
+
+
+class CycleEstimate:
+    __slots__ = ('times', 'start', 'total', 'piece_starts')
+
+    def __init__(self, times, piece):
+        self.times = array('d', times)                      # Расчётное время блока, сек
+        self.start = array('d', accumulate(self.times, initial=0.0))  # Время от начала цикла до блока
+        self.total = self.start[-1]
+        self.piece_starts = [i for i, flag in enumerate(piece) if flag]
+
+    # Время исполнения от точки (i, доля пути) до точки (j, доля пути), сек
+    def time_between(self, i, fraction_i, j, fraction_j):
+        return (self.start[j] + self.times[j]*fraction_j) - (self.start[i] + self.times[i]*fraction_i)
+
+    # Время до конца цикла от точки (i, доля пути)
+    def remaining(self, i, fraction=0.0):
+        return self.total - self.start[i] - self.times[i]*fraction
+
+    # Время до начала следующей детали от точки (i, доля пути) или None после последней
+    def to_next_piece(self, i, fraction=0.0):
+        k = bisect_right(self.piece_starts, i)
+        if k == len(self.piece_starts):
+            return None
+        return self.time_between(i, fraction, self.piece_starts[k], 0.0)
+
+    # Расчётное время деталей цикла
+    def piece_times(self):
+        bounds = [0] + self.piece_starts + [len(self.times)]
+        return [self.start[b] - self.start[a] for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def _limits(settings):
+    value = lambda key: settings.get(key, GRBL_DEFAULTS[key])
+    return value(110) / 60, value(111) / 60, value(120), value(121), value(11)
+
+
+# Расчёт времени блоков плана
+def estimate_plan(plan, settings):
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+    times = _estimate_numpy(plan, settings) if np is not None else _estimate_python(plan, settings)
+    return CycleEstimate(times, plan.piece)
+
+
+def _estimate_numpy(plan, settings):
+    rate_x, rate_y, accel_x, accel_y, junction = _limits(settings)
+    n = len(plan)
+    times = np.zeros(n)
+    length_all = np.frombuffer(plan.xy_move, dtype=np.float64)
+    moves = np.nonzero(length_all > 0)[0]
+    if not len(moves):
+        return times
+
+    x = np.frombuffer(plan.x_end, dtype=np.float64)
+    y = np.frombuffer(plan.y_end, dtype=np.float64)
+    # Координата, неизвестная по файлу (NaN после G28 и т.п.), не даёт перемещения по оси
+    dx = np.nan_to_num(np.diff(x, prepend=0.0)[moves])
+    dy = np.nan_to_num(np.diff(y, prepend=0.0)[moves])
+    length = length_all[moves]
+    feed = np.frombuffer(plan.feed, dtype=np.float64)[moves] / 60
+    chord = np.hypot(dx, dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ux = np.where(chord > 0, dx / chord, 0.0)
+        uy = np.where(chord > 0, dy / chord, 0.0)
+        ax, ay = np.abs(ux), np.abs(uy)
+
+        # Скорость и ускорение вдоль блока ограничены по каждой оси
+        v_max = np.minimum(np.where(ax > 0, rate_x / ax, np.inf), np.where(ay > 0, rate_y / ay, np.inf))
+        v_max = np.where(np.isinf(v_max), min(rate_x, rate_y), v_max)
+        v_max = np.where(feed > 0, np.minimum(feed, v_max), v_max)
+        accel = np.minimum(np.where(ax > 0, accel_x / ax, np.inf), np.where(ay > 0, accel_y / ay, np.inf))
+        accel = np.where(np.isinf(accel), min(accel_x, accel_y), accel)
+
+        # Предельная скорость на стыке (квадрат), первый блок начинается с остановки
+        cos_theta = -(ux[:-1]*ux[1:] + uy[:-1]*uy[1:])
+        sin_half = np.sqrt(np.clip(0.5 * (1.0 - cos_theta), 0.0, 1.0))
+        v_junction = np.where(cos_theta < -0.999999, np.inf,
+                              np.minimum(accel[:-1], accel[1:]) * junction * sin_half / (1.0 - sin_half))
+    v2_max = v_max * v_max
+    entry = np.empty(len(moves) + 1)
+    entry[0] = 0.0
+    entry[1:-1] = np.minimum(v_junction, np.minimum(v2_max[:-1], v2_max[1:]))
+    entry[-1] = 0.0
+
+    # Торможение: entry[i] <= entry[i+1] + 2*a*L, разгон: entry[i+1] <= entry[i] + 2*a*L
+    reach = np.concatenate(([0.0], np.cumsum(2 * accel * length)))
+    backward = np.minimum.accumulate((entry + reach)[::-1])[::-1] - reach
+    forward = reach + np.minimum.accumulate(backward - reach)
+    forward = np.maximum(forward, 0.0)
+    v0, v1 = np.sqrt(forward[:-1]), np.sqrt(forward[1:])
+
+    # Трапеция или треугольник (скорость не достигает максимальной)
+    cruise = length - (2*v2_max - forward[:-1] - forward[1:]) / (2 * accel)
+    peak = np.sqrt(np.minimum((2*accel*length + forward[:-1] + forward[1:]) / 2, v2_max))
+    times[moves] = np.where(cruise >= 0,
+                            (2*v_max - v0 - v1) / accel + np.maximum(cruise, 0.0) / v_max,
+                            (2*peak - v0 - v1) / accel)
+    return times
+
+
+def _estimate_python(plan, settings):
+    rate_x, rate_y, accel_x, accel_y, junction = _limits(settings)
+    times = [0.0] * len(plan)
+    blocks = []     # (индекс, длина, v_max, ускорение, ux, uy)
+    x_prev = y_prev = 0.0
+    for i in range(len(plan)):
+        x, y, length = plan.x_end[i], plan.y_end[i], plan.xy_move[i]
+        dx, dy = x - x_prev, y - y_prev
+        x_prev, y_prev = x, y
+        if dx != dx:
+            dx = 0.0
+        if dy != dy:
+            dy = 0.0
+        if length <= 0:
+            continue
+        chord = math.hypot(dx, dy)
+        ux, uy = (dx / chord, dy / chord) if chord else (0.0, 0.0)
+        rates = [rate / abs(u) for rate, u in ((rate_x, ux), (rate_y, uy)) if u]
+        accels = [accel / abs(u) for accel, u in ((accel_x, ux), (accel_y, uy)) if u]
+        v_max = min(rates) if rates else min(rate_x, rate_y)
+        if plan.feed[i]:
+            v_max = min(plan.feed[i] / 60, v_max)
+        accel = min(accels) if accels else min(accel_x, accel_y)
+        blocks.append((i, length, v_max, accel, ux, uy))
+    if not blocks:
+        return times
+
+    # Предельные скорости на стыках (квадраты)
+    entry = [0.0] * (len(blocks) + 1)
+    for k in range(1, len(blocks)):
+        _, _, v_prev, a_prev, ux_prev, uy_prev = blocks[k-1]
+        _, _, v_max, accel, ux, uy = blocks[k]
+        cos_theta = -(ux_prev*ux + uy_prev*uy)
+        limit = min(v_prev, v_max) ** 2
+        if cos_theta >= -0.999999:
+            sin_half = math.sqrt(min(max(0.5 * (1.0 - cos_theta), 0.0), 1.0))
+            limit = min(limit, min(a_prev, accel) * junction * sin_half / (1.0 - sin_half))
+        entry[k] = limit
+
+    # Торможение (назад) и разгон (вперёд)
+    for k in range(len(blocks) - 1, -1, -1):
+        entry[k] = min(entry[k], entry[k+1] + 2 * blocks[k][3] * blocks[k][1])
+    for k in range(len(blocks)):
+        entry[k+1] = min(entry[k+1], entry[k] + 2 * blocks[k][3] * blocks[k][1])
+
+    for k, (i, length, v_max, accel, _, _) in enumerate(blocks):
+        v0_2, v1_2 = entry[k], entry[k+1]
+        v0, v1 = math.sqrt(v0_2), math.sqrt(v1_2)
+        cruise = length - (2*v_max*v_max - v0_2 - v1_2) / (2 * accel)
+        if cruise >= 0:
+            times[i] = (2*v_max - v0 - v1) / accel + cruise / v_max
+        else:
+            peak = math.sqrt(min((2*accel*length + v0_2 + v1_2) / 2, v_max*v_max))
+            times[i] = (2*peak - v0 - v1) / accel
+    return times
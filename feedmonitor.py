@@ -0,0 +1,120 @@
+# Контроль подачи по отчётам о состоянии
+# Фактическая подача из FS: сравнивается с заданной подачей исполняемого блока плана (F с учётом коррекции скорости).
+# Подача ниже UNDERFEED_RATIO заданной в нескольких отчётах подряд дольше UNDERFEED_TIME - период недобора подачи.
+# Причина по каждому отчёту:
+#  - голодание: в планировщике GRBL не больше STARVED_BLOCKS блоков (Bf:), GRBL тормозит в ожидании блоков от сценария,
+#    или Idle посреди цикла (после первого Run): планировщик опустел и оси остановились
+#    (подача 0 на последнем подготовленном блоке); Idle до первого Run - начало цикла, не недобор;
+#  - станок: планировщик заполнен, подачу ограничивают ускорения, стыки коротких блоков и скорости осей ($110-$121, $11).
+# Без Bf: в отчётах причина - по расчёту времени с ускорениями: блок, который и по расчёту проходится медленнее
+# заданной подачи, - станок, иначе - голодание. Без Bf: и расчёта причина неизвестна.
+# Период относится к причине большинства отчётов.
+
+import time
+
+UNDERFEED_RATIO = 0.8   # Недобор: фактическая подача ниже доли заданной
+UNDERFEED_TIME = 1.0    # Наименьшая длительность периода недобора, сек
+UNDERFEED_REPORTS = 2   # Наименьшее количество отчётов подряд с недобором
+STARVED_BLOCKS = 2      # Планировщик почти пуст: блоков не больше
+
+STARVED, MACHINE, UNKNOWN = 'голодание', 'станок', 'неизвестно'
+
+
+class Underfeed:
+    __slots__ = ('start', 'end', 'first', 'last', 'ratio', 'reports', 'causes')
+
+    def __init__(self, now, index):
+        self.start = now
+        self.end = now          # Первый отчёт с нормальной подачей
+        self.first = index      # Исполняемые блоки
+        self.last = index
+        self.ratio = 1.0        # Наименьшая доля заданной подачи
+        self.reports = 0
+        self.causes = {}        # Причина -> отчётов
+
+    def duration(self):
+        return self.end - self.start
+
+    def cause(self):
+        return max(self.causes, key=self.causes.get)
+
+
+class FeedMonitor:
+    __slots__ = ('plan', 'estimate', 'planner_size', 'ratio', 'min_time', 'active', 'started', 'current', 'periods',
+                 'seconds')
+
+    # planner_size - блоков планировщика (0 - по наибольшему Bf: в отчётах)
+    def __init__(self, plan, estimate=None, planner_size=0, ratio=UNDERFEED_RATIO, min_time=UNDERFEED_TIME):
+        self.plan = plan
+        self.estimate = estimate
+        self.planner_size = planner_size
+        self.ratio = ratio
+        self.min_time = min_time
+        self.begin()
+        self.active = False
+
+    # Начало цикла (отчёты вне цикла - возврат к началу, калибровка - не проверяются)
+    def begin(self):
+        self.active = True
+        self.started = False                                # Был отчёт Run в этом цикле
+        self.current = None                                 # Недобор подачи продолжается
+        self.periods = []                                   # Периоды недобора цикла
+        self.seconds = {STARVED: 0.0, MACHINE: 0.0, UNKNOWN: 0.0}
+
+    # Отчёт о состоянии: position - (индекс блока, доля пути) исполняемого блока или None, override - коррекция подачи, %,
+    # index - последний подготовленный к отправке блок. Возвращает закончившийся период недобора или None
+    def update(self, status, position, override=100, index=None, now=None):
+        now = time.monotonic() if now is None else now
+        if status.planner_free is not None and status.planner_free > self.planner_size:
+            self.planner_size = status.planner_free
+        if not self.active:
+            return None
+        if status.state == 'Run':
+            self.started = True
+        if status.state == 'Run' and position and status.feed is not None:
+            i, feed = position[0], status.feed
+        elif status.state == 'Idle' and self.started and index is not None and index < len(self.plan):
+            i, feed = index, 0.0
+        else:
+            return self._close(now)
+        if not self.plan.feed[i]:
+            return self._close(now)
+        ratio = feed * 100 / (self.plan.feed[i] * override)
+        if ratio >= self.ratio:
+            return self._close(now)
+
+        if self.current is None:
+            self.current = Underfeed(now, i)
+        period = self.current
+        period.last = i
+        period.ratio = min(period.ratio, ratio)
+        period.reports += 1
+        cause = STARVED if status.state == 'Idle' else self._cause(status, i)
+        period.causes[cause] = period.causes.get(cause, 0) + 1
+        return None
+
+    def _cause(self, status, i):
+        if status.planner_free is not None and self.planner_size:
+            return STARVED if self.planner_size - status.planner_free <= STARVED_BLOCKS else MACHINE
+        if self.estimate and self.estimate.times[i]:
+            # Средняя подача блока по расчёту с ускорениями (без коррекции скорости)
+            expected = self.plan.xy_move[i] * 60 / self.estimate.times[i]
+            return MACHINE if expected < self.plan.feed[i] * self.ratio else STARVED
+        return UNKNOWN
+
+    def _close(self, now):
+        period = self.current
+        if period is None:
+            return None
+        self.current = None
+        period.end = now
+        if period.reports < UNDERFEED_REPORTS or period.duration() < self.min_time:
+            return None
+        self.periods.append(period)
+        self.seconds[period.cause()] += period.duration()
+        return period
+
+    # Конец цикла: недобор, продолжавшийся до конца, или None
+    def finish(self):
+        self.active = False
+        return self._close(time.monotonic())
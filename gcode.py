@@ -0,0 +1,242 @@
+# Разбор строк gcode: токенизатор и модальное состояние
+# Строка разбирается за один проход в список слов (буква, значение),
+# модальное состояние (G0/G1/G2/G3, G90/G91, G20/G21, плоскость, F, S, M3/M4/M5, G92, G54..G59)
+# превращает слова в блок с абсолютной целевой позицией и длиной перемещения.
+
+import math
+import re
+
+_WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_PAREN_COMMENT = re.compile(r'\(.*?\)')
+
+# Оси каждой плоскости: (первая, вторая, перпендикулярная), индексы в (x, y, z) и буквы смещений центра дуги
+_PLANES = {17: (0, 1, 2, 'I', 'J'), 18: (2, 0, 1, 'K', 'I'), 19: (1, 2, 0, 'J', 'K')}
+
+_ZERO = (0.0, 0.0, 0.0)
+
+
+# Слова строки gcode: [(буква, значение), ...], комментарии '; ...' и '(...)' пропускаются
+def tokenize(line):
+    if ';' in line:
+        line = line[:line.index(';')]
+    if '(' in line:
+        line = _PAREN_COMMENT.sub('', line)
+    return [(letter, float(value)) for letter, value in _WORD.findall(line.upper())]
+
+
+# Число для строки gcode без лишних нулей: 42.500 -> '42.5'
+def fmt(value, digits=4):
+    text = f'{value:.{digits}f}'.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+# Результат исполнения строки: слова, вид движения, абсолютная цель и перемещения
+class Block:
+    __slots__ = ('words', 'motion', 'x', 'y', 'z', 'dx', 'dy', 'dz', 'length', 'feed', 'power', 'axes')
+
+    def __init__(self, words, motion, target, delta, length, feed, power, axes):
+        self.words = words
+        self.motion = motion            # 0, 1, 2, 3 или None, если строка без перемещения
+        self.x, self.y, self.z = target
+        self.dx, self.dy, self.dz = delta
+        self.length = length            # Длина пути (для дуг - длина дуги), мм
+        self.feed = feed                # Подача мм/мин (для G0 - None)
+        self.power = power              # Мощность лазера S с учётом M5
+        self.axes = axes                # Буквы осей, указанные в строке: 'XY'
+
+
+class ModalState:
+    __slots__ = ('motion', 'absolute', 'scale', 'plane', 'feed', 'power', 'spindle', 'position', 'offset', 'coord')
+
+    def __init__(self):
+        self.motion = 0                 # G0
+        self.absolute = True            # G90
+        self.scale = 1.0                # G21 (мм)
+        self.plane = 17                 # G17
+        self.feed = None
+        self.power = 0.0
+        self.spindle = 0                # 3 или 4 - включен (M3/M4), 0 - выключен (M5)
+        self.position = [0.0, 0.0, 0.0]     # Рабочие координаты, None - неизвестна по файлу (G28, G30, G53)
+        self.offset = [0.0, 0.0, 0.0]       # Смещение G92 (None - неизвестно)
+        self.coord = 54                     # Система координат G54..G59
+
+    def copy(self):
+        state = ModalState()
+        state.motion = self.motion
+        state.absolute = self.absolute
+        state.scale = self.scale
+        state.plane = self.plane
+        state.feed = self.feed
+        state.power = self.power
+        state.spindle = self.spindle
+        state.position = list(self.position)
+        state.offset = list(self.offset)
+        state.coord = self.coord
+        return state
+
+    # Исполнение строки: обновление модального состояния, Block или None для пустой строки
+    # Как в GRBL, модальные слова действуют на всю строку независимо от порядка слов:
+    # сначала G, M, S, затем оси и F в единицах (G20/G21) и режиме (G90/G91) этой строки
+    def step(self, words):
+        if not words:
+            return None
+        x = y = z = feed = None
+        axes = ''
+        non_modal = None        # G4, G10, G28, G30, G92 - оси не являются перемещением
+        machine = False         # G53
+        coord = self.coord
+        for letter, value in words:
+            if letter == 'X':
+                x = value
+                axes += 'X'
+            elif letter == 'Y':
+                y = value
+                axes += 'Y'
+            elif letter == 'S':
+                self.power = value
+            elif letter == 'G':
+                if value in (0, 1, 2, 3):
+                    self.motion = int(value)
+                elif value == 90:
+                    self.absolute = True
+                elif value == 91:
+                    self.absolute = False
+                elif value == 80:
+                    self.motion = None
+                elif value == 20:
+                    self.scale = 25.4
+                elif value == 21:
+                    self.scale = 1.0
+                elif value in (17, 18, 19):
+                    self.plane = int(value)
+                elif value == 53:
+                    machine = True
+                elif value in (54, 55, 56, 57, 58, 59):
+                    coord = int(value)
+                elif value in (4, 10, 28, 30, 92, 28.1, 30.1, 92.1):
+                    non_modal = value
+            elif letter == 'F':
+                feed = value
+            elif letter == 'Z':
+                z = value
+                axes += 'Z'
+            elif letter == 'M':
+                if value in (3, 4):
+                    self.spindle = int(value)
+                elif value in (5, 2, 30):
+                    self.spindle = 0
+
+        scale = self.scale
+        if feed is not None:
+            self.feed = feed * scale
+        if coord != self.coord:
+            # Смещение другой системы координат по файлу неизвестно
+            self.coord = coord
+            self.position = [None, None, None]
+        position = self.position
+        power = self.power if self.spindle else 0.0
+        if non_modal is not None:
+            self._non_modal(non_modal, dict(words), scale)
+            return Block(words, None, self.position, _ZERO, 0.0, self.feed, power, axes)
+        motion = self.motion
+        if not axes or motion is None:
+            return Block(words, None, position, _ZERO, 0.0, self.feed, power, axes)
+
+        if machine:
+            target = [p if v is None else None for p, v in zip(position, (x, y, z))]   # G53: в рабочих неизвестны
+        elif self.absolute:
+            target = list(position)
+            if x is not None:
+                target[0] = x * scale
+            if y is not None:
+                target[1] = y * scale
+            if z is not None:
+                target[2] = z * scale
+        else:
+            # Приращение от неизвестной координаты - неизвестно
+            target = list(position)
+            if x is not None and target[0] is not None:
+                target[0] += x * scale
+            if y is not None and target[1] is not None:
+                target[1] += y * scale
+            if z is not None and target[2] is not None:
+                target[2] += z * scale
+        if None in position or None in target:
+            # Перемещение по оси с неизвестным началом или концом: длина не считается
+            delta = [0.0 if p is None or t is None else t - p for p, t in zip(position, target)]
+            known = not any(v is not None and (p is None or t is None) for p, t, v in zip(position, target, (x, y, z)))
+        else:
+            delta = [target[0] - position[0], target[1] - position[1], target[2] - position[2]]
+            known = True
+        if not known:
+            length = 0.0
+        elif motion == 0 or motion == 1:
+            dx, dy, dz = delta
+            length = math.sqrt(dx*dx + dy*dy + dz*dz)
+        else:
+            # Неизвестная ось без перемещения не влияет на длину дуги: начало и конец по ней совпадают
+            start = [0.0 if p is None else p for p in position]
+            end = [0.0 if p is None else p for p in target]
+            offsets = {letter: value * scale for letter, value in words if letter in 'IJK'}
+            radius = next((value * scale for letter, value in words if letter == 'R'), None)
+            length = self._arc_length(start, end, offsets, radius, motion == 2)
+        self.position = target
+        return Block(words, motion, target, delta, length, None if motion == 0 else self.feed, power, axes)
+
+    # G92, G28, G30, G10: позиция и смещение G92 после строки без перемещения по осям
+    def _non_modal(self, code, values, scale):
+        position = list(self.position)
+        if code == 92:
+            # Текущая точка получает указанные координаты, разница копится в смещении G92
+            offset = list(self.offset)
+            for k, letter in enumerate('XYZ'):
+                if letter in values:
+                    new = values[letter] * scale
+                    if position[k] is None or offset[k] is None:
+                        offset[k] = None
+                    else:
+                        offset[k] += position[k] - new
+                    position[k] = new
+            self.offset = offset
+        elif code == 92.1:
+            position = [None if p is None or o is None else p + o for p, o in zip(position, self.offset)]
+            self.offset = [0.0, 0.0, 0.0]
+        elif code == 28 or code == 30:
+            # Переход в сохранённую точку (G28.1/G30.1): её рабочие координаты по файлу неизвестны
+            position = [None, None, None]
+        elif code == 10:
+            p = values.get('P', 0)
+            if p == 0 or p + 53 == self.coord:
+                # Смещение текущей системы координат: L20 задаёт текущей точке указанные координаты
+                for k, letter in enumerate('XYZ'):
+                    if letter in values:
+                        position[k] = values[letter] * scale if values.get('L') == 20 else None
+        self.position = position
+
+    # Длина дуги G2/G3 по центру (I, J, K) или радиусу (R)
+    def _arc_length(self, start, target, offsets, radius, clockwise):
+        a, b, c, oa, ob = _PLANES[self.plane]
+        sa, sb = start[a], start[b]
+        ea, eb = target[a], target[b]
+        if radius is None:
+            ca, cb = sa + offsets.get(oa, 0.0), sb + offsets.get(ob, 0.0)
+            r = math.hypot(sa - ca, sb - cb)
+        else:
+            # Центр по радиусу: для R < 0 дуга больше 180 градусов
+            r = abs(radius)
+            da, db = ea - sa, eb - sb
+            chord = math.hypot(da, db)
+            if chord == 0 or chord > 2*r + 1e-9:
+                return math.hypot(chord, target[c] - start[c])
+            h = math.sqrt(max(r*r - chord*chord/4, 0.0))
+            if clockwise != (radius < 0):
+                h = -h
+            ca = sa + da/2 - h*db/chord
+            cb = sb + db/2 + h*da/chord
+        angle = math.atan2(eb - cb, ea - ca) - math.atan2(sb - cb, sa - ca)
+        if clockwise:
+            if angle >= 0:
+                angle -= 2*math.pi
+        elif angle <= 0:
+            angle += 2*math.pi
+        return math.hypot(abs(angle) * r, target[c] - start[c])
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+
+# Проверка gcode без станка по правилам разбора GRBL 1.1 (protocol.c, gcode.c, system.c)
+# Вместо прогона файла через GRBL в режиме проверки ($C) на скорости порта: те же коды ошибок тех же строк
+# за один проход на ПК. Строка очищается как в protocol.c (пробелы, комментарии, верхний регистр, не длиннее 79 знаков),
+# слова проверяются на повторы, конфликты модальных групп и осей, отрицательные значения, затем блок проверяется
+# по модальному состоянию: подача G1/G2/G3, P/L для G4/G10, G80 с осями, дуги, неиспользованные слова.
+# Позиция отслеживается в рабочих координатах, после G28/G30/G53/G92.1, смены системы координат и т. п. она
+# неизвестна, и проверки дуг по позиции пропускаются до следующего перемещения в абсолютных координатах.
+# Не проверяются ошибки, зависящие от состояния и настроек станка: 5, 8, 9, 10, 13, 15 и ALARM:2 (пределы).
+# Сборка GRBL по умолчанию (config.h): без M7, M56, $HX и единичных осей калибровки.
+# Пример: python grblcheck.py test.gcode
+
+import math
+import re
+
+from grblmessages import grbl_errors, grbl_settings
+
+MAX_LINE = 79               # LINE_BUFFER_SIZE - 1: длина строки без пробелов и комментариев
+MAX_LINE_NUMBER = 10000000
+MAX_TOOL_NUMBER = 255
+N_COORDINATE_SYSTEM = 6
+MM_PER_INCH = 25.4
+
+_WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+_BLOCK = re.compile(r'(?:[A-Z][-+]?(?:\d+\.?\d*|\.\d+))*')
+_BAD_BLOCK = re.compile(r'^(?!(?:[A-Z][-+]?(?:\d+\.?\d*|\.\d+))*$)', re.MULTILINE)
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)')
+_COMMENT = re.compile(r'\([^)\n]*\)?|;[^\n]*')
+_DELETE = dict.fromkeys([*range(10), *range(11, 33), ord('/')])     # Пробелы, управляющие символы и '/' (block delete)
+
+_VALUE_LETTERS = frozenset('FIJKLNPRST')
+_AXES = 'XYZ'
+_AXIS_INDEX = {'X': 0, 'Y': 1, 'Z': 2}
+_PLANES = {17: ('X', 'Y', 'I', 'J'), 18: ('Z', 'X', 'K', 'I'), 19: ('Y', 'Z', 'J', 'K')}
+_UNKNOWN = (None, None, None)
+
+# Команды, заданные осями (axis_command в gcode.c)
+_NON_MODAL, _MOTION, _TOOL_LENGTH = 1, 2, 3
+
+
+# Строки в том виде, в котором их принимает GRBL: без пробелов и комментариев, в верхнем регистре.
+# Весь текст обрабатывается сразу, строки разделены '\n'
+def strip_text(text):
+    if '(' in text or ';' in text:
+        text = _COMMENT.sub('', text)
+    return text.translate(_DELETE).upper()
+
+
+def strip_line(line):
+    return strip_text(line.replace('\n', ''))
+
+
+class GrblChecker:
+    __slots__ = ('motion', 'plane', 'absolute', 'inches', 'inverse_time', 'feed', 'coord', 'position')
+
+    def __init__(self):
+        self.motion = 0                 # G0, G38.2-G38.5 - 140-143, G80 - 80
+        self.plane = 17
+        self.absolute = True            # G90
+        self.inches = False             # G20
+        self.inverse_time = False       # G93
+        self.feed = 0.0                 # 0 - подача не задана
+        self.coord = 0                  # G54
+        self.position = _UNKNOWN        # Рабочие координаты, мм (None - неизвестна)
+
+    # Код ошибки GRBL для строки, 0 - ok
+    def check(self, line):
+        return self.check_block(strip_line(line))
+
+    # Код ошибки для очищенной строки (strip_text), valid - формат слов уже проверен
+    def check_block(self, text, valid=None):
+        if len(text) > MAX_LINE:
+            return 11
+        if not text:
+            return 0
+        if text[0] == '$':
+            return self._system(text)
+        return self._gcode(text, False, valid)
+
+    # Системные команды '$' (system_execute_line)
+    def _system(self, text):
+        if len(text) == 1:
+            return 0
+        command = text[1]
+        if command == 'J':
+            return self._gcode(text[3:], True) if text[2:3] == '=' else 3
+        if command in '$GCX#H':
+            return 0 if len(text) == 2 else 3
+        if command == 'S':
+            return 0 if text == '$SLP' else 3
+        if command == 'I':
+            return 0 if len(text) == 2 or text[2] == '=' else 3
+        if command == 'R':
+            return 0 if text in ('$RST=$', '$RST=#', '$RST=*') else 3
+        startup = command == 'N'
+        if startup and len(text) == 2:
+            return 0
+        match = _NUMBER.match(text, 2 if startup else 1)
+        if not match:
+            return 2
+        parameter = float(match.group())
+        position = match.end()
+        if text[position:position + 1] != '=':
+            return 3
+        if startup:
+            return self._gcode(text[position + 1:])
+        match = _NUMBER.match(text, position + 1)
+        if not match:
+            return 2
+        if match.end() != len(text) or not 0 <= parameter <= 255:
+            return 3
+        value = float(match.group())
+        if value < 0:
+            return 4
+        if int(parameter) not in grbl_settings:
+            return 3
+        if int(parameter) == 0 and int(value) < 3:
+            return 6
+        return 0
+
+    # Блок gcode (gc_execute_line): разбор слов, проверка и изменение модального состояния
+    def _gcode(self, text, jog=False, valid=None):
+        format_error = 0
+        if valid is None:
+            valid = _BLOCK.fullmatch(text) is not None
+        if not valid:
+            length, format_error = _format_error(text)
+            text = text[:length]
+
+        # Слова блока (шаг 2): повторы, модальные группы, конфликты команд с осями
+        groups = 0                      # Биты модальных групп (M - 14, 15, 16)
+        axis_command = 0
+        non_modal = 0
+        motion = 1 if jog else self.motion
+        plane, absolute, inches = self.plane, self.absolute, self.inches
+        inverse_time = False if jog else self.inverse_time
+        coord = self.coord
+        tool_length = None
+        program_end = False
+        values = {}
+        axes = ''                       # Буквы осей в порядке слов
+        others = ''                     # I, J, K, L, P, R - используются только некоторыми командами
+        for letter, number in _WORD.findall(text):
+            if letter in _AXES:
+                if letter in values:
+                    return 25
+                values[letter] = float(number)
+                axes += letter
+                continue
+            value = float(number)
+            if letter == 'G' or letter == 'M':
+                int_value = int(value)
+                mantissa = round(100 * (value - int_value))
+                if value < 0 or int_value > 255:
+                    return 20
+                if letter == 'M':
+                    if mantissa > 0:
+                        return 23
+                    if int_value in (0, 1, 2, 30):
+                        group = 14
+                        program_end = int_value in (2, 30)
+                    elif int_value in (3, 4, 5):
+                        group = 15
+                    elif int_value in (8, 9):
+                        group = 16
+                    else:
+                        return 20
+                    if groups >> group & 1:
+                        return 21
+                    groups |= 1 << group
+                    continue
+                if int_value in (10, 28, 30, 92, 4, 53):
+                    if int_value not in (4, 53) and mantissa == 0:
+                        if axis_command:
+                            return 24
+                        axis_command = _NON_MODAL
+                    group = 0
+                    non_modal = int_value
+                    if int_value in (28, 30, 92):
+                        if mantissa not in (0, 10):
+                            return 20
+                        non_modal += mantissa
+                        mantissa = 0
+                elif int_value in (0, 1, 2, 3, 38, 80):
+                    if int_value != 80:
+                        if axis_command:
+                            return 24
+                        axis_command = _MOTION
+                    group = 1
+                    motion = int_value
+                    if int_value == 38:
+                        if mantissa not in (20, 30, 40, 50):
+                            return 20
+                        motion = 138 + mantissa // 10
+                        mantissa = 0
+                elif int_value in (17, 18, 19):
+                    group = 2
+                    plane = int_value
+                elif int_value in (90, 91):
+                    if mantissa == 0:
+                        group = 3
+                        absolute = int_value == 90
+                    else:
+                        group = 4
+                        if mantissa != 10 or int_value == 90:
+                            return 20
+                        mantissa = 0
+                elif int_value in (93, 94):
+                    group = 5
+                    inverse_time = int_value == 93
+                elif int_value in (20, 21):
+                    group = 6
+                    inches = int_value == 20
+                elif int_value == 40:
+                    group = 7
+                elif int_value in (43, 49):
+                    group = 8
+                    if axis_command:
+                        return 24
+                    axis_command = _TOOL_LENGTH
+                    if int_value == 49:
+                        tool_length = False
+                    elif mantissa == 10:
+                        tool_length = True
+                    else:
+                        return 20
+                    mantissa = 0
+                elif 54 <= int_value <= 59:
+                    group = 12
+                    coord = int_value - 54
+                elif int_value == 61:
+                    group = 13
+                    if mantissa != 0:
+                        return 20
+                else:
+                    return 20
+                if mantissa > 0:
+                    return 23
+                if groups >> group & 1:
+                    return 21
+                groups |= 1 << group
+                continue
+            if letter not in _VALUE_LETTERS:
+                return 20
+            if letter == 'T' and value > MAX_TOOL_NUMBER:
+                return 38
+            if letter in values:
+                return 25
+            if value < 0 and letter in 'FNPST':
+                return 4
+            values[letter] = value
+            if letter in 'IJKLPR':
+                others += letter
+        if format_error:
+            return format_error
+
+        # Проверка блока (шаг 3)
+        if axes and not axis_command:
+            axis_command = _MOTION
+        if 'N' in values and int(values['N']) > MAX_LINE_NUMBER:
+            return 27
+        scale = MM_PER_INCH if inches else 1.0
+
+        # Подача: в G93 - F в каждом блоке перемещения, в G94 - последняя заданная
+        f = values.get('F')
+        if jog:
+            if f is None:
+                return 22
+            feed = f * scale
+        elif inverse_time:
+            if axis_command == _MOTION and motion not in (0, 80) and f is None:
+                return 22
+            feed = f or 0.0
+        elif self.inverse_time:
+            feed = f or 0.0
+        else:
+            feed = f * scale if f is not None else self.feed
+
+        used = ''                       # Использованные слова из others
+        if non_modal == 4:
+            if 'P' not in values:
+                return 28
+            used = 'P'
+        if axis_command == _TOOL_LENGTH and tool_length and axes != 'Z':
+            return 37
+
+        position = self.position if coord == self.coord else _UNKNOWN
+        target = position
+        new_position = None             # Позиция после блока, если не target
+        if non_modal == 10:
+            if not axes:
+                return 26
+            if 'P' not in values and 'L' not in values:
+                return 28
+            system = int(values.get('P', 0))
+            if system > N_COORDINATE_SYSTEM:
+                return 29
+            l_value = int(values.get('L', 0))
+            if l_value != 20 and (l_value != 2 or 'R' in values):
+                return 20
+            used = 'LP'
+            if system == 0 or system - 1 == coord:
+                new_position = list(position)
+                for axis in axes:
+                    new_position[_AXIS_INDEX[axis]] = values[axis] * scale if l_value == 20 else None
+        elif non_modal == 92:
+            if not axes:
+                return 26
+            new_position = list(position)
+            for axis in axes:
+                new_position[_AXIS_INDEX[axis]] = values[axis] * scale
+        else:
+            if axes and axis_command != _TOOL_LENGTH:
+                target = list(position)
+                for axis in axes:
+                    k = _AXIS_INDEX[axis]
+                    if non_modal == 53:
+                        target[k] = None
+                    elif absolute:
+                        target[k] = values[axis] * scale
+                    elif position[k] is not None:
+                        target[k] = position[k] + values[axis] * scale
+            if non_modal in (28, 30):
+                if not axes:
+                    axis_command = 0
+                new_position = _UNKNOWN
+            elif non_modal == 102:
+                new_position = _UNKNOWN
+            elif non_modal == 53 and motion not in (0, 1):
+                return 30
+
+        # Режимы движения
+        if motion == 80:
+            if axes:
+                return 31
+        elif axis_command == _MOTION:
+            if motion == 0:
+                if not axes:
+                    axis_command = 0
+            else:
+                if not feed:
+                    return 22
+                if motion == 1:
+                    if not axes:
+                        axis_command = 0
+                elif motion in (2, 3):
+                    if not axes:
+                        return 26
+                    axis_0, axis_1, offset_0, offset_1 = _PLANES[plane]
+                    if axis_0 not in axes and axis_1 not in axes:
+                        return 32
+                    x = _delta(target, position, _AXIS_INDEX[axis_0])
+                    y = _delta(target, position, _AXIS_INDEX[axis_1])
+                    if 'R' in values:
+                        used += 'R'
+                        if _same_target(target, position, axes):
+                            return 33
+                        r = values['R'] * scale
+                        if x is not None and y is not None and 4.0*r*r - x*x - y*y < 0:
+                            return 34
+                    else:
+                        if offset_0 not in values and offset_1 not in values:
+                            return 35
+                        used += 'IJK'
+                        if x is not None and y is not None:
+                            i = values.get(offset_0, 0.0) * scale
+                            j = values.get(offset_1, 0.0) * scale
+                            r = math.hypot(i, j)
+                            delta_r = abs(math.hypot(x - i, y - j) - r)
+                            if delta_r > 0.005 and (delta_r > 0.5 or delta_r > 0.001 * r):
+                                return 33
+                else:
+                    if not axes:
+                        return 26
+                    if _same_target(target, position, axes):
+                        return 33
+                    new_position = _UNKNOWN
+
+        # Неиспользованные слова
+        for letter in others:
+            if letter not in used:
+                return 36
+        if axes and not axis_command or jog and ('S' in values or 'T' in values):
+            return 36
+
+        if jog:
+            if groups & ~0b1001001 or non_modal not in (0, 53):
+                return 16
+            self.position = tuple(target)
+            return 0
+
+        # Изменение состояния (шаг 4)
+        self.feed = feed
+        if groups:
+            self.motion, self.plane, self.absolute, self.inches = motion, plane, absolute, inches
+            self.inverse_time, self.coord = inverse_time, coord
+        if new_position is not None:
+            position = new_position
+        elif axis_command == _MOTION:
+            position = target
+        if tool_length is not None:
+            position = (position[0], position[1], None)
+        self.position = tuple(position)
+        # M2/M30: модальное состояние по умолчанию (G1 в GRBL 1.1)
+        if program_end:
+            self.motion, self.plane, self.absolute, self.inverse_time = 1, 17, True, False
+            if self.coord:
+                self.coord = 0
+                self.position = _UNKNOWN
+        return 0
+
+
+# Ошибка формата слова: (длина правильного начала строки, 1 - нет буквы, 2 - нет числа)
+def _format_error(text):
+    position = 0
+    while True:
+        match = _WORD.match(text, position)
+        if not match:
+            return position, 2 if 'A' <= text[position] <= 'Z' else 1
+        position = match.end()
+
+
+# Смещение по оси от текущей позиции до цели, None - позиция неизвестна
+def _delta(target, position, k):
+    if target[k] is None or position[k] is None:
+        return None
+    return target[k] - position[k]
+
+
+# Цель совпадает с текущей позицией (False, если позиция неизвестна)
+def _same_target(target, position, axes):
+    for axis in axes:
+        k = _AXIS_INDEX[axis]
+        if target[k] is None or position[k] is None or target[k] != position[k]:
+            return False
+    return True
+
+
+# Ошибки текста gcode: [(индекс строки, код)]
+# Очистка строк и поиск строк с неверным форматом слов - по всему тексту сразу
+def check_text(text):
+    text = strip_text(text)
+    bad = set()
+    line, last = 0, 0
+    for match in _BAD_BLOCK.finditer(text):
+        line += text.count('\n', last, match.start())
+        last = match.start()
+        bad.add(line)
+    checker = GrblChecker()
+    check, gcode = checker.check_block, checker._gcode
+    errors = []
+    for i, block in enumerate(text.split('\n')):
+        if not block:
+            continue
+        if len(block) > MAX_LINE or block[0] == '$' or i in bad:
+            code = check(block)
+        else:
+            code = gcode(block, False, True)
+        if code:
+            errors.append((i, code))
+    return errors
+
+
+# Ошибки плана цикла (блоки в том виде, в котором отправляются): [(индекс блока, код)]
+def check_plan(plan):
+    return check_text(plan.wire.decode(errors='replace'))
+
+
+def error_text(code):
+    return f'error:{code} {grbl_errors.get(code, "")}'
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import time
+    from colorama import init, Fore, Style
+    init()
+
+    parser = argparse.ArgumentParser(description='Check g-code file by GRBL 1.1 parser rules')
+    parser.add_argument('gcode_file', nargs='+', help='g-code filename')
+    parser.add_argument('-n', '--max-errors', type=int, action='store', default=50, help='errors shown per file')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.gcode_file:
+        with open(path, errors='replace') as file:
+            text = file.read()
+        start = time.perf_counter()
+        errors = check_text(text)
+        seconds = time.perf_counter() - start
+        lines = text.split('\n')
+        size = os.path.getsize(path)
+        print(f"{path}: строк {len(lines)}, {seconds:.2f} сек ({size / seconds / 1e6 if seconds else 0:.1f} МБ/с)")
+        for i, code in errors[:args.max_errors]:
+            print(Fore.RED + f"  строка {i + 1}: {lines[i].strip()} >>> {error_text(code)}" + Style.RESET_ALL)
+        if len(errors) > args.max_errors:
+            print(Fore.RED + f"  ... всего ошибок {len(errors)}" + Style.RESET_ALL)
+        if errors:
+            failed = True
+        else:
+            print(Fore.GREEN + "  ошибок нет" + Style.RESET_ALL)
+    exit(1 if failed else 0)
@@ -0,0 +1,322 @@
+# Чтение ответов GRBL в отдельном потоке и отправка плана цикла
+# Поток забирает из порта всё, что накопилось, делит на строки и один раз классифицирует их.
+# Подтверждения, отчёты о состоянии, аварии и прочие сообщения попадают в отдельные очереди,
+# поэтому отправка блоков ждёт только подтверждений, а вывод на экран и GUI работают в своём темпе.
+# Отчёт о состоянии разбирается один раз при чтении в запись GrblStatus.
+# В порт пишет только поток Transmitter: блоки встают в очередь, realtime-байты отправляются раньше очереди.
+
+import collections
+import os
+import queue
+import select
+import threading
+import time
+
+import serial
+
+
+# Отчёт о состоянии GRBL: <Run|WPos:1.000,2.000,0.000|Bf:15,128|FS:500,0|Ov:100,100,100>
+# Отсутствующие в отчёте поля - None, str(status) - исходная строка отчёта
+class GrblStatus:
+
+    __slots__ = ('raw', 'state', 'substate', 'mpos', 'wpos', 'wco', 'feed', 'spindle',
+                 'planner_free', 'rx_free', 'overrides', 'pins', 'line', 'accessories')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.state = ''             # Idle, Run, Hold, Jog, Alarm, Door, Check, Home, Sleep
+        self.substate = None        # Hold:0, Door:1
+        self.mpos = None            # Машинные координаты (x, y, z)
+        self.wpos = None            # Рабочие координаты (x, y, z)
+        self.wco = None             # Смещение рабочих координат: WPos = MPos - WCO
+        self.feed = None            # Текущая подача, мм/мин
+        self.spindle = None         # Текущая мощность (S)
+        self.planner_free = None    # Свободные блоки планировщика (Bf, $10=2)
+        self.rx_free = None         # Свободные байты приёмного буфера (Bf, $10=2)
+        self.overrides = None       # (подача, ускоренные, шпиндель) в %
+        self.pins = None            # Сработавшие входы: 'XYZPDHRS'
+        self.line = None            # Номер строки (Ln, N в gcode)
+        self.accessories = None     # Состояние шпинделя и охлаждения: 'SCFM'
+
+    def __str__(self):
+        return self.raw
+
+
+# Разбор отчётов о состоянии с учётом WCO
+# GRBL передаёт WCO не в каждом отчёте, поэтому последнее смещение сохраняется между отчётами
+class StatusParser:
+
+    __slots__ = ('wco',)
+
+    def __init__(self):
+        self.wco = None
+
+    def parse(self, raw):
+        status = GrblStatus(raw)
+        fields = raw.strip('<>').split('|')
+        state, _, substate = fields[0].partition(':')
+        status.state = state
+        if substate:
+            status.substate = int(substate)
+        for field in fields[1:]:
+            key, _, value = field.partition(':')
+            if key == 'WPos':
+                status.wpos = tuple(map(float, value.split(',')))
+            elif key == 'MPos':
+                status.mpos = tuple(map(float, value.split(',')))
+            elif key == 'Bf':
+                status.planner_free, status.rx_free = map(int, value.split(','))
+            elif key == 'FS':
+                status.feed, status.spindle = map(float, value.split(','))
+            elif key == 'F':
+                status.feed = float(value)
+            elif key == 'Ov':
+                status.overrides = tuple(map(int, value.split(',')))
+            elif key == 'WCO':
+                self.wco = tuple(map(float, value.split(',')))
+            elif key == 'Pn':
+                status.pins = value
+            elif key == 'Ln':
+                status.line = int(value)
+            elif key == 'A':
+                status.accessories = value
+
+        # Пересчёт MPos <-> WPos по последнему известному смещению
+        wco = status.wco = self.wco
+        if wco:
+            if status.mpos and not status.wpos:
+                status.wpos = tuple(m - o for m, o in zip(status.mpos, wco))
+            elif status.wpos and not status.mpos:
+                status.mpos = tuple(w + o for w, o in zip(status.wpos, wco))
+        return status
+
+
+# Тип строки ответа GRBL и её значение: ('ack', 0|N), ('status', '<...>'), ('alarm', N), ('message', '...')
+def classify_line(line):
+    if line == b'ok':
+        return 'ack', 0
+    if line.startswith(b'<'):
+        return 'status', line.decode(errors='replace')
+    if line.startswith(b'error:'):
+        return 'ack', int(line[6:])
+    if line.startswith(b'ALARM:'):
+        return 'alarm', int(line[6:])
+    if line:
+        return 'message', line.decode(errors='replace')
+    return None, None
+
+
+class GrblReader(threading.Thread):
+
+    def __init__(self, ser):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.acks = queue.Queue()       # 0 - 'ok', N - 'error:N'
+        self.status = queue.Queue()     # GrblStatus из '<Idle|WPos:...>'
+        self.alarms = queue.Queue()     # N из 'ALARM:N'
+        self.messages = queue.Queue()   # Прочие строки: '[MSG:...]', 'Grbl 1.1h [...]'
+        self.running = True
+        self.parser = StatusParser()
+        self.queues = {'ack': self.acks, 'status': self.status, 'alarm': self.alarms, 'message': self.messages}
+        self.trace = None               # StreamTrace: время прихода подтверждений и отчётов
+
+    def run(self):
+        tail = b''
+        while self.running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError):
+                break   # Порт закрыт
+            if not data:
+                continue
+            lines = (tail + data).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                self.classify(line.strip())
+
+    def classify(self, line):
+        kind, value = classify_line(line)
+        if kind == 'status':
+            value = self.parser.parse(value)
+        if kind:
+            if self.trace is not None:
+                self.trace.reply(kind, value)
+            self.queues[kind].put(value)
+
+    def stop(self):
+        self.running = False
+
+
+# Единственный писатель в порт: блоки и команды из любых потоков - в очередь, realtime-байты ('?', '!', '~', 0x18,
+# 0x90-0x9D) - в отдельную очередь, которая отправляется первой, не дожидаясь очереди блоков.
+# GRBL забирает realtime-байты из потока в любом месте, в том числе внутри строки.
+# Запись без блокировки, остаток дописывается по готовности порта, realtime-байты не ждут всей очереди блоков.
+class Transmitter:
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.hold_latency = []              # Задержка записи '!' в порт от вызова realtime(), сек
+        self.writes = 0                     # Записей блоков в порт (пакетов)
+        self.bytes_written = 0
+        self._urgent = bytearray()
+        self._blocks = bytearray()
+        self._hold_times = collections.deque()  # Время вызова realtime(b'!') для неотправленных '!'
+        self._fd = ser.fileno() if os.name == 'posix' else None
+        self._ready = threading.Condition()
+        self.running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # Блок или команда gcode
+    def write(self, data):
+        with self._ready:
+            self._blocks += data
+            self._ready.notify()
+
+    def realtime(self, data):
+        with self._ready:
+            if b'!' in data:
+                self._hold_times.append(time.perf_counter())
+            self._urgent += data
+            self._ready.notify()
+
+    def run(self):
+        while True:
+            with self._ready:
+                while self.running and not self._urgent and not self._blocks:
+                    self._ready.wait()
+                if not self.running:
+                    return
+                lane = self._urgent or self._blocks
+                data = bytes(lane)
+            try:
+                sent = self.ser.write(data)
+            except (serial.SerialException, OSError):
+                return  # Порт закрыт
+            sent = len(data) if sent is None else sent
+            with self._ready:
+                if lane is self._urgent:
+                    for _ in range(data[:sent].count(b'!')):
+                        self.hold_latency.append(time.perf_counter() - self._hold_times.popleft())
+                else:
+                    self.writes += 1
+                    self.bytes_written += sent
+                del lane[:sent]
+            if sent < len(data):
+                # Буфер передачи заполнен: ожидание готовности порта (Windows - короткая пауза)
+                if self._fd is not None:
+                    select.select([], [self._fd], [], 0.05)
+                else:
+                    time.sleep(0.001)
+
+    def stop(self):
+        with self._ready:
+            self.running = False
+            self._ready.notify()
+        self._thread.join()
+
+
+class Streamer:
+
+    # on_block(i) - подготовка блока, False - остановить цикл перед блоком
+    # on_send(i), on_ack(code, i) - вывод отправки и ответа, on_error(code, i) - ошибка в ответ на блок
+    # trace - StreamTrace для записи отправок (None - без трассировки)
+    def __init__(self, ser, reader, plan, rx_size=128, simple=False,
+                 on_block=None, on_send=None, on_ack=None, on_error=None, trace=None):
+        self.ser = ser
+        self.reader = reader
+        self.plan = plan
+        self.rx_size = rx_size
+        self.simple = simple
+        self.on_block = on_block or (lambda i: True)
+        self.on_send = on_send or (lambda i: None)
+        self.on_ack = on_ack or (lambda code, i: None)
+        self.on_error = on_error or (lambda code, i: None)
+        self.trace = trace
+        self.c_line = collections.deque()   # (индекс блока, длина) отправленных и не подтверждённых блоков
+        self.c_sum = 0                      # Байт в приёмном буфере GRBL
+
+    def _ack(self, code):
+        index, length = self.c_line.popleft()
+        self.c_sum -= length
+        self.on_ack(code, index)
+        if code:
+            self.on_error(code, index)
+
+    # Отправка одного цикла по плану с блока start, возвращает индекс блока, на котором цикл закончен
+    def stream_cycle(self, start=0):
+        plan = self.plan
+        acks = self.reader.acks
+        l_end = len(plan)
+
+        # Простой способ отправки команд (без буфера)
+        if self.simple:
+            # Send settings file via simple call-response streaming method. Settings must be streamed
+            # in this manner since the EEPROM accessing cycles shut-off the serial interrupt.
+            for i in range(start, len(plan)):
+                if not self.on_block(i):
+                    return i
+                self.c_line.append((i, plan.lengths[i]))
+                self.on_send(i)
+                if self.trace is not None:
+                    self.trace.send(i, plan.lengths[i], plan.lengths[i])
+                self.ser.write(plan.block(i))
+                self._ack(acks.get())
+            return l_end
+
+        # Send g-code program via a more agressive streaming protocol that forces characters into
+        # Grbl's serial read buffer to ensure Grbl has immediate access to the next g-code command
+        # rather than wait for the call-response serial protocol to finish. This is done by careful
+        # counting of the number of characters sent by the streamer to Grbl and tracking Grbl's
+        # responses, such that we never overflow Grbl's serial read buffer.
+        # Блоки, помещающиеся в свободное место буфера, записываются в порт одной записью (срез plan.wire).
+        lengths = plan.lengths
+        first = start   # Первый блок, ещё не записанный в порт
+        for i in range(start, len(plan)):
+            if not self.on_block(i):
+                l_end = i
+                break
+
+            # Блок не помещается в буфер: записать накопленные блоки и ждать подтверждений,
+            # уже пришедшие подтверждения забрать без ожидания
+            length = lengths[i]
+            if self.c_sum + length >= self.rx_size-1:
+                self._write(first, i)
+                first = i
+                while self.c_sum + length >= self.rx_size-1 or not acks.empty():
+                    self._ack(acks.get())
+
+            self.c_line.append((i, length)) # Track number of characters in grbl serial read buffer
+            self.c_sum += length
+        self._write(first, l_end)
+
+        # Wait until all responses have been received.
+        while self.c_line:
+            self._ack(acks.get())
+        return l_end
+
+    # Запись блоков first..end (не включая end) одним срезом plan.wire
+    def _write(self, first, end):
+        if end <= first:
+            return
+        plan = self.plan
+        for i in range(first, end):
+            self.on_send(i)
+        offset = plan.offsets[first]
+        if self.trace is not None:
+            # Блоки first..end уже учтены в c_sum
+            fill = self.c_sum - (plan.offsets[end-1] + plan.lengths[end-1] - offset)
+            for i in range(first, end):
+                fill += plan.lengths[i]
+                self.trace.send(i, fill, plan.lengths[i])
+        self.ser.write(memoryview(plan.wire)[offset:plan.offsets[end-1] + plan.lengths[end-1]])
+
+    # Команды вне плана (G90, $H): отправка по одной с ожиданием ответа, код последнего ответа
+    def command(self, *blocks):
+        code = 0
+        for data in blocks:
+            if self.trace is not None:
+                self.trace.send(-1, len(data), len(data))
+            self.ser.write(data)
+            code = self.reader.acks.get()
+        return code
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+# Имитатор GRBL 1.1 на псевдотерминале для проверки сценария без станка
+# Моделируются: приёмный буфер (128 байт), очередь планировщика, время перемещений по подаче и ускорению,
+# ответы ok/error:N, отчёты '?' с WPos/Bf/FS/Ov, realtime-команды и канал связи с ограниченной скоростью и задержкой.
+# --packet-time - время передачи пакета сверх байтов (Bluetooth): каждая запись хоста в порт - отдельный пакет,
+# ответы GRBL, появившиеся, пока канал занят, модуль связи собирает в один пакет.
+# Пример: python grblsim.py --latency 0.02    затем    python stream.py -p /dev/pts/N test.gcode
+
+import argparse
+import collections
+import math
+import os
+import select
+import threading
+import time
+import tty
+
+from gcode import ModalState, tokenize
+
+BANNER = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+REALTIME = b'?!~\x18' + bytes(range(0x90, 0x9E))
+
+# Коды G, поддерживаемые GRBL 1.1
+G_CODES = {0, 1, 2, 3, 4, 10, 17, 18, 19, 20, 21, 28, 30, 38.2, 38.3, 38.4, 38.5, 40, 43.1, 49,
+           53, 54, 55, 56, 57, 58, 59, 61, 80, 90, 91, 91.1, 92, 92.1, 93, 94}
+M_CODES = {0, 1, 2, 3, 4, 5, 7, 8, 9, 30, 56}
+
+
+class SimBlock:
+    __slots__ = ('start', 'target', 'length', 'feed', 'power', 'rapid', 'unit', 'done')
+
+    def __init__(self, start, target, length, feed, power, rapid):
+        self.start = start
+        self.target = target
+        self.length = length
+        self.feed = feed            # мм/мин
+        self.power = power
+        self.rapid = rapid          # G0: подача - максимальная скорость, коррекция rapid
+        self.unit = [(t - s) / length for s, t in zip(start, target)] if length else [0.0, 0.0, 0.0]
+        self.done = 0.0             # Пройдено, мм
+
+
+# Канал связи: скорость (байт/сек), задержка доставки (сек) и время на пакет (сек) в одном направлении
+class Link:
+
+    def __init__(self, baud, latency, packet_time=0.0, merge=False):
+        self.byte_time = 10.0 / baud if baud else 0.0
+        self.latency = latency
+        self.packet_time = packet_time
+        self.merge = merge                  # Дописывать в пакет, ожидающий передачи
+        self.free_time = 0.0
+        self.start_time = 0.0               # Начало передачи последнего пакета
+        self.queue = collections.deque()    # (время доставки, байты)
+
+    def send(self, data, now):
+        if self.merge and self.queue and self.start_time > now:
+            self.free_time += len(data) * self.byte_time
+            self.queue[-1] = (self.free_time + self.latency, self.queue[-1][1] + data)
+            return
+        self.start_time = max(self.free_time, now)
+        self.free_time = self.start_time + self.packet_time + len(data) * self.byte_time
+        self.queue.append((self.free_time + self.latency, data))
+
+    def receive(self, now):
+        data = b''
+        while self.queue and self.queue[0][0] <= now:
+            data += self.queue.popleft()[1]
+        return data
+
+    def next_time(self):
+        return self.queue[0][0] if self.queue else None
+
+
+class GrblSim(threading.Thread):
+
+    def __init__(self, rx_size=128, planner_size=16, baud=115200, latency=0.0,
+                 accel=1000.0, max_rate=20000.0, junction=0.01, status_mask=2, speedup=1.0, packet_time=0.0):
+        super().__init__(daemon=True)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.rx_size = rx_size
+        self.planner_size = planner_size
+        self.speedup = speedup
+        self.settings = {10: status_mask, 11: junction, 110: max_rate, 111: max_rate, 112: max_rate,
+                         120: accel, 121: accel, 122: accel}
+        self.to_grbl = Link(baud, latency, packet_time)
+        self.to_host = Link(baud, latency, packet_time, merge=True)
+        self.running = True
+        self.stats = {'lines': 0, 'bytes': 0, 'overflows': 0, 'planner_empty': 0, 'run_time': 0.0}
+        self._lock = threading.Lock()
+        self.reset()
+
+    # Сброс: очистка буферов, состояние Idle (после сброса во время движения - ALARM:3)
+    def reset(self):
+        self.rx = bytearray()
+        self.planner = collections.deque()
+        self.modal = ModalState()
+        self.modal.position = list(getattr(self, 'position', [0.0, 0.0, 0.0]))
+        self.position = list(self.modal.position)
+        self.velocity = 0.0             # мм/сек
+        self.hold = False
+        self.check = False
+        self.alarm = False
+        self.homing_until = 0.0
+        self.ov_feed = 100
+        self.ov_rapid = 100
+        self.ov_spindle = 100
+        self._was_running = False
+
+    def output(self, data, now=None):
+        self.to_host.send(data, now if now is not None else time.monotonic())
+
+    def state_name(self):
+        if self.alarm:
+            return 'Alarm'
+        if self.homing_until:
+            return 'Home'
+        if self.check:
+            return 'Check'
+        if self.hold:
+            return 'Hold:0' if self.velocity == 0 else 'Hold:1'
+        return 'Run' if self.planner else 'Idle'
+
+    def status(self):
+        mask = int(self.settings[10])
+        x, y, z = self.position
+        pos = 'MPos' if mask & 1 else 'WPos'
+        report = f'<{self.state_name()}|{pos}:{x:.3f},{y:.3f},{z:.3f}'
+        if mask & 2:
+            planner_free = self.planner_size - 1 - len(self.planner)
+            report += f'|Bf:{planner_free},{self.rx_size - len(self.rx)}'
+        block = self.planner[0] if self.planner else None
+        feed = self.velocity * 60
+        power = block.power * self.ov_spindle / 100 if block else 0
+        report += f'|FS:{feed:.0f},{power:.0f}|Ov:{self.ov_feed},{self.ov_rapid},{self.ov_spindle}>\r\n'
+        return report.encode()
+
+    # Realtime-команды обрабатываются сразу при получении, минуя приёмный буфер
+    def realtime(self, byte, now):
+        if byte == 0x3F:        # ?
+            self.output(self.status(), now)
+        elif byte == 0x21:      # !
+            if self.planner:
+                self.hold = True
+        elif byte == 0x7E:      # ~
+            self.hold = False
+        elif byte == 0x18:      # Soft-reset
+            alarm = bool(self.planner) and self.velocity > 0
+            self.reset()
+            self.output(BANNER, now)
+            if alarm:
+                self.alarm = True
+                self.output(b'ALARM:3\r\n', now)
+        elif byte == 0x90:
+            self.ov_feed = 100
+        elif 0x91 <= byte <= 0x94:
+            self.ov_feed = min(200, max(10, self.ov_feed + {0x91: 10, 0x92: -10, 0x93: 1, 0x94: -1}[byte]))
+        elif 0x95 <= byte <= 0x97:
+            self.ov_rapid = {0x95: 100, 0x96: 50, 0x97: 25}[byte]
+        elif byte == 0x99:
+            self.ov_spindle = 100
+        elif 0x9A <= byte <= 0x9D:
+            self.ov_spindle = min(200, max(10, self.ov_spindle + {0x9A: 10, 0x9B: -10, 0x9C: 1, 0x9D: -1}[byte]))
+
+    def receive(self, data, now):
+        for byte in data:
+            if byte in REALTIME:
+                self.realtime(byte, now)
+            elif len(self.rx) >= self.rx_size - 1:
+                self.stats['overflows'] += 1      # Переполнение приёмного буфера: байт потерян
+            else:
+                self.rx.append(byte)
+
+    # Разбор строк из приёмного буфера, пока есть место в планировщике
+    def parse(self, now):
+        while self.rx and len(self.planner) < self.planner_size - 1 and not self.homing_until:
+            end = min((i for i in (self.rx.find(b'\n'), self.rx.find(b'\r')) if i >= 0), default=-1)
+            if end < 0:
+                return
+            line = self.rx[:end].decode(errors='replace').strip()
+            del self.rx[:end + 1]
+            self.stats['lines'] += 1
+            self.stats['bytes'] += end + 1
+            self.output(self.execute(line, now), now)
+
+    def execute(self, line, now):
+        if line.startswith('$'):
+            return self.system(line, now)
+        if not line:
+            return b'ok\r\n'
+        if self.alarm:
+            return b'error:9\r\n'
+        words = tokenize(line)
+        if not words and line.strip('%'):
+            return b'error:1\r\n'
+        for letter, value in words:
+            if letter == 'G' and value not in G_CODES:
+                return b'error:20\r\n'
+            if letter == 'M' and value not in M_CODES:
+                return b'error:20\r\n'
+        start = list(self.modal.position)
+        block = self.modal.step(words)
+        if block is None:
+            return b'ok\r\n'
+        length = block.length
+        if None in self.modal.position:
+            # Имитатор без смещений: машинные координаты G53 - рабочие, точки G28/G30 - ноль
+            values = dict(words) if block.motion is not None else {}
+            self.modal.position = [values.get(letter, 0.0) * self.modal.scale if value is None else value
+                                   for letter, value in zip('XYZ', self.modal.position)]
+            length = math.dist(start, self.modal.position)
+        if block.motion is None or not length:
+            return b'ok\r\n'
+        if block.motion == 0:
+            feed = self.settings[110]
+        elif block.feed:
+            feed = block.feed
+        else:
+            return b'error:22\r\n'
+        if not self.check:
+            self.planner.append(SimBlock(start, list(self.modal.position), length, feed, block.power, block.motion == 0))
+        return b'ok\r\n'
+
+    def system(self, line, now):
+        if line == '$$':
+            text = ''.join(f'${key}={value:g}\r\n' for key, value in sorted(self.settings.items()))
+            return text.encode() + b'ok\r\n'
+        if line == '$H':
+            if self.planner:
+                return b'error:8\r\n'
+            self.alarm = False
+            self.homing_until = now + 1.0 / self.speedup
+            return b''      # ok после завершения калибровки
+        if line == '$C':
+            self.check = not self.check
+            return f"[MSG:{'Enabled' if self.check else 'Disabled'}]\r\nok\r\n".encode()
+        if line == '$X':
+            self.alarm = False
+            return b"[MSG:Caution: Unlocked]\r\nok\r\n"
+        if '=' in line:
+            key, _, value = line[1:].partition('=')
+            try:
+                self.settings[int(key)] = float(value)
+            except ValueError:
+                return b'error:3\r\n'
+            return b'ok\r\n'
+        return b'ok\r\n'
+
+    # Скорость в конце блока: перед пустым планировщиком - остановка, иначе скорость на стыке блоков
+    def exit_speed(self, block):
+        if len(self.planner) < 2:
+            return 0.0
+        following = self.planner[1]
+        cos = -sum(a * b for a, b in zip(block.unit, following.unit))
+        if cos <= -0.999999:
+            return math.inf
+        sin_half = math.sqrt(max((1.0 - cos) / 2, 0.0))
+        accel = self.settings[120]
+        if sin_half >= 0.999999:
+            return 0.0
+        return math.sqrt(accel * self.settings[11] * sin_half / (1.0 - sin_half))
+
+    # Перемещение за интервал dt (сек)
+    def move(self, dt, now):
+        if self.homing_until:
+            if now >= self.homing_until:
+                self.homing_until = 0.0
+                self.position = [0.0, 0.0, 0.0]
+                self.modal.position = [0.0, 0.0, 0.0]
+                self.output(b'ok\r\n', now)
+            return
+        running = bool(self.planner)
+        if self._was_running and not running:
+            self.stats['planner_empty'] += 1
+        self._was_running = running
+        if not running:
+            self.velocity = 0.0
+            return
+        self.stats['run_time'] += dt
+        accel = self.settings[120]
+        dt *= self.speedup
+        while dt > 0 and self.planner:
+            block = self.planner[0]
+            if self.hold:
+                self.velocity = max(0.0, self.velocity - accel * dt)
+                break
+            ov = self.ov_rapid if block.rapid else self.ov_feed
+            target_speed = min(block.feed * ov / 100, self.settings[110]) / 60
+            remaining = block.length - block.done
+            limit = math.sqrt(min(self.exit_speed(block), target_speed) ** 2 + 2 * accel * remaining)
+            speed = min(target_speed, self.velocity + accel * dt, limit)
+            step = speed * dt
+            if step >= remaining:
+                dt -= remaining / speed if speed else dt
+                self.velocity = speed
+                self.position = list(block.target)
+                self.planner.popleft()
+                continue
+            block.done += step
+            self.velocity = speed
+            self.position = [s + u * block.done for s, u in zip(block.start, block.unit)]
+            dt = 0
+
+    def run(self):
+        self.output(BANNER)
+        last = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            try:
+                data = os.read(self.master, 4096)
+            except (BlockingIOError, OSError):
+                data = b''
+            if data:
+                self.to_grbl.send(data, now)
+            with self._lock:
+                self.receive(self.to_grbl.receive(now), now)
+                self.parse(now)
+                self.move(now - last, now)
+                self.parse(now)
+            last = now
+            outgoing = self.to_host.receive(now)
+            if outgoing:
+                os.write(self.master, outgoing)
+            times = [t for t in (self.to_grbl.next_time(), self.to_host.next_time()) if t]
+            timeout = 0.001 if self.planner or self.homing_until else 0.05
+            if times:
+                timeout = min(timeout, max(0.0, min(times) - now))
+            select.select([self.master], [], [], timeout)
+
+    def stop(self):
+        self.running = False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GRBL 1.1 simulator on a pseudo-terminal')
+    parser.add_argument('--rx', type=int, default=128, help='RX buffer size, bytes')
+    parser.add_argument('--planner', type=int, default=16, help='planner buffer size, blocks')
+    parser.add_argument('--baud', type=int, default=115200, help='link speed, baud (0 - unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='link latency one way, sec')
+    parser.add_argument('--accel', type=float, default=1000.0, help='acceleration, mm/sec^2')
+    parser.add_argument('--max-rate', type=float, default=20000.0, help='maximum rate, mm/min')
+    parser.add_argument('--junction', type=float, default=0.01, help='junction deviation, mm')
+    parser.add_argument('--status-mask', type=int, default=2, help='$10 status report mask')
+    parser.add_argument('--speedup', type=float, default=1.0, help='motion time speedup factor')
+    parser.add_argument('--packet-time', type=float, default=0.0, help='link time per packet (host write), sec')
+    args = parser.parse_args()
+
+    sim = GrblSim(args.rx, args.planner, args.baud, args.latency, args.accel,
+                  args.max_rate, args.junction, args.status_mask, args.speedup, args.packet_time)
+    sim.start()
+    print(f'GRBL simulator: {sim.port}  (Ctrl+C - stop)')
+    try:
+        while sim.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    print(f"\n{sim.stats}")
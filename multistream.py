@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+# Одновременная работа нескольких станков GRBL из одного процесса
+# Каждый станок - свой порт, файл gcode, план, расчёт времени и счётчики, передача - AsyncStreamer в общем цикле asyncio:
+# порты читаются по готовности дескрипторов, отправка ждёт только свой буфер GRBL, поэтому станки не ждут друг друга
+# (python benchmark.py -m asyncio -n 4 - скорость на станок при четырёх имитаторах).
+# Статистика всех станков - один журнал stat.txt (запись под блокировкой), общий вывод состояния и одно окно управления.
+# Пример: python multistream.py -m /dev/ttyUSB0:part1.gcode -m /dev/ttyUSB1:part2.gcode -r 10
+
+import time
+import argparse
+import asyncio
+import os
+import re
+import serial
+
+# tkinter загружается только при наличии дисплея
+tk = None
+
+from aiostream import AsyncGrbl, AsyncStreamer
+from cycleplan import load_plan
+from estimator import estimate_plan, read_settings
+from grblmessages import grbl_errors
+from grblmessages import grbl_alarm
+from statstore import StatStore
+
+from colorama import init, Fore, Style
+init()
+
+
+# --------------------- Параметры ------------------------------------
+
+RX_BUFFER_SIZE = 128    # Размер буфера (байт)
+BAUD_RATE = 115200      # Скорость порта (байт/сек)
+REPORT_INTERVAL = 1.0   # Периодичность запросов состояния (?) каждого станка, сек
+VIEW_INTERVAL = 0.5     # Периодичность обновления общего вывода состояния и окна, сек
+LOCATE_BLOCKS = 40      # Глубина поиска исполняемого блока от последнего отправленного
+MAX_ERRORS = 3          # Останавливать станок после N ошибок
+MAX_CHECK_ERRORS = 10   # Выводить ошибок проверки gcode каждого станка перед запуском
+BANNER_TIMEOUT = 2.5    # Ожидание приветствия GRBL после открытия порта (сек)
+
+if os.name == 'posix':
+    PATH_STAT = f'{os.getcwd()}/stat.txt'       # путь к файлу статистики
+    PATH_CACHE = f'{os.getcwd()}/plan_cache'    # путь к кэшу разобранных файлов gcode
+else:
+    PATH_SCRIPT = os.path.dirname(os.path.realpath(__file__))
+    PATH_STAT = os.path.join(PATH_SCRIPT, 'stat.txt')
+    PATH_CACHE = os.path.join(PATH_SCRIPT, 'plan_cache')
+
+# --------------------------------------------------------------------
+
+
+# Станок: порт, план файла gcode, счётчики циклов и деталей, последний отчёт о состоянии
+class Machine:
+
+    def __init__(self, number, port, path):
+        self.name = f'{number}:{port}'
+        self.port = port
+        self.file = open(path)
+        gcode_name = re.sub(r'(\s+)', '_', path)
+        self.gcode_name = re.sub(r'(.*)(\\|/)', '', gcode_name)
+        compact = (args.compact_digits, args.merge_tolerance) if args.compact else None
+        self.plan, _ = load_plan(self.file, PATH_CACHE, args.pieces_distance, args.laser, args.speed, compact,
+                                 args.reorder, args.reverse_groups)
+        self.estimate = None
+        self.ser = None
+        self.streamer = None
+        self.status = None
+        self.position = None            # Исполняемый блок: (индекс, доля пути)
+        self.block_index = 0
+        self.repeats_count = 0
+        self.pieces_count = 0
+        self.pieces_cycle_count = 0
+        self.errors_count = 0
+        self.start_time_cycle = 0
+        self.is_last_cycle = False
+        self.is_last_piece = False
+        self.failed = False
+        self.done = False
+
+    # Подключение, сброс, режим проверки ($C) и чтение настроек ($$) - блокирующий обмен до запуска цикла событий
+    def connect(self):
+        ser = serial.Serial(self.port, BAUD_RATE, timeout=BANNER_TIMEOUT, write_timeout=0)
+        ser.readline()
+        ser.timeout = 5
+        ser.write(b"\x18")
+        while True:
+            line = ser.readline().decode(errors='replace')
+            if not line or 'Grbl' in line:
+                break
+        if args.grbl_check:
+            ser.write(b"$C\n")
+            while True:
+                line = ser.readline().decode(errors='replace').strip()
+                if not line or line == 'ok' or line.startswith('error'):
+                    break
+        settings = read_settings(ser)
+        if settings:
+            self.estimate = estimate_plan(self.plan, settings)
+        self.ser = ser
+
+    async def run(self):
+        grbl = AsyncGrbl(self.ser)
+        self.streamer = streamer = AsyncStreamer(grbl, self.plan, RX_BUFFER_SIZE, False, lambda: REPORT_INTERVAL,
+                                                 self.block_prepare, self.show_status, self.block_error,
+                                                 self.show_alarm)
+        streamer.start()
+        try:
+            if args.home and not args.grbl_check:
+                code = await streamer.command(b"$H\n")
+                log(f"{self.name}: Homing axes >>> {'ok' if not code else f'error:{code}'}")
+            while self.repeats_count < args.repeats and not self.failed:
+                self.cycle_begin()
+                l_end = await streamer.stream_cycle()
+                if self.failed:
+                    break       # Цикл прерван ошибками: без строки статистики и возврата к началу (как stream.py)
+                start_position = self.cycle_finish(l_end)
+                await streamer.command(b'G90\n', *([start_position] if start_position else []))
+                await streamer.wait_status(lambda status: status.state == 'Idle')
+                if self.is_last_cycle:
+                    break
+        finally:
+            await streamer.stop()
+            self.ser.close()
+            self.file.close()
+            self.done = True
+
+    def cycle_begin(self):
+        self.start_time_cycle = time.time()
+        self.pieces_cycle_count = 0
+        self.errors_count = 0
+        self.block_index = 0
+
+    # Подготовка блока: счётчики деталей, False - остановка перед блоком
+    def block_prepare(self, i):
+        self.block_index = i
+        if self.plan.piece[i]:
+            self.pieces_count += 1
+            self.pieces_cycle_count += 1
+            if self.is_last_piece:
+                return False
+        return not self.failed
+
+    def block_error(self, code, i):
+        text = f'{code} {grbl_errors[code]}' if code in grbl_errors else code
+        log(Fore.RED + f"{self.name}: ERR< {self.plan.line_no[i]}/{self.plan.lines_in_file} {self.plan.text(i)} : {text}" + Style.RESET_ALL)
+        self.errors_count += 1
+        if self.errors_count > MAX_ERRORS and not self.failed:
+            log(Fore.RED + f"{self.name}: !!! Слишком много ошибок, станок остановлен !!!" + Style.RESET_ALL)
+            self.failed = True
+
+    def show_alarm(self, alarm):
+        log(Fore.RED + f"{self.name}: ALARM:{alarm} {grbl_alarm.get(alarm, '')}" + Style.RESET_ALL)
+
+    def show_status(self, status):
+        self.status = status
+        if status.wpos and status.state in ('Run', 'Hold'):
+            self.position = self.plan.locate(status.wpos[0], status.wpos[1],
+                                             max(0, self.block_index - LOCATE_BLOCKS), self.block_index + 1)
+        else:
+            self.position = None
+
+    # Итоги цикла: строка статистики, возвращает начальную позицию следующего цикла (None - без G0 X Y, без возврата)
+    def cycle_finish(self, l_end):
+        x_move, y_move, xy_move, s_move = self.plan.totals(l_end)
+        self.repeats_count += 1
+        self.pieces_count += 1
+        self.pieces_cycle_count += 1
+        average_power = s_move / xy_move if xy_move else 0
+        finish = time.time()
+        stat_store.append(f'{int(self.start_time_cycle)} {int(finish)} {self.gcode_name} {self.pieces_cycle_count} '
+                          f'{int(x_move)} {int(2*y_move)} {int(average_power)} {id}')
+        log(Fore.GREEN + f"{self.name}: цикл {self.repeats_count}/{args.repeats} {self.gcode_name} "
+            f"{round(finish - self.start_time_cycle)} сек, деталей {self.pieces_cycle_count} "
+            f"(всего {self.pieces_count})" + Style.RESET_ALL)
+        return self.plan.start_position(l_end)
+
+    # Строка общего вывода: циклы, строка файла, детали, расчётное время до конца цикла, состояние GRBL
+    def summary(self):
+        if self.done:
+            state = 'ОСТАНОВЛЕН' if self.failed else 'ЗАВЕРШЁН'
+        else:
+            state = self.status.state if self.status else '---'
+        plan = self.plan
+        line = plan.line_no[min(self.block_index, len(plan) - 1)] if len(plan) else 0
+        eta = ''
+        if self.estimate and self.position:
+            feed_override = self.status.overrides[0] if self.status.overrides else 100
+            eta = f" {time.strftime('%M:%S', time.gmtime(self.estimate.remaining(*self.position) * 100 / feed_override))}"
+        mark = ' *' if self.is_last_cycle or self.is_last_piece else ''
+        return (f'{self.name:<20} {self.gcode_name:<16} {self.repeats_count}/{args.repeats} '
+                f'{line}/{plan.lines_in_file} {self.pieces_cycle_count}/{self.pieces_count}{eta} {state}{mark}')
+
+    # Realtime-команда станку: '!' - пауза, '~' - продолжение
+    def realtime(self, data):
+        if self.streamer and not self.done:
+            self.streamer.grbl.write_realtime(data)
+
+
+# --------------------- Общий вывод ------------------------------------
+
+view_lines = 0      # Строк состояния станков на экране
+
+# Сообщение над строками состояния: строки стираются и выводятся заново при следующем обновлении
+def log(text):
+    global view_lines
+    if view_lines:
+        print(f'\x1b[{view_lines}A\x1b[J', end='')
+        view_lines = 0
+    print(text)
+
+async def console_view():
+    global view_lines
+    while True:
+        if view_lines:
+            print(f'\x1b[{view_lines}A', end='')
+        for machine in machines:
+            print(f'\x1b[2K{machine.summary()}')
+        view_lines = len(machines)
+        if all(machine.done for machine in machines):
+            return
+        await asyncio.sleep(VIEW_INTERVAL)
+
+
+# --------------------- Окно управления ------------------------------------
+
+def last_cycle(machine):
+    machine.is_last_cycle = True
+
+def last_piece(machine):
+    machine.is_last_piece = True
+
+def gui_create():
+    global tk
+    global window
+    import tkinter as tk
+    window = tk.Tk()
+    window.title('GRBL')
+    for row, machine in enumerate(machines):
+        label = tk.Label(master=window, text=machine.name, width=70, anchor='w', font=('Courier', 11))
+        label.grid(row=row, column=0)
+        gui_labels.append(label)
+        for column, (text, color, command) in enumerate((
+                ('ПАУЗА', 'red', lambda machine=machine: machine.realtime(b'!')),
+                ('СТАРТ', 'green', lambda machine=machine: machine.realtime(b'~')),
+                ('ПОСЛЕДНИЙ\nЦИКЛ', 'yellow', lambda machine=machine: last_cycle(machine)),
+                ('ПОСЛЕДНЯЯ\nДЕТАЛЬ', 'yellow', lambda machine=machine: last_piece(machine))), 1):
+            tk.Button(master=window, text=text, width=10, height=2, bg=color, fg='black',
+                      command=command).grid(row=row, column=column)
+    all_row = len(machines)
+    tk.Button(master=window, text='ПАУЗА ВСЕХ', width=10, height=2, bg='red', fg='black',
+              command=lambda: [machine.realtime(b'!') for machine in machines]).grid(row=all_row, column=1)
+    tk.Button(master=window, text='СТАРТ ВСЕХ', width=10, height=2, bg='green', fg='black',
+              command=lambda: [machine.realtime(b'~') for machine in machines]).grid(row=all_row, column=2)
+    tk.Button(master=window, text='ПОСЛЕДНИЙ\nЦИКЛ ВСЕХ', width=10, height=2, bg='yellow', fg='black',
+              command=lambda: [last_cycle(machine) for machine in machines]).grid(row=all_row, column=3)
+
+# Обновление окна в цикле asyncio
+async def gui_update():
+    global window
+    while window:
+        try:
+            for label, machine in zip(gui_labels, machines):
+                label['text'] = machine.summary()
+            window.update()
+        except tk.TclError:
+            window = None   # Окно закрыто
+        await asyncio.sleep(VIEW_INTERVAL)
+
+
+async def main():
+    global window
+    try:
+        gui_create()
+    except Exception:   # Нет дисплея (TclError) или tkinter
+        window = None
+    gui_task = asyncio.create_task(gui_update())
+    view_task = asyncio.create_task(console_view())
+    results = await asyncio.gather(*(machine.run() for machine in machines), return_exceptions=True)
+    await view_task
+    for machine, result in zip(machines, results):
+        if isinstance(result, Exception):
+            print(Fore.RED + f"{machine.name}: !!! {result!r} !!!" + Style.RESET_ALL)
+    gui_task.cancel()
+
+
+parser = argparse.ArgumentParser(description='Stream g-code to several GRBL machines')
+parser.add_argument('-m', '--machine', action='append', required=True, metavar='PORT:FILE',
+                    help='serial device and g-code file, repeat for each machine')
+parser.add_argument('-r', '--repeats', type=int, action='store', default=1, help='repeat programm')
+parser.add_argument('-d', '--pieces_distance', type=int, action='store', default=600, help='distance between pieces, mm')
+parser.add_argument('-l', '--laser', type=int, action='store', default=None, help='replace laser power, %')
+parser.add_argument('-f', '--speed', type=int, action='store', default=None, help='replace speed G1, mm/min')
+parser.add_argument('--compact', action='store_true', default=False,
+                    help='compact g-code: no repeated G0/G1, F, S, coordinates rounded, collinear G1 merged')
+parser.add_argument('--compact-digits', type=int, action='store', default=3, help='compacted coordinate digits')
+parser.add_argument('--merge-tolerance', type=float, action='store', default=0.01, help='collinear G1 merge tolerance, mm')
+parser.add_argument('--reorder', action='store_true', default=False, help='reorder groups between G0 to shorten rapid travel')
+parser.add_argument('--reverse-groups', action='store_true', default=False, help='allow reversed G1 groups when reordering')
+parser.add_argument('-c', '--check', action='store_true', default=False, help='check g-code by GRBL 1.1 rules without machine and exit')
+parser.add_argument('--grbl-check', action='store_true', default=False, help='stream in GRBL check mode ($C)')
+parser.add_argument('--home', action='store_true', default=False, help='home before start')
+args = parser.parse_args()
+
+# Порт и файл: '/dev/ttyUSB0:part.gcode', 'COM3:C:\\gcode\\part.gcode'
+machines = []
+for number, value in enumerate(args.machine, 1):
+    port, _, path = value.partition(':')
+    if not path or not os.path.exists(path):
+        print(Fore.RED + f"\n!!! Файл gcode не найден: {value} !!!\n" + Style.RESET_ALL)
+        exit()
+    machines.append(Machine(number, port, path))
+
+# Ошибки проверки gcode по правилам GRBL 1.1 без станка: с -c только проверка, иначе запуск по подтверждению
+errors = 0
+for machine in machines:
+    plan = machine.plan
+    if plan.errors or args.check:
+        print(f"{machine.name}: {machine.gcode_name}, проверка gcode: "
+              f"{f'ошибок {len(plan.errors)}' if plan.errors else 'ошибок нет'} ({len(plan)} блоков)")
+    for i, code in plan.errors[:MAX_CHECK_ERRORS]:
+        print(Fore.RED + f"  ERR< {plan.line_no[i]}/{plan.lines_in_file} {plan.text(i)} : {code} {grbl_errors[code]}"
+              + Style.RESET_ALL)
+    errors += len(plan.errors)
+if args.check:
+    exit(1 if errors else 0)
+if errors and input('Запустить программу с ошибками? (y/n): ').strip().lower() not in ('y', 'д'):
+    exit()
+
+stat_store = StatStore(PATH_STAT)
+window = None
+gui_labels = []
+
+id = input(f'\nВведите Ваш ID или имя и нажмите Enter: ')
+id = id.strip().upper()
+id = re.sub(r'(\s+)', '_', id)
+
+for machine in list(machines):
+    try:
+        machine.connect()
+    except (serial.SerialException, OSError) as error:
+        print(Fore.RED + f"{machine.name}: !!! Подключение GRBL отсутствует ({error}) !!!" + Style.RESET_ALL)
+        machine.file.close()
+        machines.remove(machine)
+        continue
+    total = f"{round(machine.estimate.total)} сек на цикл" if machine.estimate else 'расчёт времени недоступен'
+    print(f"{machine.name}: {machine.gcode_name}, {len(machine.plan)} блоков, {total}")
+    if machine.plan.compact_error:
+        print(Fore.RED + f"{machine.name}: сжатие gcode отменено, траектория не совпадает: {machine.plan.compact_error}"
+              + Style.RESET_ALL)
+print()
+
+if machines:
+    asyncio.run(main())
+stat_store.close()
+print(Fore.YELLOW + f'Работа завершена\n' + Style.RESET_ALL)
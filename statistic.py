@@ -1,78 +1,234 @@
-import time
-import re
-import argparse
-from colorama import init, Fore, Style
-init()
-
-min_time = 30 # Минимальное время обработки одной детали
-              # При меньшей длительности считать выполненным в режиме симуляции (check) и пропускать
-
-
-def date_time(unix_time=time.time()):
-    t = time.localtime(unix_time)
-    c_time = time.strftime("%H:%M:%S %d-%m-%Y", t)
-    return c_time
-
-def show_global_stat(file):
-    stat_time = 0
-    stat_pieces = 0
-    stat_move_x = 0
-    stat_move_y = 0
-    stat_power = 0
-    for line in file:
-        data = re.split('\s+', line.strip())
-        if len(data) > 6:
-            stat_time += int(data[1]) - int(data[0]) # sec
-            stat_pieces += int(data[3])
-            stat_move_x += int(data[4]) # mm
-            stat_move_y += int(data[5]) # mm
-            # stat_power += int(data[6]) * (int(data[4])**2 + int(data[5])**2) **0.5 # by x,y moves
-            stat_power += int(data[6]) * (int(data[1]) - int(data[0])) # by time
-    # stat_power = int(stat_power / ((stat_move_x**2 + stat_move_y**2) **0.5))
-    stat_power = int(stat_power / stat_time)
-    print(Fore.YELLOW + f"\n-------- ОБЩАЯ СТАТИСТИКА --------\n")
-    print(f"Время работы:          {int(stat_time/(1*60*60))} ч")
-    print(f"Деталей обработано:    {stat_pieces} шт")
-    print(f"Перемещения оси X:     {int(stat_move_x/1000)} м")
-    print(f"Перемещения оси Y:     {int(stat_move_y/1000)} м")
-    print(f"Перемещений с лазером: {int(stat_power/10)} %")
-    print(f"" + Style.RESET_ALL)
-
-def show_days_stat(file):
-    print(f"\n------- СТАТИСТИКА ПО ДНЯМ -------\n")
-    pieces_counter_dict = {}
-    date_last = ''
-    line_counter = 1
-    file.seek(0)
-    for line in file:
-        data = re.split('\s+', line.strip())
-        if len(data) > 6 and ((int(data[1])-int(data[0]))/int(data[3]) > min_time):
-            key = f'{data[7]} {data[2]}' if len(data)>7 else f'--- {data[2]}'
-            t = time.localtime(int(data[0]))
-            date = time.strftime("%Y-%m-%d", t)      
-            if date == date_last:
-                if key in pieces_counter_dict.keys():
-                    pieces_counter_dict[key] += int(data[3])
-                else:
-                    pieces_counter_dict[key] = int(data[3])       
-            else:
-                if len(pieces_counter_dict):
-                    print(f'{date_last}  {pieces_counter_dict}')               
-                pieces_counter_dict = {}
-                pieces_counter_dict[key] = int(data[3])
-        # Вывод тестовых записей с малой длительностью
-        # if len(data) <= 6 or ((int(data[1])-int(data[0]))/int(data[3]) <= min_time):
-            # print(f'line={line_counter} - time={int(data[1])-int(data[0])} - {line}') 
-        date_last = date
-        line_counter += 1
-    print(f'{date_last}  {pieces_counter_dict}\n')
-
-parser = argparse.ArgumentParser(description='Statistic')
-parser.add_argument('file', type=argparse.FileType('r'), help='statistic file')
-args = parser.parse_args()
-file = args.file
-
-show_global_stat(file)
-show_days_stat(file)
-print(Fore.GREEN + f'Время формирования отчёта {date_time()}\n' + Style.RESET_ALL)
-
+import time
+import argparse
+import csv
+import json
+from array import array
+from colorama import init, Fore, Style
+init()
+
+min_time = 30 # Минимальное время обработки одной детали
+              # При меньшей длительности считать выполненным в режиме проверки GRBL ($C, --grbl-check) и пропускать
+
+
+def date_time(unix_time=time.time()):
+    t = time.localtime(unix_time)
+    c_time = time.strftime("%H:%M:%S %d-%m-%Y", t)
+    return c_time
+
+
+# Файл статистики в виде столбцов: один проход по файлу, строки файлов gcode и операторов - номера в списках имён
+class StatColumns:
+    __slots__ = ('start', 'finish', 'pieces', 'x_move', 'y_move', 'power', 'starved', 'machine', 'gcode', 'operator',
+                 'day', 'gcodes', 'operators', 'days')
+
+    def __init__(self):
+        self.start = array('q')         # Начало цикла, unix time
+        self.finish = array('q')        # Конец цикла, unix time
+        self.pieces = array('l')
+        self.x_move = array('q')        # мм
+        self.y_move = array('q')        # мм
+        self.power = array('l')         # Средняя мощность цикла, S
+        self.starved = array('l')       # Недобор подачи из-за опустошения планировщика, сек (0 в старых записях)
+        self.machine = array('l')       # Недобор подачи из-за ограничений станка, сек
+        self.gcode = array('H')         # Номер в gcodes
+        self.operator = array('H')      # Номер в operators
+        self.day = array('H')           # Номер в days
+        self.gcodes = []
+        self.operators = []             # '---' - записи без имени оператора
+        self.days = []                  # 'YYYY-MM-DD' в порядке появления
+
+    def __len__(self):
+        return len(self.start)
+
+
+def load_stat(file):
+    columns = StatColumns()
+    rows = [data for data in map(str.split, file) if len(data) > 6]
+    if not rows:
+        return columns
+    fields = [[data[k] for data in rows] for k in range(7)]
+    columns.start = array('q', map(int, fields[0]))
+    columns.finish = array('q', map(int, fields[1]))
+    columns.pieces = array('l', map(int, fields[3]))
+    columns.x_move = array('q', map(int, fields[4]))
+    columns.y_move = array('q', map(int, fields[5]))
+    columns.power = array('l', map(int, fields[6]))
+    columns.gcodes, columns.gcode = _encode(fields[2])
+    columns.operators, columns.operator = _encode(data[7] if len(data) > 7 else '---' for data in rows)
+    columns.starved = array('l', (int(data[8]) if len(data) > 9 else 0 for data in rows))
+    columns.machine = array('l', (int(data[9]) if len(data) > 9 else 0 for data in rows))
+
+    # Дата по местному времени, пересчёт только при переходе через полночь
+    days = {}
+    day_end = 0
+    day_index = 0
+    day = columns.day
+    for start in columns.start:
+        if not (day_end - 86400 <= start < day_end):
+            t = time.localtime(start)
+            day_end = int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1)))
+            day_index = days.setdefault(time.strftime("%Y-%m-%d", t), len(days))
+        day.append(day_index)
+    columns.days = list(days)
+    return columns
+
+# Строки в номера по списку уникальных значений в порядке появления
+def _encode(values):
+    index = {}
+    codes = array('H', [index.setdefault(value, len(index)) for value in values])
+    return list(index), codes
+
+
+# Общие итоги по всем записям
+def global_stat(columns):
+    stat_time = sum(columns.finish) - sum(columns.start) # sec
+    # stat_power - средняя мощность по времени работы
+    stat_power = sum(map(lambda p, s, f: p * (f - s), columns.power, columns.start, columns.finish))
+    return {
+        'seconds': stat_time,
+        'cycles': len(columns),
+        'pieces': sum(columns.pieces),
+        'x_move': sum(columns.x_move), # mm
+        'y_move': sum(columns.y_move), # mm
+        'power': int(stat_power / stat_time) if stat_time else 0,
+        'underfeed_starved': sum(columns.starved), # sec
+        'underfeed_machine': sum(columns.machine), # sec
+    }
+
+# Итоги по дням, операторам и файлам gcode без записей режима симуляции:
+# {(день, оператор, gcode): [циклов, деталей, сек, x, y, недобор голодание, недобор станок]}
+def breakdown(columns):
+    seconds = list(map(int.__sub__, columns.finish, columns.start))
+    n_operators, n_gcodes = len(columns.operators), len(columns.gcodes)
+    keys = [(d * n_operators + o) * n_gcodes + g if sec > min_time * p else -1
+            for d, o, g, sec, p in zip(columns.day, columns.operator, columns.gcode, seconds, columns.pieces)]
+    sums = []
+    for values in ([1] * len(keys), columns.pieces, seconds, columns.x_move, columns.y_move, columns.starved, columns.machine):
+        total = {}
+        get = total.get
+        for key, value in zip(keys, values):
+            total[key] = get(key, 0) + value
+        sums.append(total)
+    groups = {}
+    for key in sums[0]:
+        if key >= 0:
+            day, rest = divmod(key, n_operators * n_gcodes)
+            groups[(day, *divmod(rest, n_gcodes))] = [total[key] for total in sums]
+    return groups
+
+# Свёртка итогов по части ключа: 0 - день, 1 - оператор, 2 - gcode
+def rollup(groups, *fields):
+    result = {}
+    for key, values in groups.items():
+        short = tuple(key[f] for f in fields)
+        total = result.setdefault(short, [0] * len(values))
+        for k, value in enumerate(values):
+            total[k] += value
+    return result
+
+def pieces_per_hour(pieces, seconds):
+    return round(pieces * 3600 / seconds, 1) if seconds else 0
+
+
+def show_global_stat(stat):
+    print(Fore.YELLOW + f"\n-------- ОБЩАЯ СТАТИСТИКА --------\n")
+    print(f"Время работы:          {int(stat['seconds']/(1*60*60))} ч")
+    print(f"Деталей обработано:    {stat['pieces']} шт")
+    print(f"Перемещения оси X:     {int(stat['x_move']/1000)} м")
+    print(f"Перемещения оси Y:     {int(stat['y_move']/1000)} м")
+    print(f"Перемещений с лазером: {int(stat['power']/10)} %")
+    if stat['underfeed_starved'] or stat['underfeed_machine']:
+        print(f"Недобор подачи:        голодание {stat['underfeed_starved']/60:.1f} мин, станок {stat['underfeed_machine']/60:.1f} мин")
+    print(f"" + Style.RESET_ALL)
+
+def show_days_stat(columns, groups):
+    print(f"\n------- СТАТИСТИКА ПО ДНЯМ -------\n")
+    days = {}
+    for (day, operator, gcode), values in groups.items():
+        pieces_counter_dict = days.setdefault(day, {})
+        key = f'{columns.operators[operator]} {columns.gcodes[gcode]}'
+        pieces_counter_dict[key] = pieces_counter_dict.get(key, 0) + values[1]
+    for day in sorted(days, key=lambda day: columns.days[day]):
+        print(f'{columns.days[day]}  {days[day]}')
+    print()
+
+# Итоги по операторам или файлам gcode: детали, часы работы, детали в час, недобор подачи (голодание/станок, % времени)
+def show_totals_stat(title, names, totals):
+    print(f"\n------- {title} -------\n")
+    for (index,), (cycles, pieces, seconds, _, _, starved, machine) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        underfeed = f' {starved*100/seconds:>5.1f}/{machine*100/seconds:.1f} % недобор' if seconds and (starved or machine) else ''
+        print(f'{names[index]:<24} {pieces:>8} шт {seconds/3600:>8.1f} ч {pieces_per_hour(pieces, seconds):>7} шт/ч{underfeed}')
+    print()
+
+# Производительность по месяцам: детали в час работы
+def show_trend_stat(columns, groups):
+    print(f"\n---- ПРОИЗВОДИТЕЛЬНОСТЬ ПО МЕСЯЦАМ ----\n")
+    months = {}
+    for (day,), (cycles, pieces, seconds, *_) in rollup(groups, 0).items():
+        month = months.setdefault(columns.days[day][:7], [0, 0])
+        month[0] += pieces
+        month[1] += seconds
+    for month in sorted(months):
+        pieces, seconds = months[month]
+        print(f'{month}  {pieces:>8} шт {seconds/3600:>8.1f} ч {pieces_per_hour(pieces, seconds):>7} шт/ч')
+    print()
+
+# Строки для выгрузки: день, оператор, файл gcode
+def export_rows(columns, groups):
+    rows = []
+    for (day, operator, gcode), (cycles, pieces, seconds, x_move, y_move, starved, machine) in groups.items():
+        rows.append({
+            'date': columns.days[day],
+            'operator': columns.operators[operator],
+            'gcode': columns.gcodes[gcode],
+            'cycles': cycles,
+            'pieces': pieces,
+            'seconds': seconds,
+            'x_move': x_move,
+            'y_move': y_move,
+            'pieces_per_hour': pieces_per_hour(pieces, seconds),
+            'underfeed_starved': starved,
+            'underfeed_machine': machine,
+        })
+    rows.sort(key=lambda row: (row['date'], row['operator'], row['gcode']))
+    return rows
+
+def export_csv(path, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else ['date'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def export_json(path, stat, rows):
+    with open(path, 'w') as file:
+        json.dump({'global': stat, 'rows': rows}, file, indent=2, ensure_ascii=False)
+
+parser = argparse.ArgumentParser(description='Statistic')
+parser.add_argument('file', type=argparse.FileType('r'), help='statistic file')
+parser.add_argument('-o', '--operators', action='store_true', default=False, help='totals by operator')
+parser.add_argument('-g', '--gcodes', action='store_true', default=False, help='totals by g-code file')
+parser.add_argument('-t', '--trend', action='store_true', default=False, help='pieces per hour by month')
+parser.add_argument('--csv', type=str, default=None, help='export by day, operator and g-code to CSV')
+parser.add_argument('--json', type=str, default=None, help='export totals and rows to JSON')
+args = parser.parse_args()
+
+columns = load_stat(args.file)
+args.file.close()
+stat = global_stat(columns)
+groups = breakdown(columns)
+
+show_global_stat(stat)
+show_days_stat(columns, groups)
+if args.operators:
+    show_totals_stat('ПО ОПЕРАТОРАМ', columns.operators, rollup(groups, 1))
+if args.gcodes:
+    show_totals_stat('ПО ФАЙЛАМ GCODE', columns.gcodes, rollup(groups, 2))
+if args.trend:
+    show_trend_stat(columns, groups)
+if args.csv or args.json:
+    rows = export_rows(columns, groups)
+    if args.csv:
+        export_csv(args.csv, rows)
+    if args.json:
+        export_json(args.json, stat, rows)
+print(Fore.GREEN + f'Время формирования отчёта {date_time()}\n' + Style.RESET_ALL)
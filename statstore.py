@@ -0,0 +1,148 @@
+# Индекс файла статистики stat.txt в SQLite
+# stat.txt остаётся журналом: одна строка на цикл, запись дописывается в конец файла.
+# Рядом хранится stat.db: накопленные итоги, последняя серия циклов каждого оператора и размер проиндексированной части журнала.
+# При запуске и после записи разбираются только новые строки журнала, при замене или усечении журнала индекс строится заново.
+# Строки дописываются под блокировкой файла: в журнал пишут несколько станков одного процесса и несколько процессов.
+# Формат строки: начало конец файл_gcode деталей перемещение_x перемещение_y средняя_мощность [оператор]
+# [недобор_подачи_голодание недобор_подачи_станок] (сек), перед ними оператор без имени - '---'
+
+import os
+import sqlite3
+import threading
+
+if os.name == 'posix':
+    import fcntl
+else:
+    import msvcrt
+
+RESUME_WINDOW = 30*60   # Циклы одной серии: предыдущий цикл закончился не раньше чем за 30 минут до начала следующего
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY CHECK (id = 1), size INTEGER, head BLOB);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 1),
+    seconds INTEGER, pieces INTEGER, x_move INTEGER, y_move INTEGER, power_seconds INTEGER);
+CREATE TABLE IF NOT EXISTS series (operator TEXT PRIMARY KEY,
+    gcode TEXT, start INTEGER, finish INTEGER, cycles INTEGER, pieces INTEGER);
+'''
+
+_HEAD_SIZE = 64     # Начало журнала для проверки, что файл не заменён
+
+_append_lock = threading.Lock()
+
+
+# Дописать строку в журнал одной записью под блокировкой (потоки процесса - Lock, процессы - блокировка файла)
+def append_line(path, line):
+    with _append_lock, open(path, 'a') as file:
+        if os.name == 'posix':
+            fcntl.flock(file, fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            file.write(f'{line}\n')
+            file.flush()
+        finally:
+            if os.name == 'posix':
+                fcntl.flock(file, fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class StatStore:
+
+    def __init__(self, path_stat, path_db=None):
+        self.path_stat = path_stat
+        # Транзакции явные (BEGIN IMMEDIATE в sync)
+        self.db = sqlite3.connect(path_db or os.path.splitext(path_stat)[0] + '.db', timeout=10, isolation_level=None)
+        self.db.executescript(_SCHEMA)
+        self.sync()
+
+    def close(self):
+        self.db.close()
+
+    def _reset(self):
+        self.db.execute('DELETE FROM series')
+        self.db.execute('INSERT OR REPLACE INTO totals VALUES (1, 0, 0, 0, 0, 0)')
+        self.db.execute('INSERT OR REPLACE INTO journal VALUES (1, 0, ?)', (b'',))
+
+    # Запись цикла в журнал и обновление индекса
+    def append(self, line):
+        append_line(self.path_stat, line)
+        self.sync()
+
+    # Индексация строк, дописанных в журнал после прошлой синхронизации
+    # Чтение размера проиндексированной части, индексация и её обновление - одна транзакция с блокировкой записи
+    # (BEGIN IMMEDIATE): другой процесс или соединение ждёт её окончания и не индексирует те же строки повторно
+    def sync(self):
+        if not os.path.exists(self.path_stat):
+            return
+        with open(self.path_stat, 'rb') as file:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                head = file.read(_HEAD_SIZE)
+                row = self.db.execute('SELECT size, head FROM journal').fetchone()
+                if not row or row[0] > os.fstat(file.fileno()).st_size or not head.startswith(row[1]):
+                    self._reset()
+                    size = 0
+                else:
+                    size = row[0]
+                file.seek(size)
+                data = file.read()
+                end = data.rfind(b'\n') + 1     # Незаконченная последняя строка - до следующей синхронизации
+                if end:
+                    self._index(data[:end].decode(errors='replace').splitlines())
+                    self.db.execute('UPDATE journal SET size = ?, head = ?', (size + end, head))
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def _index(self, lines):
+        seconds = pieces = x_move = y_move = power_seconds = 0
+        series = {}
+        for line in lines:
+            data = line.split()
+            if len(data) < 7:
+                continue
+            start, finish, gcode = int(data[0]), int(data[1]), data[2]
+            count, power = int(data[3]), int(data[6])
+            operator = data[7] if len(data) > 7 and data[7] != '---' else ''
+            seconds += finish - start
+            pieces += count
+            x_move += int(data[4])
+            y_move += int(data[5])
+            power_seconds += power * (finish - start)
+
+            # Серия циклов оператора: тот же файл gcode без длительных перерывов
+            if operator not in series:
+                series[operator] = self.db.execute(
+                    'SELECT gcode, start, finish, cycles, pieces FROM series WHERE operator = ?', (operator,)).fetchone()
+            last = series[operator]
+            if last and last[0] == gcode and last[2] > start - RESUME_WINDOW:
+                series[operator] = (gcode, last[1], finish, last[3] + 1, last[4] + count)
+            else:
+                series[operator] = (gcode, start, finish, 1, count)
+
+        self.db.execute('UPDATE totals SET seconds = seconds + ?, pieces = pieces + ?, x_move = x_move + ?, '
+                        'y_move = y_move + ?, power_seconds = power_seconds + ?',
+                        (seconds, pieces, x_move, y_move, power_seconds))
+        self.db.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?)',
+                            [(operator,) + values for operator, values in series.items()])
+
+    # Общие итоги: время (сек), детали, перемещения X и Y (мм), средняя мощность по времени или None
+    def totals(self):
+        row = self.db.execute('SELECT seconds, pieces, x_move, y_move, power_seconds FROM totals').fetchone()
+        if not row or not row[0]:
+            return None
+        seconds, pieces, x_move, y_move, power_seconds = row
+        return seconds, pieces, x_move, y_move, int(power_seconds / seconds)
+
+    # Продолжение серии после короткой остановки: (циклов, деталей, начало серии)
+    # Серия продолжается, если последний цикл оператора с тем же файлом gcode закончился позже since
+    def resume(self, operator, gcode, since):
+        row = self.db.execute('SELECT gcode, start, finish, cycles, pieces FROM series WHERE operator = ?',
+                              (operator,)).fetchone()
+        if row and row[0] == gcode and row[2] > since:
+            return row[3], row[4], row[1]
+        return 0, 0, None
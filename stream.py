@@ -1,18 +1,31 @@
 #!/usr/bin/env python
 
+import time
+START_TIME = time.perf_counter()
+
 import argparse
+import atexit
 import os
+import queue
 import re
 import serial
-import serial.tools.list_ports
 import subprocess
 import sys
 import threading
-import time
-import tkinter as tk
 
+# tkinter, asyncio, поиск портов и numpy загружаются только при использовании
+tk = None
+asyncio = None
+
+from checkpoint import CheckpointJournal, load_checkpoint, load_state, mark_recorded, source_id
+from cycleplan import load_plan, resume_preamble
+from estimator import estimate_plan, read_settings
+from feedmonitor import MACHINE, STARVED, UNDERFEED_REPORTS, UNKNOWN, FeedMonitor
+from grblio import GrblReader, Streamer, Transmitter
 from grblmessages import grbl_errors
-# from grblmessages import grbl_alarm
+from grblmessages import grbl_alarm
+from statstore import RESUME_WINDOW, StatStore
+from streamtrace import StreamTrace
 
 from colorama import init, Fore, Style
 init()
@@ -23,43 +36,69 @@ init()
 RX_BUFFER_SIZE = 128    # Размер буфера (байт)
 BAUD_RATE = 115200      # Скорость порта (байт/сек)
 REPORT_INTERVAL = 1.0   # Периодичность (сек, не менее 0.20) запросов состояния (?)
+REPORT_INTERVAL_MIN = 0.2   # Периодичность запросов состояния при опустошении планировщика (режим --planner) и перед сигналом Y
+LOCATE_BLOCKS = 40      # Глубина поиска исполняемого блока от последнего отправленного (планировщик + буфер приёма)
 MAX_ERRORS = 3          # Прерывать программу после N ошибок
-
-port = serial.tools.list_ports.comports()
-ports = []
-for port in serial.tools.list_ports.comports():
-    ports.append(port.name)
-if len(ports) == 0:
-    print(Fore.RED + "\n!!! Подключение GRBL отсутствует !!!\n" + Style.RESET_ALL)
-    exit()
+MAX_CHECK_ERRORS = 20   # Выводить ошибок проверки gcode перед запуском
+GUI_INTERVAL = 200      # Периодичность обновления окна GUI (мс), показывается только последнее состояние
+BANNER_TIMEOUT = 2.5    # Ожидание приветствия GRBL после открытия порта (сек), через Bluetooth приветствия нет
 
 if os.name == 'posix':                          # параметры для Linux
-    DEVICE = f'/dev/{ports[0]}'
     PATH_PLAYER = '/usr/bin/mpv'                # путь к проигрывателю
     PLAYER_OPTIONS="--no-terminal"              # параметры проигрывателя
     PATH_SOUND_1 = f'{os.getcwd()}/alarm.oga'   # путь к звуковому файлу
     PATH_SOUND_2 = f'{os.getcwd()}/click.ogg'
     PATH_STAT = f'{os.getcwd()}/stat.txt'       # путь к файлу статистики
+    PATH_CACHE = f'{os.getcwd()}/plan_cache'    # путь к кэшу разобранных файлов gcode
+    PATH_CHECKPOINT = f'{os.getcwd()}/checkpoint.jsonl' # путь к журналу контрольных точек цикла
+    PATH_TRACE = f'{os.getcwd()}/trace.bin'     # путь к файлу трассировки передачи (--trace)
 
 else:                           # Windows
-    DEVICE = f'{ports[0]}'
     PATH_PLAYER = 'c:\\mpv\\mpv.com'
     PLAYER_OPTIONS="--no-terminal"
-    PATH_SCRIPT = os.path.realpath(__file__)
-    PATH_SOUND_1 = re.findall(r'.*\\', text)[0] + 'alarm.oga'
-    PATH_SOUND_2 = re.findall(r'.*\\', text)[0] + 'click.ogg'
-    PATH_STAT = re.findall(r'.*\\', text)[0] + 'stat.txt'
+    PATH_SCRIPT = os.path.dirname(os.path.realpath(__file__))
+    PATH_SOUND_1 = os.path.join(PATH_SCRIPT, 'alarm.oga')
+    PATH_SOUND_2 = os.path.join(PATH_SCRIPT, 'click.ogg')
+    PATH_STAT = os.path.join(PATH_SCRIPT, 'stat.txt')
+    PATH_CACHE = os.path.join(PATH_SCRIPT, 'plan_cache')
+    PATH_CHECKPOINT = os.path.join(PATH_SCRIPT, 'checkpoint.jsonl')
+    PATH_TRACE = os.path.join(PATH_SCRIPT, 'trace.bin')
 
 # --------------------------------------------------------------------
 
+# Время этапов запуска (-t)
+startup_times = []
+
+def startup_mark(name):
+    startup_times.append((name, time.perf_counter()))
+
+def show_startup_times():
+    print(f"\n------- ВРЕМЯ ЗАПУСКА -------\n")
+    last = START_TIME
+    for name, mark in startup_times:
+        print(f"{name:<22} {(mark - last)*1000:8.1f} мс")
+        last = mark
+    print(f"{'Всего':<22} {(last - START_TIME)*1000:8.1f} мс\n")
+
+# Первый найденный последовательный порт
+def find_port():
+    import serial.tools.list_ports
+    ports = [port.device for port in serial.tools.list_ports.comports()]
+    return ports[0] if ports else None
+
+startup_mark('Загрузка модулей')
+
 
 # Передача аргументов сценарию
 parser = argparse.ArgumentParser(description='Stream g-code file to grbl', add_help=False)
 parser.add_argument('gcode_file', type=argparse.FileType('r'), help='g-code filename to be streamed')
-parser.add_argument('-p', '--port', type=str, action='store', default=DEVICE, help='serial device path')
+parser.add_argument('-p', '--port', type=str, action='store', default=None, help='serial device path (first found by default)')
 parser.add_argument('-v', '--verbose', action='store_true', default=False, help='suppress output text')
 parser.add_argument('-s', '--simple', action='store_true', default=False, help='simple streaming mode')
-parser.add_argument('-c', '--check', action='store_true', default=False, help='stream in check mode')
+parser.add_argument('-a', '--asyncio', action='store_true', default=False, help='asyncio streaming engine')
+parser.add_argument('-b', '--planner', action='store_true', default=False, help='RX buffer size from Bf: in status reports, planner telemetry, faster status polling while the planner is draining')
+parser.add_argument('-c', '--check', action='store_true', default=False, help='check g-code by GRBL 1.1 rules without machine and exit')
+parser.add_argument('--grbl-check', action='store_true', default=False, help='stream in GRBL check mode ($C)')
 parser.add_argument('-r', '--repeats', type=int, action='store', default=1, help='repeat programm')
 parser.add_argument('-d', '--pieces_distance', type=int, action='store', default=600, help='distance between pieces, mm')
 parser.add_argument('-y', '--y_beep', type=int, action='store', default=0, help='y position for signal, mm')
@@ -67,72 +106,305 @@ parser.add_argument('-l', '--laser', type=int, action='store', default=None, hel
 parser.add_argument('-f', '--speed', type=int, action='store', default=None, help='replace speed G1, mm/min')
 parser.add_argument('-h', '--home', action='store_true', default=False, help='home before start')
 parser.add_argument('-x', '--home_cycles', type=int, action='store', default=0, help='home after n cycles')
+parser.add_argument('--resume-from', type=str, action='store', default=None, help='start first cycle from line N or piece pN')
+parser.add_argument('--compact', action='store_true', default=False,
+                    help='compact g-code: no repeated G0/G1, F, S, coordinates rounded, collinear G1 merged')
+parser.add_argument('--compact-digits', type=int, action='store', default=3, help='compacted coordinate digits')
+parser.add_argument('--merge-tolerance', type=float, action='store', default=0.01, help='collinear G1 merge tolerance, mm')
+parser.add_argument('--reorder', action='store_true', default=False, help='reorder groups between G0 to shorten rapid travel')
+parser.add_argument('--reverse-groups', action='store_true', default=False, help='allow reversed G1 groups when reordering')
+parser.add_argument('--trace', action='store_true', default=False, help='trace sends, acks and status reports to trace.bin')
+parser.add_argument('-t', '--timing', action='store_true', default=False, help='show startup timing')
 
 args = parser.parse_args()
 
+# Поиск порта, только если он не задан (-p /dev/pts/N - имитатор grblsim.py), для проверки gcode порт не нужен
+if not args.port and not args.check:
+    args.port = find_port()
+    startup_mark('Поиск порта')
+if not args.port and not args.check:
+    print(Fore.RED + "\n!!! Подключение GRBL отсутствует !!!\n" + Style.RESET_ALL)
+    exit()
+
 file = args.gcode_file
 gcode_name = re.sub(r'(\s+)', '_', file.name)
 gcode_name = re.sub(r'(.*)(\\|/)', '', gcode_name)
-for count, _ in enumerate(file):
-    pass
-lines_in_file = count + 1
 file_size = os.path.getsize(file.name)
 
+# Однократный разбор файла gcode для всех циклов (или план из кэша)
+compact = (args.compact_digits, args.merge_tolerance) if args.compact else None
+plan, plan_cached = load_plan(file, PATH_CACHE, args.pieces_distance, args.laser, args.speed, compact,
+                              args.reorder, args.reverse_groups)
+lines_in_file = plan.lines_in_file
+startup_mark('План (кэш)' if plan_cached else 'Разбор gcode')
+
 verbose = True if args.verbose else False
 
 y_beep_position = args.y_beep if args.y_beep else None
+beep_target = plan.y_crossing(y_beep_position) if y_beep_position else None
+
+# Первый блок для --resume-from: номер строки файла или pN - начало детали N, None - нет в файле
+def resume_block(value):
+    try:
+        if value.lower().startswith('p'):
+            return plan.piece_block(int(value[1:]))
+        index = plan.block_at_line(int(value))
+    except ValueError:
+        return None
+    return index if index < len(plan) else None
+
+# Продолжение первого цикла с середины файла: модальное состояние перед блоком восстанавливается
+# разбором файла от ближайшей сохранённой в плане точки и отправляется командами перед циклом
+resume_start = 0
+resume_commands = []
+if args.resume_from:
+    resume_start = resume_block(args.resume_from)
+    if resume_start is None:
+        print(Fore.RED + f"\n!!! Строка или деталь {args.resume_from} отсутствует в файле !!!\n" + Style.RESET_ALL)
+        exit()
+    resume_commands = resume_preamble(plan.state_before(file, resume_start), args.laser, args.speed)
+    startup_mark('Продолжение')
 
 def homing():
-    last_report_len = 0
     print(f'Homing axes...', end='')
-    ser.write(b"$H\n")
-    while 1:
-        grbl_out = ser.readline().decode().strip()
-        clear_len = last_report_len - len(grbl_out)
-        last_report_len = len(grbl_out)
-        if grbl_out.lower().strip() == 'ok':
-            print(f" >>> {grbl_out}{' '*clear_len}\n")
-            break
+    tx.write(b"$H\n")
+    code = reader.acks.get()
+    print(f" >>> {'ok' if not code else f'error:{code}'}\n")
 
 # Отдельный процесс отправки запросов состояния '?'
 def status_request():
     while is_run:
-      ser.write(b'?')
-      time.sleep(REPORT_INTERVAL)
-
-# Текущие координаты осей из статуса GRBL
-def position_from_status(state):
-    # try:
-    temp = re.search(r'WPos(.*?)(\|)', state, re.IGNORECASE).group()
-    temp = temp[5:-1]
-    coords = temp.split(',')
-    x, y, _ = map(float, coords)
-    return x, y
-
-# Перемещения осей из строки gcode
-def data_from_gcode(line):
-    if ('G1' in line.upper() or 'G0' in line.upper()) and 'X' in line.upper():
-        x_move = re.search(r'X(-?)(\d+)(\.?)(\d*)', line.upper()).group()    # 'X-28.731'
-        x_move = float(x_move[1:])
-    else: x_move = 0
-    if ('G1' in line.upper() or 'G0' in line.upper()) and 'Y' in line.upper():
-        y_move = re.search(r'Y(-?)(\d+)(\.?)(\d*)', line.upper()).group()    # 'Y10'
-        y_move = float(y_move[1:])
-    else: y_move = 0
-    xy_move = (x_move**2 + y_move**2)**0.5
-    if 'G1' in line.upper() and 'S' in line.upper():
-        s = re.search(r'S(\d+)', line.upper()).group()    # 'S800'
-        s_power = int(s[1:])
-        s_move = s_power * xy_move
+      tx.realtime(b'?')
+      time.sleep(report_interval)
+
+# Отдельный процесс обработки отчётов состояния
+def status_monitor():
+    while is_run:
+        while not reader.alarms.empty():
+            show_alarm(reader.alarms.get())
+        while not reader.messages.empty():
+            show_message(reader.messages.get())
+        try:
+            status = reader.status.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        show_status(status)
+
+# Отчёт о состоянии: вывод на экран, заголовок окна и коррекции в GUI, звуковой сигнал
+def show_status(status):
+    global last_status
+    global last_report_len
+    global report_interval
+    global feed_override
+    global beep_armed
+    global beep_switch
+    last_status = status
+    status_event.set()
+
+    if status.overrides:
+        feed_override = status.overrides[0]
+    position = executing_block(status)
+    underfeed = feed_monitor.update(status, position, feed_override, block_index)
+    if underfeed:
+        show_underfeed(underfeed)
+
+    # Расчётное время до конца цикла и до следующей детали
+    eta_out = ''
+    if estimate and position:
+        eta_out = f" {time.strftime('%M:%S', time.gmtime(estimate.remaining(*position) * 100 / feed_override))}"
+        to_piece = estimate.to_next_piece(*position)
+        if to_piece is not None:
+            eta_out += f" (деталь {round(to_piece * 100 / feed_override)} с)"
+
+    percents = round(l_count*100/lines_in_file)
+    my_out = f'    MSG: {repeats_count}/{args.repeats} {l_count}/{lines_in_file} {percents}% {pieces_cycle_count}/{pieces_count}{eta_out}'
+    report_out = f"{my_out} {status}"
+    clear_len = last_report_len - len(report_out)
+    print(f"{report_out}{' '*clear_len}", end='\r') # Clean last report out
+    last_report_len = len(report_out)
+    if window:
+        if is_last_cycle:
+            title = f"{repeats_count}/{repeats_count+1} {percents}% {pieces_cycle_count}/{pieces_count}{eta_out} *"
+        else:
+            title = f"{repeats_count}/{args.repeats} {percents}% {pieces_cycle_count}/{pieces_count}{eta_out}"
+        # Недобор подачи для окна - строкой (период меняется потоком отчётов)
+        underfeed = feed_monitor.current
+        if underfeed and underfeed.reports >= UNDERFEED_REPORTS:
+            underfeed_out = f'Недобор подачи {round(underfeed.ratio*100)}% ({underfeed.cause()})'
+        else:
+            underfeed_out = f'Недоборов подачи за цикл: {len(feed_monitor.periods)}' if feed_monitor.periods else ''
+        gui_queue.put((title, status, eta_out, underfeed_out))
+    if planner_size:
+        planner_update(status)
+    if beep_armed and status.wpos and status.wpos[1] < y_beep_position:
+        beep_armed = False
+        beep_switch = True
+    if beep_switch:
+        beep_predict(status, position)
+    report_interval = REPORT_INTERVAL_MIN if planner_hungry or beep_near else REPORT_INTERVAL
+
+# Исполняемый блок по координатам из отчёта: (индекс блока, доля пути блока) или None
+def executing_block(status):
+    if not status.wpos or status.state not in ('Run', 'Hold'):
+        return None
+    return plan.locate(status.wpos[0], status.wpos[1], max(0, block_index - LOCATE_BLOCKS), block_index + 1)
+
+# Звуковой сигнал по координате Y: момент пересечения прогнозируется по плану (с учётом ускорений,
+# если прочитаны настройки GRBL), текущей подаче и коррекции, таймер уточняется по каждому отчёту.
+# Отчёт с Y за точкой сигнала включает сигнал сразу, если таймер ещё не сработал.
+def beep_predict(status, position):
+    global beep_near
+    if not status.wpos:
+        return
+    if status.wpos[1] > y_beep_position:
+        beep_fire()
+        return
+    beep_near = False
+    beep_cancel()
+    if not beep_target or not position or status.state != 'Run':
+        return
+    i, fraction = position
+    k, fraction_k = beep_target
+    if i > k:
+        return
+    timing = estimate or plan
+    scale = 100 / feed_override
+    if i < k and status.feed:
+        # Остаток исполняемого блока - по текущей подаче из FS, следующие блоки - по расчётному времени
+        remaining = plan.xy_move[i] * (1 - fraction) * 60 / status.feed
+        remaining += timing.time_between(i, 1.0, k, fraction_k) * scale
     else:
-        s_move = 0
-        s_power = 0
-    if 'G1' in line.upper() and 'F' in line.upper():
-        f_speed = re.search(r'F(\d+)', line.upper()).group()    # 'F2000'
-        f_speed = int(f_speed[1:])
+        remaining = timing.time_between(i, fraction, k, fraction_k) * scale
+    beep_near = remaining < 2*REPORT_INTERVAL
+    beep_schedule(max(0.0, remaining))
+
+def beep_schedule(delay):
+    global beep_timer
+    if grbl:
+        beep_timer = asyncio.get_running_loop().call_later(delay, beep_fire)
     else:
-        f_speed = None
-    return x_move, y_move, xy_move, f_speed, s_power, s_move
+        beep_timer = threading.Timer(delay, beep_fire)
+        beep_timer.daemon = True
+        beep_timer.start()
+
+def beep_cancel():
+    global beep_timer
+    if beep_timer:
+        beep_timer.cancel()
+        beep_timer = None
+
+def beep_fire():
+    global beep_switch
+    global beep_near
+    if beep_switch:
+        beep_switch = False
+        beep_near = False
+        beep_cancel()
+        beep(1)
+
+# Период недобора подачи: длительность, наименьшая доля заданной подачи, строки файла и причина
+def show_underfeed(period):
+    lines = f'{plan.line_no[period.first]}'
+    if period.last != period.first:
+        lines += f'-{plan.line_no[period.last]}'
+    print(Fore.YELLOW + f"\n  Недобор подачи {period.duration():.1f} с, до {round(period.ratio*100)}% заданной, "
+          f"строки {lines}/{lines_in_file} ({period.cause()})" + Style.RESET_ALL)
+
+def show_alarm(alarm):
+    print(Fore.RED + f"\n  ALARM:{alarm} {grbl_alarm.get(alarm, '')}" + Style.RESET_ALL)
+
+def show_message(message):
+    if verbose:
+        print(f"\n  MSG< {message}")
+
+# Подготовка блока плана к отправке: звуковой сигнал, счётчики деталей
+# False - остановка перед блоком по запросу "последняя деталь"
+def block_prepare(i):
+    global l_count
+    global pieces_count
+    global pieces_cycle_count
+    global block_index
+    l_count = plan.line_no[i]
+    block_index = i
+
+    # Звуковой сигнал, если надена метка ; beep
+    if plan.beep[i]:
+        beep(1)
+
+    # Счётчики деталей (деталь, с которой продолжен цикл, не завершает предыдущую)
+    if plan.piece[i] and i != cycle_start:
+        pieces_count += 1
+        pieces_cycle_count += 1
+        if is_last_piece:
+            return False
+    return True
+
+def block_sent(i):
+    print(f"SND> {plan.line_no[i]}/{lines_in_file} : {plan.text(i)}", end='\r')
+
+# Ответ на блок плана: контрольная точка (запись журнала по бюджету) и вывод
+def block_acked(code, i):
+    checkpoints.ack(i)
+    if verbose and not code:
+        print(f"  REC< line {plan.line_no[i]}/{lines_in_file} : ok", end='\r')
+
+# Ошибка в ответ на блок плана
+def block_error(code, i):
+    global errors_count
+    print_error(code, plan.line_no[i], plan.text(i))
+    errors_count += 1
+    if errors_count > MAX_ERRORS:
+        print(Fore.RED + f'\n\n!!! Слишком много ошибок !!!\n\n' + Style.RESET_ALL)
+        trace_dump()
+        os._exit(1)
+
+# Запись трассировки в файл (однократно: по завершении, при Ctrl+C или выходе из-за ошибок)
+def trace_dump():
+    global trace
+    if not trace:
+        return
+    mode = 'simple' if args.simple else 'planner' if args.planner else 'aggressive'
+    trace.dump(PATH_TRACE, plan, gcode=gcode_name, rx_size=rx_size, planner_size=planner_size,
+               mode=mode + (', asyncio' if args.asyncio else ''))
+    print(f"\nТрассировка:       {PATH_TRACE} ({min(trace.count, trace.records)} записей)\n")
+    trace = None
+
+# Realtime-команда: через цикл asyncio или вне очереди блоков потока отправки
+def realtime(data):
+    if grbl:
+        grbl.write_realtime(data)
+    else:
+        tx.realtime(data)
+
+# Свободные блоки планировщика и байты приёмного буфера из статуса GRBL (Bf:15,128)
+def buffer_from_status(status):
+    if status.planner_free is None:
+        return None
+    return status.planner_free, status.rx_free
+
+# Размер планировщика и приёмного буфера по статусу GRBL в состоянии Idle
+def detect_buffers():
+    tx.realtime(b'?')
+    try:
+        return buffer_from_status(reader.status.get(timeout=5))
+    except queue.Empty:
+        return None
+
+# Заполнение планировщика по статусу GRBL (режим --planner)
+def planner_update(status):
+    global planner_hungry
+    global planner_reports
+    global planner_empty
+    planner_free = status.planner_free
+    if planner_free is None:
+        return
+    # Планировщик пуст во время работы - GRBL ожидает блоки от сценария
+    if status.state == 'Run':
+        planner_reports += 1
+        if planner_free >= planner_size:
+            planner_empty += 1
+    # Частые запросы при опустошении планировщика, редкие - при заполненном
+    planner_hungry = planner_free > planner_size // 2
 
 def beep(num=1):
     if not os.path.exists(PATH_PLAYER):
@@ -158,60 +430,48 @@ def read_output():
             break
     return grbl_out
 
-# Запись статистики в файл
-def add_stat(start_time_cycle, pieces_cycle_count, x_move, y_move, average_power):
-    line = f'{int(start_time_cycle)} {int(time.time())} {gcode_name} {pieces_cycle_count} {int(x_move)} {int(y_move)} {int(average_power)} {id}'
-    with open(PATH_STAT, 'a') as file_stat:
-        file_stat.write(f'{line}\n')
-
-# Считывание статистики из файла
-def get_stat():
-    stat_time = 0
-    stat_pieces = 0
-    stat_move_x = 0
-    stat_move_y = 0
-    stat_power = 0
-    file = open(PATH_STAT, 'r')
-    for line in file:
-        data = re.split('\s+', line.strip())
-        if len(data) > 6:
-            stat_time += int(data[1]) - int(data[0]) # sec
-            stat_pieces += int(data[3])
-            stat_move_x += int(data[4]) # mm
-            stat_move_y += int(data[5]) # mm
-            # stat_power += int(data[6]) * (int(data[4])**2 + int(data[5])**2) **0.5 # by x,y moves
-            stat_power += int(data[6]) * (int(data[1]) - int(data[0])) # by time
-    file.close()
-    # stat_power = int(stat_power / ((stat_move_x**2 + stat_move_y**2) **0.5))
-    stat_power = int(stat_power / stat_time)
-    return stat_time, stat_pieces, stat_move_x, stat_move_y, stat_power
+# Вывод ошибки в ответ на блок gcode
+def print_error(err_key, l_count, l_block=''):
+    if err_key in grbl_errors.keys():
+        err_key = f'{err_key} {grbl_errors[err_key]}'
+    print(Fore.RED + f"\n  ERR< {l_count}/{lines_in_file} {l_block} : {err_key}" + Style.RESET_ALL)
+
+# Запись статистики в файл и обновление индекса
+# underfeed - секунды недобора подачи (голодание, станок), записываются, если не округляются до нуля;
+# перед ними оператор без имени записывается как '---'
+def add_stat(start_time_cycle, pieces_cycle_count, x_move, y_move, average_power, finish_time=None, operator=None, underfeed=None):
+    operator = id if operator is None else operator
+    line = f'{int(start_time_cycle)} {int(finish_time or time.time())} {gcode_name} {pieces_cycle_count} {int(x_move)} {int(y_move)} {int(average_power)} {operator}'
+    if underfeed and any(round(seconds) for seconds in underfeed):
+        line = f"{line.rstrip()}{'' if operator else ' ---'} {round(underfeed[0])} {round(underfeed[1])}"
+    stat_store.append(line)
 
 # ----------- tkinter --------------
 def cycle_resume():
     # print('Resume')
-    ser.write(b'~')
+    realtime(b'~')
 
 def cycle_hold():
     # print('Hold')
-    ser.write(b'!')
+    realtime(b'!')
 
 def soft_reset():
     # print('Soft-Reset')
-    ser.write(b"\x18")
+    realtime(b"\x18")
 
 # SPEED
 def override_speed_reset():
-    ser.write(b"\x90")
+    realtime(b"\x90")
     label_speed['text'] = '+0%'
 
 def override_speed(num):
     current_value = int(label_speed['text'][:-1])
     new_value = int(current_value + num)
     if new_value >= -90 and new_value <= 100:
-        if num == 10: ser.write(b"\x91")
-        if num == -10: ser.write(b"\x92")
-        if num == 1: ser.write(b"\x93")
-        if num == -1: ser.write(b"\x94")
+        if num == 10: realtime(b"\x91")
+        if num == -10: realtime(b"\x92")
+        if num == 1: realtime(b"\x93")
+        if num == -1: realtime(b"\x94")
         if new_value >= 0:
             label_speed['text'] = f'+{new_value}%'
         else:
@@ -219,17 +479,17 @@ def override_speed(num):
 
 # LASER
 def override_laser_reset():
-    ser.write(b"\x99")
+    realtime(b"\x99")
     label_laser['text'] = '+0%'
 
 def override_laser(num):
     current_value = int(label_laser['text'][:-1])
     new_value = int(current_value + num)
     if new_value >= -90 and new_value <= 100:
-        if num == 10: ser.write(b"\x9A")
-        if num == -10: ser.write(b"\x9B")
-        if num == 1: ser.write(b"\x9C")
-        if num == -1: ser.write(b"\x9D")
+        if num == 10: realtime(b"\x9A")
+        if num == -10: realtime(b"\x9B")
+        if num == 1: realtime(b"\x9C")
+        if num == -1: realtime(b"\x9D")
         if new_value >= 0:
             label_laser['text'] = f'+{new_value}%'
         else:
@@ -262,13 +522,51 @@ def last_piece():
         button_last_piece.configure(bg="yellow", fg="black")
     
 def gui():
+    gui_create()
+    window.mainloop()
+
+# Окно обновляется только из потока Tk: состояния из очереди забираются по таймеру window.after(),
+# показывается последнее, промежуточные пропускаются
+def gui_refresh():
+    view = None
+    try:
+        while True:
+            view = gui_queue.get_nowait()
+    except queue.Empty:
+        pass
+    if view:
+        title, status, eta_out, underfeed_out = view
+        window.title(title)
+        if status.overrides:
+            label_speed['text'] = f'{status.overrides[0]-100:+d}%'
+            label_laser['text'] = f'{status.overrides[2]-100:+d}%'
+        label_info['text'] = gui_info(status, eta_out, underfeed_out)
+    window.after(GUI_INTERVAL, gui_refresh)
+
+# Состояние, подача, заполнение планировщика и буфера приёма GRBL, недобор подачи, расчётное время
+def gui_info(status, eta_out, underfeed_out=''):
+    lines = [f"{status.state}  F{round(status.feed) if status.feed is not None else '-'} S{round(status.spindle) if status.spindle is not None else '-'}"]
+    if status.planner_free is not None:
+        planner = f'{planner_size - status.planner_free}/{planner_size}' if planner_size else f'свободно {status.planner_free}'
+        lines.append(f'Планировщик {planner}  RX {rx_size - status.rx_free}/{rx_size}')
+    if underfeed_out:
+        lines.append(underfeed_out)
+    lines.append(f'Осталось{eta_out}' if eta_out else '')
+    return '\n'.join(lines)
+
+def gui_create():
+    global tk
     global window
     global button_last_cycle
     global button_last_piece
-    
+    global label_speed
+    global label_laser
+    global label_info
+
+    import tkinter as tk
     window = tk.Tk()
     window.title('GRBL Control')
-    window.geometry('260x505+100+0')
+    window.geometry('260x580+100+0')
     
     frame_c = tk.Frame(master=window)
     frame_c.grid(row=8, column=2)
@@ -312,17 +610,36 @@ def gui():
     button_last_cycle.grid(row=7, column=0)
     button_last_piece = tk.Button(master=frame_c, text="ПОСЛЕДНЯЯ\nДЕТАЛЬ", width=15, height=3, bg="yellow", fg="black", command=last_piece)
     button_last_piece.grid(row=7, column=1)
-    
+
+    label_info = tk.Label(master=frame_c, text='', width=32, height=4, justify='left')
+    label_info.grid(row=8, column=0, columnspan=2)
+    window.after(GUI_INTERVAL, gui_refresh)
+
     # soft_reset_button = tk.Button(master=frame_c, text="SOFT-RESET", width=15, height=3, bg="red", fg="yellow", command=soft_reset)
     # soft_reset_button.pack()
-
-    window.mainloop()
 # -------------------------------------------------
 
 
+# Ошибки проверки gcode по правилам GRBL 1.1 без станка (план проверяется при разборе и хранится в кэше)
+# С -c только проверка, иначе запуск с ошибками - по подтверждению
+if plan.errors or args.check:
+    print(f"\nПроверка gcode:    {f'ошибок {len(plan.errors)}' if plan.errors else 'ошибок нет'} ({len(plan)} блоков)")
+    for i, code in plan.errors[:MAX_CHECK_ERRORS]:
+        print_error(code, plan.line_no[i], plan.text(i))
+    if len(plan.errors) > MAX_CHECK_ERRORS:
+        print(Fore.RED + f"\n  ... ещё {len(plan.errors) - MAX_CHECK_ERRORS}" + Style.RESET_ALL)
+    print()
+    if args.check:
+        exit(1 if plan.errors else 0)
+    answer = input('Запустить программу с ошибками? (y/n): ')
+    if answer.strip().lower() not in ('y', 'д'):
+        exit()
+    startup_mark('Проверка gcode')
+
 # Вывод общей статистики при запуске сценария
-if os.path.exists(PATH_STAT):
-    stat = get_stat()
+stat_store = StatStore(PATH_STAT)
+stat = stat_store.totals()
+if stat:
     print(Fore.YELLOW + f"\n-------- ОБЩАЯ СТАТИСТИКА --------\n")
     print(f"Время работы:          {int(stat[0]/(1*60*60))} ч")
     print(f"Деталей обработано:    {stat[1]} шт")
@@ -330,52 +647,89 @@ if os.path.exists(PATH_STAT):
     print(f"Перемещения оси Y:     {int(stat[3]/1000)} м")
     print(f"Перемещений с лазером: {int(stat[4]/10)} %")
     print(f"" + Style.RESET_ALL)
+startup_mark('Статистика')
 
 print(f"\n----------- ПАРАМЕТРЫ ------------\n")
-print(f"Порт:              {DEVICE}")
+print(f"Порт:              {args.port}")
 print(f"Файл Gcode:        {file.name}")
 if args.speed: print(f"Скорость оси X:    {args.speed} мм/мин")
 if args.laser: print(f"Мощность лазера:   {args.laser} %")
 print(f"Количество циклов: {args.repeats}")
 print(f"Между деталями:    {args.pieces_distance} мм")
 if y_beep_position: print(f"Звуковой сигнал Y: {y_beep_position} мм")
+if plan.reordered:
+    before, after = plan.reordered
+    print(f"Холостые ходы:     {round(before)} -> {round(after)} мм за цикл (-{round(before - after)} мм)")
+if plan.compacted:
+    blocks, size = plan.compacted
+    print(f"Сжатие gcode:      блоков {blocks} -> {len(plan)} (-{100 - len(plan)*100/blocks:.1f}%), "
+          f"байт {size} -> {len(plan.wire)} (-{100 - len(plan.wire)*100/size:.1f}%)")
+elif plan.compact_error:
+    print(Fore.RED + f"Сжатие gcode отменено, траектория не совпадает: {plan.compact_error}" + Style.RESET_ALL)
+if resume_start: print(f"Первый цикл:       со строки {plan.line_no[resume_start]}/{lines_in_file}")
 
 if args.simple:
     print(Fore.RED + f"Режим:             Simple streaming (может вызывать остановки в работе)" + Style.RESET_ALL)
+elif args.planner:
+    print(f"Режим:             Planner-aware streaming")
 else:
     # print(f"Режим:             Agressive streaming")
     pass
 
 
+# Прерванный цикл (журнал контрольных точек остался после сбоя): строка статистики выполненной части
+# и предложение продолжить цикл с блока, следующего за последним подтверждённым GRBL
+def checkpoint_offer():
+    global resume_start
+    global resume_commands
+    record = load_checkpoint(PATH_CHECKPOINT)
+    if not record:
+        return
+    if record['source'] != source_id(file):
+        print(Fore.RED + f"\nПрерванный цикл файла {record['source'][0]}: журнал сохранён до запуска с этим файлом" + Style.RESET_ALL)
+        return
+    start, end = record['start'], record['block'] + 1
+    pieces = record['pieces'] + (end == len(plan))
+    if not record.get('recorded') and end > start:
+        x_move, y_move, xy_move, s_move = plan.totals(end, start)
+        add_stat(record['start_time'], pieces, x_move, 2*y_move, s_move / xy_move if xy_move else 0,
+                 record['time'], record['operator'])
+        mark_recorded(PATH_CHECKPOINT, record)
+    print(Fore.YELLOW + f"\nПрерванный цикл {record['cycle']} ({date_time(record['time'])}, {record['operator']}): "
+          f"строка {plan.line_no[min(end, len(plan) - 1)]}/{lines_in_file}, деталей {pieces}" + Style.RESET_ALL)
+    if end >= len(plan) or args.resume_from:
+        os.remove(PATH_CHECKPOINT)
+        return
+    answer = input('Продолжить прерванный цикл с места остановки? (y/n): ')
+    if answer.strip().lower() not in ('y', 'д'):
+        os.remove(PATH_CHECKPOINT)
+        return
+    resume_start = end
+    resume_commands = resume_preamble(load_state(record['state']), args.laser, args.speed)
+
+checkpoint_offer()
+
 # Ввод имени для статистики
+startup_mark('Параметры')
 id = input(f'\nВведите Ваш ID или имя и нажмите Enter: ')
 id = id.strip().upper()
 id = re.sub(r'(\s+)', '_', id)
 
-repeats_count = 0
-pieces_count = 0
 start_time_program = time.time()
-last_time = 0 if args.repeats == 1 else 30*60   # Смотреть записи не старше 30 минут
+last_time = 0 if args.repeats == 1 else RESUME_WINDOW   # Смотреть записи не старше 30 минут
 # Продолжить отсчёт после короткой остановки
-if os.path.exists(PATH_STAT):
-    with open(PATH_STAT, 'r') as file_stat:
-        lines = file_stat.readlines()
-    for line in reversed(lines):
-        data = re.split('\s+', line.strip())
-        if (len(data)>7 and data[7]==id) or (len(data)<8 and id==''):
-            if (int(data[1]) > (start_time_program-last_time)) and (data[2] == gcode_name):
-                repeats_count += 1
-                pieces_count += int(data[3])
-                start_time_program = int(data[0])
-            else:
-                break
+repeats_count, pieces_count, start_time_series = stat_store.resume(id, gcode_name, start_time_program-last_time)
+if start_time_series:
+    start_time_program = start_time_series
+startup_mark('Ввод ID')
 
 
 # Инициализация подклюения к GRBL
 print(f'\nВремя запуска: {date_time(start_time_program)}\n')
 print(f"Порт {args.port}      >>> Initializing Grbl...", end='')
-ser = serial.Serial(args.port, BAUD_RATE, timeout=5, write_timeout=0)
+ser = serial.Serial(args.port, BAUD_RATE, timeout=BANNER_TIMEOUT, write_timeout=0)
 grbl_out = ser.readline().decode().strip()
+ser.timeout = 5
 print(f" >>> {grbl_out}")
 ser.write(b"\r\n\r\n")
 time.sleep(1)
@@ -384,9 +738,10 @@ print(f'SoftReset...   >>> 0x18 >>>', end='')
 ser.write(b"\x18")
 grbl_out = read_output()
 print(f' {grbl_out.split("[")[0]}')
+startup_mark('Подключение GRBL')
 
-# Симуляция выполнения (Check mode)
-if args.check:
+# Прогон через GRBL в режиме проверки ($C): ошибки, зависящие от настроек станка
+if args.grbl_check:
     time.sleep(1)
     ser.write(b"$C\n")
     grbl_out = ser.readline().decode().strip()
@@ -397,242 +752,34 @@ if args.check:
         quit()
     time.sleep(3)
 
-# Панель управления прошивкой во время работы
-timerThread_gui = threading.Thread(target=gui)
-timerThread_gui.daemon = True
-timerThread_gui.start()
-
-# Калибровка осей перед исполнением gcode
-if args.home and not args.check:
-    homing()
-time.sleep(1)
-
-
-# Процесс отправки запросов состояния (?)
-timerThread = threading.Thread(target=status_request)
-timerThread.daemon = True
-is_run = True
-timerThread.start()
+# Расчётное время цикла по настройкам скоростей и ускорений GRBL ($110, $111, $120, $121, $11)
+settings = read_settings(ser)
+if settings:
+    estimate = estimate_plan(plan, settings)
+    piece_times = estimate.piece_times()
+    print(f"Расчётное время:   {round(estimate.total)} сек на цикл ({round(estimate.total/len(piece_times))} сек на деталь)")
+else:
+    estimate = None
+    print(Fore.RED + f"Настройки GRBL ($$) не прочитаны, расчёт времени недоступен" + Style.RESET_ALL)
+startup_mark('Расчёт времени')
 
+# Итоги цикла: статистика и вывод на экран, возвращает начальную позицию следующего цикла
+def cycle_finish(start_time_cycle, l_end):
+    global repeats_count
+    global pieces_count
+    global pieces_cycle_count
 
-is_last_cycle = False
-is_last_piece = False
+    checkpoints.finish()
+    if checkpoints.error:
+        print(Fore.RED + f"Журнал контрольных точек не записан: {checkpoints.error}" + Style.RESET_ALL)
+        checkpoints.error = None
 
-print('\n')
-# Циклическая обработка gcode
-while repeats_count < args.repeats:
-    start_time_cycle = time.time()
-    pieces_cycle_count = 0
-    x_move_cycle_count = 0
-    y_move_cycle_count = 0
-    xy_move_cycle_count = 0
-    s_cycle_count = 0
-    errors_count = 0
-    last_report_len = 0
+    # Звуковой сигнал по метке ; beep в конце файла
+    if plan.end_beep and l_end == len(plan):
+        beep(1)
 
-    file.seek(0) # Start read file from begin
-
-    beep_switch = True if y_beep_position else False
-
-    # Простой способ отправки команд (без буфера)
-    if args.simple:
-        # Send settings file via simple call-response streaming method. Settings must be streamed
-        # in this manner since the EEPROM accessing cycles shut-off the serial interrupt.
-
-        l_count = 0
-        for line in file:
-            l_count += 1 # Iterate line counter
-            x, y, xy, f, s, sxy = data_from_gcode(line)
-
-            # Сохранить начальную позию для следующего цикла
-            if 'G0' in line.upper() and x and y:
-                start_position = line
-
-            # Звуковой сигнал, если надена метка ; beep
-            if '; beep' in line.lower():
-                beep(1)
-
-            # Счётчики деталей
-            if 'G1' in line.upper() and not s and y >= args.pieces_distance:
-                pieces_count += 1
-                pieces_cycle_count += 1
-                if is_last_piece:
-                    break
-
-            # Статистика
-            if 'G1' in line.upper() or 'G0' in line.upper():
-                x_move_cycle_count += abs(x)
-                y_move_cycle_count += abs(y)
-                xy_move_cycle_count += xy
-                s_cycle_count += sxy
-
-            # Подмена мощности лазера S
-            if args.laser and int(args.laser)<=100 and s:
-                line = re.sub(r'S(\d+)', f'S{args.laser*10}', line)
-
-            # Подмена скорости F
-            if args.speed and F:
-                line = re.sub(r'F(\d+)', f'F{args.speed}', line)
-                
-            l_block = re.sub(r'(\s)|(;.*)', '', line).upper()
-            if not l_block:
-                continue
-
-            if verbose:
-                print(f"SND> line {l_count}/{lines_in_file} : {l_block}", end='\r')
-
-            ser.write(l_block.encode() + b'\n')
-
-            while True:
-                grbl_out = ser.readline().decode().strip()
-
-                if grbl_out.lower().strip() == 'ok':
-                    if verbose:
-                        print(f"  REC< line {l_count}/{lines_in_file} : {grbl_out}", end='\r')
-                    break
-
-                elif 'error' in grbl_out.lower():
-                    err_key = int(grbl_out.split(':')[1])
-                    if err_key in grbl_errors.keys():
-                        err_key = f'{err_key} {grbl_errors[err_key]}'
-                    print(Fore.RED + f"\n  ERR< {l_count}/{lines_in_file} {l_block} : {err_key}" + Style.RESET_ALL)
-                    errors_count += 1
-                    if errors_count >= MAX_ERRORS:
-                        print(Fore.RED + f'\n\n!!! Слишком много ошибок !!!\n\n' + Style.RESET_ALL)
-                        exit()
-
-                else: # --- MSG --- MSG --- MSG ---
-                    my_out = f'    MSG:  {repeats_count}/{args.repeats} {l_count}/{lines_in_file} {int(l_count*100/lines_in_file)}% {pieces_cycle_count}/{pieces_count}'
-                    report_out = f"{my_out} {grbl_out}"
-                    clear_len = last_report_len - len(report_out)
-                    print(f"{report_out}{' '*clear_len}", end='\r')
-                    last_report_len = len(report_out)
-
-                    if 'pos' in grbl_out.lower():
-                        if beep_switch and (position_from_status(grbl_out)[1]>y_beep_position):
-                            beep(1)
-                            beep_switch = False
-                # time.sleep(0.01)
-    else:
-        # Send g-code program via a more agressive streaming protocol that forces characters into
-        # Grbl's serial read buffer to ensure Grbl has immediate access to the next g-code command
-        # rather than wait for the call-response serial protocol to finish. This is done by careful
-        # counting of the number of characters sent by the streamer to Grbl and tracking Grbl's
-        # responses, such that we never overflow Grbl's serial read buffer.
-
-        l_count = 0         # Lines file counter
-        l_block_count = 0   # Lines with g-code counter
-        g_count = 0         # Received responses counter
-        c_line = []
-        for line in file:
-            l_count += 1 # Iterate line counter
-            x, y, xy, F, s, sxy = data_from_gcode(line)
-
-            # Сохранить начальную позию для следующего цикла
-            if 'G0' in line.upper() and x and y:
-                start_position = line
-
-            # Звуковой сигнал, если надена метка ; beep
-            if '; beep' in line.lower():
-                beep(1)
-
-            # Счётчики деталей
-            if 'G1' in line.upper() and not s and y >= args.pieces_distance:
-                pieces_count += 1
-                pieces_cycle_count += 1
-                if is_last_piece:
-                    break
-
-            # Статистика
-            if 'G1' in line.upper() or 'G0' in line.upper():
-                x_move_cycle_count += abs(x)
-                y_move_cycle_count += abs(y)
-                xy_move_cycle_count += xy
-                s_cycle_count += sxy
-
-            # Подмена мощности лазера S
-            if args.laser and int(args.laser)<=100 and s:
-                line = re.sub(r'S(\d+)', f'S{args.laser*10}', line)
-
-            # Подмена скорости F
-            if args.speed and F:
-                line = re.sub(r'F(\d+)', f'F{args.speed}', line)
-
-            l_block = re.sub(r'(\s)|(;.*)', '', line).upper()
-            if not l_block:
-                continue
-
-            l_block_count += 1
-            c_line.append(len(l_block)+1) # Track number of characters in grbl serial read buffer
-            # print(f'{sum(c_line)} : {c_line} : {ser.inWaiting()}')    # Buffer debug
-
-            while sum(c_line) >= RX_BUFFER_SIZE-1 or ser.inWaiting():
-                out_temp = ser.readline().decode().strip()
-
-                if out_temp.lower().strip() == 'ok':
-                    g_count += 1 # Iterate g-code counter
-                    del c_line[0] # Delete the block character count corresponding to the last 'ok'
-                    if verbose:
-                        print(f"  REC< line {l_count}/{lines_in_file} : {out_temp}", end='\r')
-
-                elif 'error' in out_temp:
-                    g_count += 1 # Iterate g-code counter
-                    del c_line[0]
-                    err_key = int(out_temp.split(':')[1])
-                    if err_key in grbl_errors.keys():
-                        err_key = f'{err_key} {grbl_errors[err_key]}'
-                    print(Fore.RED + f"\n  ERR< {l_count}/{lines_in_file} {l_block} : {err_key}" + Style.RESET_ALL) # Debug response
-                    errors_count += 1
-                    if errors_count > MAX_ERRORS:
-                        print(Fore.RED + f'\n\n!!! Слишком много ошибок !!!\n\n' + Style.RESET_ALL)
-                        exit()
-
-                else:
-                    percents = round(l_count*100/lines_in_file)
-                    # percents = int(l_count*100//lines_in_file + (l_count*100%lines_in_file/lines_in_file >= 0.5))
-                    my_out = f'    MSG: {repeats_count}/{args.repeats} {l_count}/{lines_in_file} {percents}% {pieces_cycle_count}/{pieces_count}'
-                    report_out = f"{my_out} {out_temp}"
-                    clear_len = last_report_len - len(report_out)
-                    print(f"{report_out}{' '*clear_len}", end='\r') # Clean last report out
-                    last_report_len = len(report_out)
-                    if is_last_cycle:
-                        title = f"{repeats_count}/{repeats_count+1} {percents}% {pieces_cycle_count}/{pieces_count} *"
-                    else:
-                        title = f"{repeats_count}/{args.repeats} {percents}% {pieces_cycle_count}/{pieces_count}"
-                    window.title(title)
-                    if 'pos' in out_temp.lower():
-                        if beep_switch and (position_from_status(out_temp)[1]>y_beep_position):
-                            beep(1)
-                            beep_switch = False
-
-            if verbose:
-                print(f"SND> {l_count}/{lines_in_file} : {l_block}", end='\r')
-
-            ser.write(l_block.encode() + b'\n')
-
-        # Wait until all responses have been received.
-        while l_block_count > g_count:
-            out_temp = ser.readline().decode().strip()
-            # print(f'{sum(c_line)} : {c_line} : {ser.inWaiting()}')    # Buffer debug
-            if out_temp.lower().strip() == 'ok':
-                g_count += 1 # Iterate g-code counter
-                del c_line[0] # Delete the block character count corresponding to the last 'ok'
-                if verbose:
-                    print(f"  REC< line {l_count}/{lines_in_file} : {out_temp}", end='\r')
-            elif 'error' in out_temp:
-                g_count += 1 # Iterate g-code counter
-                del c_line[0]
-                err_key = int(out_temp.split(':')[1])
-                if err_key in grbl_errors.keys():
-                    err_key = f'{err_key} {grbl_errors[err_key]}'
-                print(Fore.RED + f"\n  ERR< {l_count}/{lines_in_file} : {err_key}" + Style.RESET_ALL) # Debug response
-                errors_count += 1
-            else:
-                my_out = f'    MSG: {repeats_count}/{args.repeats} {l_count}/{lines_in_file} {int(l_count*100/lines_in_file)}% {pieces_cycle_count}/{pieces_count}'
-                report_out = f"{my_out} {out_temp}"
-                clear_len = last_report_len - len(report_out)
-                print(f"{report_out}{' '*clear_len}", end='\r')
-                last_report_len = len(report_out)
+    # Статистика цикла из плана
+    x_move_cycle_count, y_move_cycle_count, xy_move_cycle_count, s_cycle_count = plan.totals(l_end, cycle_start)
 
     repeats_count += 1
     seconds_elapsed_cycle = round(time.time() - start_time_cycle)
@@ -641,10 +788,14 @@ while repeats_count < args.repeats:
     pieces_cycle_count += 1
     # piece_average_time = round(seconds_elapsed_cycle / pieces_cycle_count)
     piece_average_time = seconds_elapsed_cycle//pieces_cycle_count + (seconds_elapsed_cycle%pieces_cycle_count > 0)
-    average_power = s_cycle_count / xy_move_cycle_count
+    average_power = s_cycle_count / xy_move_cycle_count if xy_move_cycle_count else 0
+
+    underfeed = feed_monitor.finish()
+    if underfeed:
+        show_underfeed(underfeed)
+    add_stat(start_time_cycle, pieces_cycle_count, x_move_cycle_count, 2*y_move_cycle_count, average_power,
+             underfeed=(feed_monitor.seconds[STARVED], feed_monitor.seconds[MACHINE]))
 
-    add_stat(start_time_cycle, pieces_cycle_count, x_move_cycle_count, 2*y_move_cycle_count, average_power)
-    
     date_start = time.strftime('%d-%m-%Y', time.localtime(start_time_program))
     date_finish = time.strftime('%d-%m-%Y', time.localtime())
     if date_start == date_finish:
@@ -657,34 +808,291 @@ while repeats_count < args.repeats:
     print(f"Время работы:      {time.strftime('%H:%M:%S', time.gmtime(seconds_elapsed_program))} ({period})")
     print(f"Время цикла:       {seconds_elapsed_cycle} сек {time.strftime('%M:%S', time.localtime(seconds_elapsed_cycle))} ({piece_average_time} сек на деталь)")
     print(f"Завершено:         циклов - {repeats_count}, деталей - {pieces_count}")
+    if estimate and estimate.start[l_end] > estimate.start[cycle_start]:
+        # Сравнение с расчётом: потери на опустошение планировщика, коррекции скорости, паузы
+        planned = estimate.start[l_end] - estimate.start[cycle_start]
+        print(f"Расчётное время:   {round(planned)} сек (фактическое {round((time.time() - start_time_cycle)*100/planned - 100):+d}%)")
     # print(f"Laser moves: {int(average_power/10)}%")
     print(f"\n" + Style.RESET_ALL)
     if errors_count:
         print(Fore.RED + f"!!! {errors_count} ошибок !!!\n" + Style.RESET_ALL)
+    if planner_size:
+        print(f"Планировщик пуст:  {planner_empty} из {planner_reports} отчётов в работе\n")
+    if feed_monitor.periods:
+        seconds = feed_monitor.seconds
+        print(Fore.YELLOW + f"Недобор подачи:    {len(feed_monitor.periods)} раз, голодание {seconds[STARVED]:.1f} с, "
+              f"станок {seconds[MACHINE]:.1f} с" + (f", неизвестно {seconds[UNKNOWN]:.1f} с" if seconds[UNKNOWN] else '')
+              + "\n" + Style.RESET_ALL)
+    # Записей в порт (пакетов) в секунду и байт на запись: сравнение USB и Bluetooth
+    writer = grbl or tx
+    writes, written = writer.writes - cycle_writes[0], writer.bytes_written - cycle_writes[1]
+    seconds = time.time() - start_time_cycle
+    if writes and seconds:
+        print(f"Запись в порт:     {writes/seconds:.1f} записей/с, {written/writes:.1f} байт/запись\n")
+
+    # None - в плане до l_end нет G0 X Y: возврат к началу не отправляется
+    return plan.start_position(l_end)
+
+# Задержка паузы (!) от нажатия кнопки до записи в порт
+def show_hold_latency():
+    latency = (grbl or tx).hold_latency
+    if latency:
+        print(f"Пауза (!):         задержка записи в порт {sum(latency)/len(latency)*1000:.2f} мс в среднем, "
+              f"{max(latency)*1000:.2f} мс максимум ({len(latency)} нажатий)\n")
+
+# Калибровка осей после цикла (каждые --home_cycles циклов)
+def homing_needed():
+    return args.home_cycles and not args.grbl_check and not is_last_cycle and not repeats_count%args.home_cycles
+
+# Оси вернулись к началу следующего цикла
+def cycle_returned(status):
+    return status.state == 'Idle' or (y_beep_position and status.wpos and status.wpos[1] < y_beep_position)
+
+# Последний цикл: по количеству повторов или по запросу
+def cycles_done():
+    return is_last_cycle or repeats_count >= args.repeats
+
+# Ожидание отчёта о состоянии, удовлетворяющего условию (потоковый режим)
+def wait_status(predicate):
+    while 1:
+        status_event.clear()
+        status_event.wait()
+        if predicate(last_status):
+            return
+
+# Сброс счётчиков в начале цикла, возвращает первый блок цикла (после --resume-from только в первом цикле)
+def cycle_begin():
+    global cycle_start
+    global resume_start
+    global start_time_cycle
+    global pieces_cycle_count
+    global errors_count
+    global last_report_len
+    global planner_reports
+    global planner_empty
+    global beep_switch
+    global beep_armed
+    global block_index
+    global cycle_writes
+    start_time_cycle = time.time()
+    writer = grbl or tx
+    cycle_writes = (writer.writes, writer.bytes_written)
+    pieces_cycle_count = 0
+    errors_count = 0
+    last_report_len = 0
+    planner_reports = 0
+    planner_empty = 0
+    cycle_start = resume_start
+    resume_start = 0
+    checkpoints.begin(id, gcode_name, repeats_count + 1, pieces_count, start_time_cycle, cycle_start)
+    # Сигнал не нужен, если цикл продолжен после точки сигнала. Цикл отправляется во время возврата к началу,
+    # поэтому сигнал включается по первому отчёту с Y ниже точки сигнала
+    beep_switch = False
+    beep_armed = True if y_beep_position and not (beep_target and beep_target[0] < cycle_start) else False
+    block_index = cycle_start
+    beep_cancel()
+    feed_monitor.begin()
+    if trace:
+        trace.cycle(cycle_start)
+    return cycle_start
+
+# Восстановление модального состояния перед продолжением цикла
+def resume_show(code):
+    print(f"Продолжение со строки {plan.line_no[cycle_start]}: {' '.join(data.decode().strip() for data in resume_commands)}", end='')
+    print(f" >>> {'ok' if not code else f'error:{code}'}\n")
+
+# Обновление окна GUI в цикле asyncio
+async def gui_update():
+    global window
+    while window:
+        try:
+            window.update()
+        except tk.TclError:
+            window = None   # Окно закрыто
+        await asyncio.sleep(0.05)
+
+# Потоковая передача на asyncio: чтение, отправка, запросы состояния и GUI в одном потоке
+async def async_main():
+    global grbl
+    global window
+    global rx_size
+    global planner_size
+
+    grbl = AsyncGrbl(ser)
+    grbl.trace = trace
+    streamer = AsyncStreamer(grbl, plan, rx_size, args.simple, lambda: report_interval,
+                             block_prepare, show_status, block_error, show_alarm, show_message, block_acked,
+                             trace)
+    streamer.start()
+    try:
+        gui_create()
+    except Exception:   # Нет дисплея (TclError) или tkinter
+        window = None
+    gui_task = asyncio.create_task(gui_update())
+
+    # Калибровка осей перед исполнением gcode
+    if args.home and not args.grbl_check:
+        print(f'Homing axes...', end='')
+        code = await streamer.command(b"$H\n")
+        print(f" >>> {'ok' if not code else f'error:{code}'}\n")
+    await asyncio.sleep(1)
+
+    # Размеры буферов GRBL для режима --planner
+    if args.planner and not args.simple:
+        try:
+            buffers = buffer_from_status(await asyncio.wait_for(streamer.wait_status(lambda status: True), 5))
+        except asyncio.TimeoutError:
+            buffers = None
+        if buffers:
+            planner_size, rx_size = buffers
+            streamer.rx_size = rx_size
+            print(f"Буферы GRBL:       планировщик {planner_size} блоков, приём {rx_size} байт\n")
+        else:
+            print(Fore.RED + f"Статус GRBL без Bf: (включите $10=2), размер буфера {RX_BUFFER_SIZE} байт\n" + Style.RESET_ALL)
+
+    print('\n')
+    while repeats_count < args.repeats:
+        start = cycle_begin()
+        if start:
+            resume_show(await streamer.command(*resume_commands))
+        l_end = await streamer.stream_cycle(start)
+        start_position = cycle_finish(start_time_cycle, l_end)
+
+        # Калибровка - после остановки осей. Возврат к началу и следующий цикл идут одним потоком блоков
+        # без опустошения планировщика, возврат ожидается только после последнего цикла
+        if homing_needed():
+            await streamer.wait_status(lambda status: status.state == 'Idle')
+            print(f'Homing axes...', end='')
+            code = await streamer.command(b"$H\n")
+            print(f" >>> {'ok' if not code else f'error:{code}'}\n")
+        else:
+            await streamer.command(b'G90\n', *([start_position] if start_position else []))
+            if cycles_done():
+                await streamer.wait_status(cycle_returned)
+
+        # Завершение исполнения программы по запросу
+        if is_last_cycle:
+            break
+
+    gui_task.cancel()
+    await streamer.stop()
+
+
+rx_size = RX_BUFFER_SIZE
+planner_size = 0
+planner_reports = 0
+planner_empty = 0
+report_interval = REPORT_INTERVAL
+planner_hungry = False
+beep_near = False
+beep_timer = None
+feed_override = 100
+block_index = 0
+cycle_start = 0
+cycle_writes = (0, 0)           # Записей в порт и байт к началу цикла
+checkpoints = CheckpointJournal(PATH_CHECKPOINT, plan, file)
+atexit.register(checkpoints.close)      # Дописать журнал при прерывании сценария
+feed_monitor = FeedMonitor(plan, estimate)
+trace = StreamTrace() if args.trace else None
+if trace:
+    atexit.register(trace_dump)
+
+is_last_cycle = False
+is_last_piece = False
+l_count = 0
+pieces_cycle_count = 0
+errors_count = 0
+last_report_len = 0
+last_status = None
+status_event = threading.Event()
+beep_switch = False
+beep_armed = False
+window = None
+label_speed = label_laser = label_info = None
+gui_queue = queue.SimpleQueue()     # Состояния для окна GUI: (заголовок, GrblStatus, расчётное время, недобор подачи)
+grbl = None
+reader = None
+tx = None
+is_run = True
+
+if args.timing:
+    show_startup_times()
 
-    if args.home_cycles and not args.check and not is_last_cycle  \
-    and not repeats_count%args.home_cycles:
+if args.asyncio:
+    import asyncio
+    from aiostream import AsyncGrbl, AsyncStreamer
+    asyncio.run(async_main())
+else:
+    # Процесс чтения ответов GRBL и единственный поток записи в порт
+    reader = GrblReader(ser)
+    reader.trace = trace
+    reader.start()
+    tx = Transmitter(ser)
+
+    # Панель управления прошивкой во время работы
+    timerThread_gui = threading.Thread(target=gui)
+    timerThread_gui.daemon = True
+    timerThread_gui.start()
+
+    # Калибровка осей перед исполнением gcode
+    if args.home and not args.grbl_check:
         homing()
-    else:
-        ser.write(b'G90\n')
-        ser.write(start_position.encode())
-        check_ok = 0
-        while 1:
-            out_temp = ser.readline().decode().strip()
-            if out_temp.lower().strip() == 'ok':
-                check_ok += 1
-            # print(f'--{out_temp}--', end='\r')
-            if 'pos' in out_temp.lower() and check_ok == 2:
-                if ('idle' in out_temp.lower()) or (position_from_status(out_temp)[1] < y_beep_position):
-                    break
-
-    # Завершение исполнения программы по запросу
-    if is_last_cycle:
-        break
+    time.sleep(1)
+
+    # Размеры буферов GRBL для режима --planner
+    if args.planner and not args.simple:
+        buffers = detect_buffers()
+        if buffers:
+            planner_size, rx_size = buffers
+            print(f"Буферы GRBL:       планировщик {planner_size} блоков, приём {rx_size} байт\n")
+        else:
+            print(Fore.RED + f"Статус GRBL без Bf: (включите $10=2), размер буфера {RX_BUFFER_SIZE} байт\n" + Style.RESET_ALL)
+
+    # Процесс отправки запросов состояния (?)
+    timerThread = threading.Thread(target=status_request)
+    timerThread.daemon = True
+    timerThread.start()
+
+    # Процесс обработки отчётов состояния
+    monitorThread = threading.Thread(target=status_monitor)
+    monitorThread.daemon = True
+    monitorThread.start()
+
+    streamer = Streamer(tx, reader, plan, rx_size, args.simple, block_prepare,
+                        block_sent if verbose else None, block_acked, block_error, trace)
+
+    print('\n')
+    # Циклическая обработка gcode
+    while repeats_count < args.repeats:
+        start = cycle_begin()
+        if start:
+            resume_show(streamer.command(*resume_commands))
+        l_end = streamer.stream_cycle(start)
+        start_position = cycle_finish(start_time_cycle, l_end)
+
+        # Калибровка - после остановки осей. Возврат к началу и следующий цикл идут одним потоком блоков
+        # без опустошения планировщика, возврат ожидается только после последнего цикла
+        if homing_needed():
+            wait_status(lambda status: status.state == 'Idle')
+            homing()
+        else:
+            streamer.command(b'G90\n', *([start_position] if start_position else []))
+            if cycles_done():
+                wait_status(cycle_returned)
+
+        # Завершение исполнения программы по запросу
+        if is_last_cycle:
+            break
+
+    reader.stop()
+    tx.stop()
 
+show_hold_latency()
+trace_dump()
 
 # Закрыть файл и порт
 is_run = False
+checkpoints.close()
 file.close()
 ser.close()
 
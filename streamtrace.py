@@ -0,0 +1,94 @@
+# Трассировка потоковой передачи (--trace)
+# Время отправки каждого блока и заполнение приёмного буфера GRBL (c_sum) после отправки, время прихода каждого
+# подтверждения, отчёты о состоянии (состояние, Bf: свободные блоки планировщика и байты буфера) и начала циклов.
+# Записи фиксированного размера (struct) пишутся в кольцевой буфер в памяти, при заполнении затираются старые.
+# Время - time.perf_counter() (монотонное). Отправки и подтверждения нумеруются, пара - по номеру, поэтому
+# пара находится и после затирания начала буфера. Без --trace трассировка не создаётся, в коде передачи
+# остаётся только проверка trace на None.
+# Файл: строка JSON (параметры, номера строк и тексты блоков) и записи подряд. Отчёт: python tracereport.py trace.bin
+
+import json
+import struct
+import threading
+import time
+
+SEND, ACK, STATUS, CYCLE = 1, 2, 3, 4
+STATES = ('Idle', 'Run', 'Hold', 'Jog', 'Alarm', 'Door', 'Check', 'Home', 'Sleep')
+NONE = 0xFFFF           # Bf: нет в отчёте
+TRACE_RECORDS = 1 << 19 # Записей в кольцевом буфере (22 байта на запись)
+
+# Время, вид, код (ошибка подтверждения, номер состояния), блок (-1 - команда вне плана),
+# номер отправки/подтверждения, значения: SEND - заполнение буфера и длина блока, STATUS - Bf
+_RECORD = struct.Struct('<dBbiIHH')
+
+
+class StreamTrace:
+
+    def __init__(self, records=TRACE_RECORDS):
+        self.records = records
+        self.buffer = bytearray(_RECORD.size * records)
+        self.count = 0                  # Записей всего (включая затёртые)
+        self.sent = 0                   # Номер следующей отправки
+        self.acked = 0                  # Номер следующего подтверждения
+        self._lock = threading.Lock()   # Отправка и приём - в разных потоках
+
+    def _add(self, kind, code, index, number, value, extra):
+        with self._lock:
+            _RECORD.pack_into(self.buffer, self.count % self.records * _RECORD.size,
+                              time.perf_counter(), kind, code, index, number, value, extra)
+            self.count += 1
+
+    # Блок index записан в порт (index -1 - команда вне плана), fill - байт в буфере GRBL вместе с блоком
+    def send(self, index, fill, length):
+        self._add(SEND, 0, index, self.sent, min(fill, NONE), length)
+        self.sent += 1
+
+    # Ответ GRBL в потоке чтения: подтверждение ('ack', код) или отчёт о состоянии ('status', GrblStatus)
+    def reply(self, kind, value):
+        if kind == 'ack':
+            self._add(ACK, value, -1, self.acked, 0, 0)
+            self.acked += 1
+        elif kind == 'status':
+            state = STATES.index(value.state) if value.state in STATES else -1
+            planner = NONE if value.planner_free is None else value.planner_free
+            rx = NONE if value.rx_free is None else value.rx_free
+            self._add(STATUS, state, -1, 0, planner, rx)
+
+    # Начало цикла с блока start: все отправленные блоки подтверждены, нумерация отправок совмещается
+    # с подтверждениями (команды, записанные в порт без трассировки, не сдвигают пары)
+    def cycle(self, start):
+        self.sent = self.acked
+        self._add(CYCLE, 0, start, self.sent, 0, 0)
+
+    # Записи по порядку времени
+    def snapshot(self):
+        with self._lock:
+            size = _RECORD.size
+            if self.count <= self.records:
+                return bytes(self.buffer[:self.count * size]), 0
+            split = self.count % self.records * size
+            return bytes(self.buffer[split:] + self.buffer[:split]), self.count - self.records
+
+    # Запись в файл: параметры и номера строк и тексты блоков плана, встречающихся в записях
+    def dump(self, path, plan, **info):
+        data, dropped = self.snapshot()
+        blocks = [record[3] for record in _RECORD.iter_unpack(data) if record[3] >= 0]
+        first = min(blocks) if blocks else 0
+        end = max(blocks) + 1 if blocks else 0
+        header = dict(info, record=_RECORD.format, dropped=dropped,
+                      clock=time.time() - time.perf_counter(),     # perf_counter -> unix time
+                      first_block=first, lines=list(plan.line_no[first:end]),
+                      texts=[plan.text(i) for i in range(first, end)])
+        with open(path, 'wb') as file:
+            file.write(json.dumps(header, ensure_ascii=False).encode() + b'\n')
+            file.write(data)
+
+
+# Файл трассировки: (параметры, [(время, вид, код, блок, номер, значение, значение), ...])
+def load_trace(path):
+    with open(path, 'rb') as file:
+        header = json.loads(file.readline())
+        data = file.read()
+    record = struct.Struct(header['record'])
+    data = data[:len(data) - len(data) % record.size]   # Запись, не дописанная до сбоя
+    return header, list(record.iter_unpack(data))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# Отчёт по файлу трассировки передачи (stream.py --trace)
+# Задержка подтверждений (процентили), заполнение приёмного буфера, промежутки между отчётами о состоянии,
+# остановки и блоки, на которых они произошли:
+#  - задержка отправки: место в буфере GRBL уже освободилось, а блок записан в порт позже (сценарий, ПК, порт);
+#  - ожидание подтверждения: GRBL долго не подтверждает блок (планировщик заполнен или блок исполняется долго);
+#  - пустой планировщик в состоянии Run (по Bf: в отчётах, $10=2): станок останавливается в ожидании блоков.
+# Пример: python tracereport.py trace.bin -t 20 -n 10
+
+import argparse
+import time
+from colorama import init, Fore, Style
+
+from streamtrace import ACK, CYCLE, NONE, SEND, STATES, STATUS, load_trace
+init()
+
+
+# Значение процентиля q (0..1) по отсортированному списку
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class Trace:
+    __slots__ = ('header', 'records', 'start', 'sends', 'acks', 'statuses')
+
+    def __init__(self, header, records):
+        self.header = header
+        self.records = records
+        self.start = records[0][0] if records else 0.0
+        self.sends = {}             # номер -> (время, блок, заполнение буфера, длина)
+        self.acks = {}              # номер -> (время, код)
+        self.statuses = []          # (время, состояние, свободно блоков, свободно байт)
+        for t, kind, code, index, number, value, extra in records:
+            if kind == SEND:
+                self.sends[number] = (t, index, value, extra)
+            elif kind == ACK:
+                self.acks[number] = (t, code)
+            elif kind == STATUS:
+                self.statuses.append((t, STATES[code] if code >= 0 else '', value, extra))
+
+    # Строка файла и текст блока плана
+    def block(self, index):
+        k = index - self.header['first_block']
+        if index < 0 or not 0 <= k < len(self.header['lines']):
+            return '(команда)'
+        return f"строка {self.header['lines'][k]}: {self.header['texts'][k]}"
+
+    def at(self, t):
+        return f'{t - self.start:9.3f} с'
+
+    # Задержки подтверждений блоков плана: [(задержка, номер отправки)]
+    def latencies(self):
+        result = []
+        for number, (t, index, _, _) in self.sends.items():
+            if index >= 0 and number in self.acks:
+                result.append((self.acks[number][0] - t, number))
+        return result
+
+    # Задержки отправки: от подтверждения, освободившего место для блока, до записи блока в порт
+    # Заполнение буфера восстанавливается по отправкам и подтверждениям: блок помещается,
+    # если вместе с ним занято меньше rx_size-1 байт (как в Streamer), в режиме simple - после ответа на предыдущий
+    def send_delays(self):
+        rx_size = 0 if self.header.get('mode', '').startswith('simple') else self.header.get('rx_size', 128)
+        inflight = {}           # номер -> длина
+        fill = 0
+        ready = None            # Время предыдущей отправки
+        frees = [(0.0, 0)]      # (время, заполнение): после предыдущей отправки и после каждого подтверждения
+        result = []
+        for t, kind, code, index, number, value, extra in self.records:
+            if kind == CYCLE:
+                inflight.clear()
+                fill = 0
+                ready = None
+            elif kind == ACK:
+                fill -= inflight.pop(number, 0)
+                frees.append((t, fill))
+            elif kind == SEND:
+                if index >= 0 and ready is not None:
+                    # Место появилось при предыдущей отправке или с первым подходящим подтверждением после неё
+                    start = next((t_free for t_free, fill_free in frees
+                                  if fill_free + extra < rx_size - 1 or not fill_free), t)
+                    result.append((t - start, index, number))
+                inflight[number] = extra
+                fill += extra
+                ready = t
+                frees = [(t, fill)]
+        return result
+
+    # Промежутки без подтверждений при неподтверждённых блоках: (длительность, номер подтверждения в конце)
+    def ack_gaps(self):
+        result = []
+        previous = None
+        for number in sorted(self.acks):
+            t = self.acks[number][0]
+            send = self.sends.get(number)
+            if send and previous is not None and send[0] < previous:
+                result.append((t - previous, number))
+            previous = t
+        return result
+
+    # Интервалы пустого планировщика в состоянии Run: (начало, конец)
+    def planner_empty(self):
+        sizes = [free for _, _, free, _ in self.statuses if free != NONE]
+        if not sizes:
+            return [], 0
+        size = max(sizes)           # В Idle все блоки свободны
+        result = []
+        begin = None
+        for t, state, free, _ in self.statuses:
+            empty = state == 'Run' and free != NONE and free >= size
+            if empty and begin is None:
+                begin = t
+            elif not empty and begin is not None:
+                result.append((begin, t))
+                begin = None
+        return result, size
+
+    # Последний блок плана, записанный в порт до момента t
+    def last_sent(self, t):
+        last = None
+        for number, (t_send, index, _, _) in self.sends.items():
+            if t_send <= t and index >= 0 and (last is None or t_send > last[0]):
+                last = (t_send, index)
+        return last
+
+
+def show_summary(trace):
+    header = trace.header
+    records = trace.records
+    duration = records[-1][0] - trace.start if records else 0.0
+    print(Fore.YELLOW + f"\n------------ ТРАССИРОВКА ------------\n")
+    print(f"Файл Gcode:        {header.get('gcode', '')}")
+    print(f"Начало:            {time.strftime('%H:%M:%S %d-%m-%Y', time.localtime(trace.start + header['clock']))}")
+    print(f"Режим:             {header.get('mode', '')}, буфер приёма {header.get('rx_size', '')} байт")
+    print(f"Записей:           {len(records)} за {duration:.1f} сек"
+          + (f" (ранние {header['dropped']} затёрты)" if header['dropped'] else ''))
+    blocks = sum(1 for _, index, _, _ in trace.sends.values() if index >= 0)
+    print(f"Блоков отправлено: {blocks}, ответов GRBL {len(trace.acks)}" + Style.RESET_ALL)
+
+    latencies = sorted(latency for latency, _ in trace.latencies())
+    if latencies:
+        print(f"\nЗадержка подтверждения, мс:")
+        print('  ' + '  '.join(f"{name} {percentile(latencies, q) * 1000:.1f}"
+                               for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999)))
+              + f"  max {latencies[-1] * 1000:.1f}")
+    fills = sorted(fill for _, index, fill, _ in trace.sends.values() if index >= 0)
+    if fills:
+        print(f"Заполнение буфера при отправке, байт: среднее {sum(fills) / len(fills):.0f}, "
+              f"p50 {percentile(fills, 0.5)}, p90 {percentile(fills, 0.9)}, max {fills[-1]}")
+    times = [t for t, _, _, _ in trace.statuses]
+    if len(times) > 1:
+        gaps = sorted(b - a for a, b in zip(times, times[1:]))
+        print(f"Отчёты о состоянии: {len(times)}, интервал среднее {sum(gaps) / len(gaps) * 1000:.0f} мс, "
+              f"max {gaps[-1] * 1000:.0f} мс")
+
+
+def show_stalls(trace, threshold, top):
+    delays = [item for item in trace.send_delays() if item[0] >= threshold]
+    print(f"\nЗадержки отправки >= {threshold * 1000:.0f} мс (место в буфере было): {len(delays)}, "
+          f"всего {sum(delay for delay, _, _ in delays):.2f} сек")
+    for delay, index, number in sorted(delays, reverse=True)[:top]:
+        print(Fore.RED + f"  {trace.at(trace.sends[number][0])}  {delay * 1000:8.1f} мс  {trace.block(index)}"
+              + Style.RESET_ALL)
+
+    gaps = [item for item in trace.ack_gaps() if item[0] >= threshold]
+    print(f"\nОжидание подтверждения >= {threshold * 1000:.0f} мс (GRBL занят): {len(gaps)}")
+    for gap, number in sorted(gaps, reverse=True)[:top]:
+        index = trace.sends[number][1]
+        print(f"  {trace.at(trace.acks[number][0])}  {gap * 1000:8.1f} мс  {trace.block(index)}")
+
+    intervals, size = trace.planner_empty()
+    if not size:
+        print(f"\nПланировщик: нет Bf: в отчётах о состоянии ($10=2)")
+        return
+    print(f"\nПустой планировщик в Run ({size} блоков): {len(intervals)}, "
+          f"всего {sum(end - begin for begin, end in intervals):.2f} сек")
+    for begin, end in sorted(intervals, key=lambda interval: interval[0] - interval[1])[:top]:
+        last = trace.last_sent(begin)
+        block = f"после {trace.block(last[1])}" if last else ''
+        print(Fore.RED + f"  {trace.at(begin)}  {(end - begin) * 1000:8.1f} мс  {block}" + Style.RESET_ALL)
+
+
+parser = argparse.ArgumentParser(description='Streaming trace report')
+parser.add_argument('file', type=str, help='trace file (stream.py --trace)')
+parser.add_argument('-t', '--threshold', type=float, action='store', default=20, help='stall threshold, ms')
+parser.add_argument('-n', '--top', type=int, action='store', default=10, help='stalls shown')
+args = parser.parse_args()
+
+trace = Trace(*load_trace(args.file))
+show_summary(trace)
+show_stalls(trace, args.threshold / 1000, args.top)
+print()